@@ -1,25 +1,119 @@
+import os
 from datetime import timedelta
 from flask import Flask
 from flask_cors import CORS
-from models import db
+from werkzeug.middleware.proxy_fix import ProxyFix
+from database import init_db
+from cache import cache
+from hashing import password_hasher
+from auth import init_jwt
+from events import bus
+from like_buffer import like_buffer
+from compaction import compactor
+from metrics import metrics
+from ratelimit import limiter
+from timeline import init_timeline
+from serializers import init_json
+from migrations import upgrade, upgrade_db_command
 from routes import bp as main_bp
 from flask_jwt_extended import JWTManager
 
-app = Flask(__name__)
-CORS(app)
+def create_app(config=None):
+    app = Flask(__name__)
+    CORS(app)
 
-app.config["JWT_SECRET_KEY"] = "your-secret-key"  
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=72) 
+    app.config["JWT_SECRET_KEY"] = "your-secret-key"
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=72)
+    app.config['JWT_REVOCATION_CACHE_TTL'] = 60  # how long a worker may trust a cached token version
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///My_Database_user_22.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///My_Database_user_22.db')
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))  # ignored on SQLite
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-jwt = JWTManager(app)
-db.init_app(app)
+    app.config['BCRYPT_LOG_ROUNDS'] = 12  # existing hashes are upgraded on next login when this changes
+    app.config['PASSWORD_HASH_WORKERS'] = 2
+    app.config['PASSWORD_HASH_QUEUE_SIZE'] = 32
+
+    app.config['TIMELINE_FANOUT_LIMIT'] = 10000  # authors with more followers are merged into feeds at read time
+
+    app.config['SEARCH_MAX_CANDIDATES'] = 1000  # newest matches ranked per search; common terms cost no more than rare ones
+
+    app.config['JSON_PROVIDER'] = os.environ.get('JSON_PROVIDER', 'default')  # 'orjson' needs `pip install orjson`
+
+    app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')  # 'memory' (per process), 'redis' or 'null'
+    app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    app.config['CACHE_MAX_ENTRIES'] = 10000
+    app.config['CACHE_TTL'] = 300
+    app.config['CACHE_LEASE_TTL'] = 10  # seconds a reader may take to load a missed entry and still cache it
+
+    app.config['EVENT_WORKERS'] = int(os.environ.get('EVENT_WORKERS', 2))  # 0 leaves events to `flask drain-outbox`
+    app.config['EVENT_QUEUE_SIZE'] = 1000
+    app.config['EVENT_BATCH_SIZE'] = 100
+    app.config['EVENT_MAX_ATTEMPTS'] = 5
+    app.config['EVENT_RETENTION'] = 86400  # seconds processed events stay in the outbox
+    app.config['EVENT_FAILED_RETENTION'] = 7 * 86400  # seconds failed events are kept for inspection
+
+    app.config['LIKE_BUFFER_ENABLED'] = os.environ.get('LIKE_BUFFER_ENABLED', '0') == '1'  # write-behind likes for hot posts
+    app.config['LIKE_BUFFER_MAX_PENDING'] = 1000
+    app.config['LIKE_BUFFER_FLUSH_INTERVAL'] = 0.5  # seconds
+
+    app.config['COMPACTION_ENABLED'] = os.environ.get('COMPACTION_ENABLED', '1') == '1'  # 0 leaves tombstones to `flask compact`
+    app.config['COMPACTION_BATCH_SIZE'] = 500  # rows per compaction transaction
+    app.config['COMPACTION_INTERVAL'] = 30  # seconds between sweeps when no delete wakes the compactor
+
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'  # Prometheus text at /metrics
+    app.config['METRICS_SLOW_REQUEST_MS'] = int(os.environ.get('METRICS_SLOW_REQUEST_MS', 0))  # log SQL of slower requests; 0 = off
+    app.config['METRICS_MULTIPROC_DIR'] = os.environ.get('METRICS_MULTIPROC_DIR')  # lets /metrics add up every worker
+
+    app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # 'redis' shares buckets between workers
+    app.config['RATE_LIMIT_REDIS_URL'] = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+    app.config['RATE_LIMIT_MAX_KEYS'] = 100000  # buckets kept per process by the memory backend
+    app.config['RATE_LIMIT_DEFAULT'] = os.environ.get('RATE_LIMIT_DEFAULT')  # e.g. '600/minute' for endpoints not listed below
+    app.config['TRUSTED_PROXY_COUNT'] = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))  # reverse proxies in front of the app; clients are keyed by IP
+    app.config['RATE_LIMITS'] = {
+        'user.login': '10/minute',  # every attempt costs a bcrypt hash
+        'user.signup_user': '5/minute',
+        'post.create_post': '30/minute',
+        'post.create_posts_batch': '10/minute',
+        'comment.create_comment': '30/minute',
+        'comment.create_comments_batch': '10/minute',
+    }
+
+    app.config['ASYNC_DATABASE_URL'] = os.environ.get('ASYNC_DATABASE_URL')  # derived from DATABASE_URL when unset
+    app.config['ASYNC_WSGI_THREADS'] = int(os.environ.get('ASYNC_WSGI_THREADS', 16))  # threads for the views asgi.py hands to Flask
+
+    app.config.update(config or {})
+
+    proxies = app.config['TRUSTED_PROXY_COUNT']
+    if proxies:
+        # Take the client address and scheme from the X-Forwarded-* values set by our own proxies.
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+
+    init_json(app)
+    jwt = JWTManager(app)
+    init_jwt(jwt)
+    init_db(app)
+    cache.init_app(app)
+    password_hasher.init_app(app)
+    bus.init_app(app)
+    init_timeline(bus)
+    like_buffer.init_app(app)
+    compactor.init_app(app)
+    metrics.init_app(app)
+    limiter.init_app(app)
+
+    app.cli.add_command(upgrade_db_command)
+    app.register_blueprint(main_bp)
+    return app
 
-app.register_blueprint(main_bp)
 
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
-        db.create_all()
+        upgrade()
     app.run(debug=True)
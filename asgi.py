@@ -0,0 +1,5 @@
+from app import create_app
+from async_views import AsyncApp
+
+# uvicorn asgi:app --workers 4
+app = AsyncApp(create_app())
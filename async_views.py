@@ -0,0 +1,179 @@
+import io
+from urllib.parse import parse_qs
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import jsonify, request
+from flask_jwt_extended import verify_jwt_in_request
+from sqlalchemy import select
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from auth import preload_token_version, revocation_ttl, token_version_query, unverified_subject
+from cache import cache, post_key, token_version_key
+from conditional import has_validators, is_not_modified, not_modified, with_validators
+from database import create_async_db_engine
+from like_buffer import like_buffer
+from models import Post
+from pagination import InvalidCursor, page_query, parse_limit, split_page
+from routes.comment_routes import comments_etag, comments_meta_query, comments_query
+from routes.post_routes import post_etag, post_meta_query
+from serializers import comment_schema, post_schema
+
+
+async def get_posts(engine):
+    try:
+        fields = post_schema.parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+        stmt = page_query(select(*post_schema.columns(fields)).where(Post.live()), Post, request.args.get('cursor'), limit)
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    async with engine.connect() as conn:
+        rows = (await conn.execute(stmt)).all()
+    posts, next_cursor = split_page(rows, limit)
+    items = post_schema.dump_many(posts, fields)
+    if like_buffer.enabled and 'likes_count' in fields:
+        items = like_buffer.overlay_many(items)
+    return jsonify({'posts': items, 'next_cursor': next_cursor}), 200
+
+
+async def get_post(engine, post_id):
+    try:
+        fields = post_schema.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    post = cache.get(post_key(post_id))
+    if post is None:
+        async with engine.connect() as conn:
+            if has_validators():
+                meta = (await conn.execute(post_meta_query(post_id))).first()
+                if not meta:
+                    return jsonify({'error': 'Post not found'}), 404
+                likes_count = meta.likes_count + (like_buffer.pending_delta(post_id) if like_buffer.enabled else 0)
+                etag = post_etag(post_id, fields, meta.updated_at, likes_count, meta.comments_count)
+                if is_not_modified(etag):
+                    return not_modified(etag)
+            token = cache.lease(post_key(post_id))
+            row = (await conn.execute(select(*post_schema.columns()).where(Post.id == post_id, Post.live()))).first()
+        post = post_schema.dump(row) if row else None
+        cache.fill(post_key(post_id), token, post)
+    if not post:
+        return jsonify({'error': 'Post not found'}), 404
+    post = like_buffer.overlay(post)
+    etag = post_etag(post_id, fields, post['updated_at'], post['likes_count'], post['comments_count'])
+    if is_not_modified(etag):
+        return not_modified(etag)
+    return with_validators(jsonify(post_schema.project(post, fields)), etag), 200
+
+
+async def get_post_comments(engine, post_id):
+    try:
+        fields = comment_schema.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    async with engine.connect() as conn:
+        meta = (await conn.execute(comments_meta_query(post_id))).first()
+        if not meta:
+            return jsonify({'error': 'Post not found'}), 404
+        etag = comments_etag(post_id, fields, meta)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        comments = (await conn.execute(comments_query(post_id, fields))).all()
+    response = jsonify({'post_id': post_id, 'comments_count': meta.comments_count, 'comments': comment_schema.dump_many(comments, fields)})
+    return with_validators(response, etag), 200
+
+
+# Flask endpoint -> async twin. Only plain GETs are served here; ?include= and format=ndjson stay on the sync views.
+ASYNC_VIEWS = {
+    'main.post.get_posts': get_posts,
+    'main.post.get_post': get_post,
+    'main.comment.get_post_comments': get_post_comments,
+}
+SYNC_ONLY_ARGS = ('include', 'format')
+
+
+class AsyncApp:
+    # ASGI application: the read-heavy views run on the event loop with an async engine, so a slow client
+    # or a slow query holds a coroutine rather than a thread. Every other request goes to the Flask app on
+    # a bounded thread pool. Both share the Flask app's config, hooks, error handlers and cache.
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=flask_app.config['ASYNC_WSGI_THREADS'])
+        self.engine = create_async_db_engine(flask_app)
+        self.urls = flask_app.url_map.bind('localhost')
+        # The async views build their own request context instead of going through app.wsgi_app, so they
+        # apply create_app()'s X-Forwarded-* handling to the environ themselves.
+        proxies = flask_app.config['TRUSTED_PROXY_COUNT']
+        self.proxy_fix = ProxyFix(lambda environ, start_response: environ, x_for=proxies, x_proto=proxies) if proxies else None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        view, view_args = self.match(scope)
+        if view is None:
+            return await self.wsgi(scope, receive, send)
+        environ = build_environ(scope, io.BytesIO())
+        if self.proxy_fix is not None:
+            environ = self.proxy_fix(environ, None)
+        response = await self.dispatch(view, view_args, environ)
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    def match(self, scope):
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            return None, None
+        if scope['query_string'] and any(name in SYNC_ONLY_ARGS for name in parse_qs(scope['query_string'].decode('latin-1'))):
+            return None, None
+        try:
+            endpoint, view_args = self.urls.match(scope['path'], method='GET')
+        except HTTPException:
+            # 404s, 405s and trailing-slash redirects are answered by Flask.
+            return None, None
+        return ASYNC_VIEWS.get(endpoint), view_args
+
+    async def dispatch(self, view, view_args, environ):
+        # Mirrors Flask.full_dispatch_request() so before/after_request hooks (CORS, metrics) and error
+        # handlers (including flask_jwt_extended's 401s) behave exactly as on the sync path.
+        app = self.flask_app
+        with app.request_context(environ):
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        await self.prefetch_token_version()
+                        verify_jwt_in_request()
+                        rv = await view(self.engine, **view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                return app.finalize_request(rv)
+            except Exception as e:
+                return app.handle_exception(e)
+
+    async def prefetch_token_version(self):
+        # verify_jwt_in_request() checks revocation through auth.token_version(), which queries the database
+        # on a cache miss. Loading the version through the async engine first, and handing it over, keeps the
+        # check off the event loop. The claims are read without checking the signature: this only loads a row by
+        # primary key, and verify_jwt_in_request() still validates the token. A second full decode would cost
+        # more than the view.
+        user_id = unverified_subject(request.headers.get('Authorization', ''))
+        if user_id is None:
+            return
+        key = token_version_key(user_id)
+        version = cache.get(key)
+        if version is None:
+            token = cache.lease(key)
+            async with self.engine.connect() as conn:
+                version = (await conn.execute(token_version_query(user_id))).scalar()
+            cache.fill(key, token, version, ttl=revocation_ttl())
+        preload_token_version(user_id, version)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
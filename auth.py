@@ -0,0 +1,71 @@
+import base64
+import json
+from collections import namedtuple
+from flask import current_app, g
+from sqlalchemy import select
+from cache import cache, token_version_key
+from models import db, User
+
+DEFAULT_REVOCATION_TTL = 60
+
+# What handlers see as flask_jwt_extended.current_user: built from token claims, never from the database.
+Principal = namedtuple('Principal', ['id', 'email', 'first_name', 'last_name'])
+
+
+def load_principal(jwt_header, jwt_data):
+    return Principal(int(jwt_data['sub']), jwt_data.get('email'), jwt_data.get('first_name'), jwt_data.get('last_name'))
+
+
+def unverified_subject(authorization):
+    # The user id in an "Authorization: Bearer" header, read without checking the signature. Only fit for
+    # cache warming and rate-limit keys; None when there is no readable token.
+    _, _, token = authorization.partition(' ')
+    try:
+        payload = token.split('.')[1]
+        return int(json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['sub'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def token_version_query(user_id):
+    return select(User.token_version).where(User.id == user_id, User.live())
+
+
+def revocation_ttl():
+    return current_app.config.get('JWT_REVOCATION_CACHE_TTL', DEFAULT_REVOCATION_TTL)
+
+
+def preload_token_version(user_id, version):
+    # For callers that already loaded the version without blocking (the async views): token_version() then
+    # answers from it, even where the cache would not, as with CACHE_BACKEND=null or a deleted user's None.
+    g.token_versions = {user_id: version}
+
+
+def token_version(user_id):
+    # None means the user no longer exists or is deleted, which revokes every token they still hold.
+    preloaded = g.get('token_versions')
+    if preloaded is not None and user_id in preloaded:
+        return preloaded[user_id]
+
+    def load():
+        return db.session.execute(token_version_query(user_id)).scalar()
+    return cache.get_or_set(token_version_key(user_id), load, ttl=revocation_ttl())
+
+
+def is_token_revoked(jwt_header, jwt_data):
+    current = token_version(int(jwt_data['sub']))
+    return current is None or jwt_data.get('ver', 0) != current
+
+
+def revoke_tokens(user_id):
+    # Call before commit; forget_token_version() once the new version is durable.
+    User.adjust_counter(user_id, 'token_version', 1)
+
+
+def forget_token_version(user_id):
+    cache.delete(token_version_key(user_id))
+
+
+def init_jwt(jwt):
+    jwt.user_lookup_loader(load_principal)
+    jwt.token_in_blocklist_loader(is_token_revoked)
@@ -0,0 +1,37 @@
+from collections import Counter
+from flask import jsonify
+
+MAX_BATCH_ITEMS = 500
+
+CREATED = 'created'
+CONFLICT = 'conflict'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+
+
+class BatchError(ValueError):
+    pass
+
+
+def batch_items(data, key, max_items=MAX_BATCH_ITEMS):
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BatchError(f'{key} must be a non-empty list')
+    if len(items) > max_items:
+        raise BatchError(f'At most {max_items} {key} per request')
+    return items
+
+
+def is_id(value):
+    # JSON true/false arrive as bool, which is an int subclass.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_text(value):
+    return isinstance(value, str) and bool(value)
+
+
+def batch_response(results):
+    # Always 200: each item carries its own status so one bad item never aborts the rest.
+    summary = Counter(result['status'] for result in results)
+    return jsonify({'results': results, 'summary': dict(summary)}), 200
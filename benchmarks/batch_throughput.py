@@ -0,0 +1,96 @@
+"""Write throughput of the /batch endpoints against one request per item, for the same items.
+
+    python benchmarks/batch_throughput.py --items 2000 --batch-sizes 1 10 100 500
+
+Each kind (posts, comments, likes) writes --items items through its single-item endpoint, then once per
+--batch-size through its /batch endpoint, each time as a fresh user so that every run inserts the same
+rows. A batch size of 1 shows what the batch endpoint costs per item without any batching. Events stay in
+the outbox (EVENT_WORKERS=0), so the timeline fan-out they trigger is not timed.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(posts, users):
+    from sqlalchemy import insert
+    from models import db, Post, User
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {'first_name': 'bench', 'last_name': str(n), 'email': f'bench{n}@example.com', 'password': 'x',
+         'date_of_birth': date(1990, 1, 1), 'gender': 'Other', 'created_at': now, 'updated_at': now}
+        for n in range(users)
+    ])
+    db.session.execute(insert(Post), [
+        {'user_id': 1, 'title': f'post {n}', 'content': 'x' * 200, 'created_at': now + timedelta(seconds=n), 'updated_at': now}
+        for n in range(posts)
+    ])
+    db.session.commit()
+    return [{'Authorization': f'Bearer {user.generate_token()}'} for user in User.query.order_by(User.id).all()]
+
+
+def single_requests(kind, post_ids):
+    if kind == 'posts':
+        return [('/post/', {'title': f'single {n}', 'content': 'y' * 200}) for n in range(len(post_ids))]
+    if kind == 'comments':
+        return [(f'/comment/post/{post_id}', {'content': 'a comment'}) for post_id in post_ids]
+    return [(f'/like/post/{post_id}', None) for post_id in post_ids]
+
+
+def batch_requests(kind, post_ids, size):
+    chunks = [post_ids[n:n + size] for n in range(0, len(post_ids), size)]
+    if kind == 'posts':
+        return [('/post/batch', {'posts': [{'title': f'batch {n}', 'content': 'y' * 200} for n in chunk]}) for chunk in chunks]
+    if kind == 'comments':
+        return [('/comment/batch', {'comments': [{'post_id': post_id, 'content': 'a comment'} for post_id in chunk]}) for chunk in chunks]
+    return [('/like/batch', {'post_ids': chunk}) for chunk in chunks]
+
+
+def timed(client, headers, requests, items):
+    started = time.perf_counter()
+    for path, body in requests:
+        response = client.post(path, json=body, headers=headers)
+        if response.status_code not in (200, 201):
+            raise SystemExit(f'{path}: {response.status_code} {response.get_data(as_text=True)[:200]}')
+    return items / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=2000, help='items written per run')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 100, 500], help='items per /batch request (at most 500)')
+    parser.add_argument('--kinds', nargs='+', choices=('posts', 'comments', 'likes'), default=['posts', 'comments', 'likes'])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['EVENT_WORKERS'] = '0'
+        os.environ['METRICS_ENABLED'] = '0'
+        os.environ['RATE_LIMIT_ENABLED'] = '0'
+        from app import create_app
+        from migrations import upgrade
+        app = create_app()
+        runs = 1 + len(args.batch_sizes)
+        with app.app_context():
+            upgrade()
+            # Every run writes as its own user, so likes never conflict with an earlier run's.
+            users = iter(seed(args.items, runs * len(args.kinds)))
+        post_ids = list(range(1, args.items + 1))
+        client = app.test_client()
+
+        print(f'{args.items} items per run')
+        print(f"{'kind':<9} {'endpoint':<16} {'items/s':>9} {'speedup':>8}")
+        for kind in args.kinds:
+            baseline = timed(client, next(users), single_requests(kind, post_ids), args.items)
+            print(f"{kind:<9} {'single':<16} {baseline:>9.0f} {1:>7.1f}x")
+            for size in args.batch_sizes:
+                rate = timed(client, next(users), batch_requests(kind, post_ids, size), args.items)
+                print(f"{kind:<9} {f'batch of {size}':<16} {rate:>9.0f} {rate / baseline:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
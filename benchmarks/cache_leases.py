@@ -0,0 +1,170 @@
+"""Lease/fill behaviour and cost of the cache backends, and what the cache does while Redis is down.
+
+    python benchmarks/cache_leases.py
+    python benchmarks/cache_leases.py --redis-url redis://localhost:6379/15
+
+The same checks run against the memory backend and the redis backend: a leased key reads as a miss, a fill
+lands only while its lease is still in place, an invalidation between lease and fill discards the fill,
+and lease_many/fill_many do the same per key. The redis backend uses --redis-url or, without it, a
+fakeredis TCP server started in this process (pip install fakeredis lupa). fakeredis answers each
+pipelined command in its own small write, so its lease_many/fill_many timings include two delayed-ACK
+stalls of about 40 ms; time those against a real server with --redis-url. Then a Cache pointed at a port
+nothing listens on serves every read from the loader and counts the failures in info()['errors']. Exits
+non-zero when a check fails.
+"""
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+failures = []
+
+
+def check(label, ok):
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+    if not ok:
+        failures.append(label)
+
+
+def per_call(func, count):
+    started = time.perf_counter()
+    for n in range(count):
+        func(n)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def run_checks(cache):
+    from cache import post_counts_key, post_key
+    cache.clear()
+    token = cache.lease('a')
+    check('lease on a missing key returns a token', token is not None)
+    check('a second lease on the same key is refused', cache.lease('a') is None)
+    check('a leased key reads as a miss', cache.get('a') is None)
+    cache.fill('a', token, {'v': 1})
+    check('fill under the lease stores the value', cache.get('a') == {'v': 1})
+    check('a filled key cannot be leased', cache.lease('a') is None)
+
+    token = cache.lease('b')
+    cache.delete('b')
+    cache.fill('b', token, {'v': 'stale'})
+    check('fill after an invalidation is discarded', cache.get('b') is None)
+    cache.fill('c', None, {'v': 1})
+    check('fill without a lease stores nothing', cache.get('c') is None)
+
+    keys = ['m1', 'm2', 'm3']
+    tokens = cache.lease_many(keys)
+    check('lease_many leases every free key', all(tokens[key] is not None for key in keys))
+    check('lease_many refuses keys already leased', set(cache.lease_many(keys).values()) == {None})
+    cache.delete('m2')
+    cache.fill_many(tokens, {key: {'k': key} for key in keys})
+    check('fill_many skips the key invalidated meanwhile', cache.get_many(keys) == {'m1': {'k': 'm1'}, 'm3': {'k': 'm3'}})
+
+    loads = []
+    value = cache.get_or_set('g', lambda: loads.append(1) or {'v': 'loaded'})
+    check('get_or_set loads and caches a miss', value == {'v': 'loaded'} and cache.get('g') == {'v': 'loaded'})
+    cache.get_or_set('g', lambda: loads.append(1) or {'v': 'again'})
+    check('get_or_set serves a hit without loading', len(loads) == 1)
+
+    cache.set(post_key(7), {'id': 7})
+    cache.set(post_counts_key(7), {'likes_count': 1})
+    cache.invalidate_post(7)
+    check('invalidate_post drops the post and its counts', cache.get_many([post_key(7), post_counts_key(7)]) == {})
+    cache.clear()
+
+
+def run_timings(cache, count):
+    cache.clear()
+    cache.set('hot', {'id': 1, 'title': 'x' * 100})
+    print(f"  get, hit:          {per_call(lambda n: cache.get('hot'), count):8.1f} us")
+    print(f"  lease + fill:      {per_call(lambda n: cache.fill(f'k{n}', cache.lease(f'k{n}'), {'id': n}), count):8.1f} us")
+    keys = [f'many{n}' for n in range(20)]
+
+    def many(n):
+        cache.delete(*keys)
+        cache.fill_many(cache.lease_many(keys), {key: {'id': key} for key in keys})
+    print(f"  20 x lease/fill:   {per_call(many, max(1, count // 20)):8.1f} us  (lease_many + fill_many)")
+    cache.clear()
+
+
+def redis_cache(url):
+    import redis
+    from cache import FILL_SCRIPT, RedisCache
+    server = None
+    if url is None:
+        try:
+            from fakeredis import TcpFakeServer
+        except ImportError:
+            return None, None
+        server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'redis://%s:%d/0' % server.server_address
+        # fakeredis drops RESP3 connections on a NOSCRIPT reply instead of letting redis-py load the script.
+        redis.Redis(*server.server_address).script_load(FILL_SCRIPT)
+    return RedisCache(redis.Redis.from_url(url), prefix='cache-bench:'), server
+
+
+def facade(backend):
+    from cache import Cache
+    cache = Cache()
+    cache.backend = backend
+    return cache
+
+
+def run_outage():
+    import redis
+    from cache import RedisCache
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    cache = facade(RedisCache(redis.Redis(port=port, socket_connect_timeout=0.2)))
+    logging.getLogger('cache').disabled = True
+    try:
+        value = cache.get_or_set('token_version:1', lambda: 3)
+        check('get_or_set falls back to the loader', value == 3)
+        cache.invalidate_user(1)
+        check('lease_many degrades to no leases', set(cache.lease_many(['a', 'b']).values()) == {None})
+        info = cache.info()
+        check(f"failures are counted in info() (errors={info.get('errors')})", info.get('errors', 0) >= 4)
+    finally:
+        logging.getLogger('cache').disabled = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--redis-url', help='a Redis server to use instead of the in-process stand-in')
+    parser.add_argument('--ops', type=int, default=2000, help='operations per timing')
+    args = parser.parse_args()
+    from cache import LRUCache
+    print('memory')
+    memory = facade(LRUCache())
+    run_checks(memory)
+    run_timings(memory, args.ops * 10)
+
+    backend, server = redis_cache(args.redis_url)
+    if backend is None:
+        print('redis: skipped, pass --redis-url or pip install fakeredis lupa')
+    else:
+        try:
+            print(f"redis ({'fakeredis' if server else args.redis_url})")
+            shared = facade(backend)
+            run_checks(shared)
+            run_timings(shared, args.ops)
+            check('no backend errors', shared.info()['errors'] == 0)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+    print('redis unreachable')
+    run_outage()
+    if failures:
+        raise SystemExit(f'{len(failures)} check(s) failed')
+
+
+if __name__ == '__main__':
+    main()
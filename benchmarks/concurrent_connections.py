@@ -0,0 +1,187 @@
+"""Read throughput and latency with 1,000 open connections: gunicorn (wsgi.py) against uvicorn (asgi.py).
+
+    python benchmarks/concurrent_connections.py --connections 1000 --slow 0 --duration 20
+    python benchmarks/concurrent_connections.py --connections 1000 --slow 200 --duration 20
+
+Every connection is a keep-alive client that loops over GET /post/, GET /post/<id> and GET /comment/post/<id>
+(Zipf-popular posts from the benchmarks/dataset.py data). The --slow clients send each request a few bytes
+at a time over --slow-seconds, like mobile clients on bad networks. Latency and req/s are reported for the
+fast clients only, so the numbers show how much the slow ones get in their way.
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dataset import ensure_dataset, parse_scale, popularity, sample
+
+REQUEST_TIMEOUT = 30
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(server, port, workers, threads):
+    if server == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+                '--workers', str(workers), '--threads', str(threads), '--worker-connections', '2000', 'wsgi:app']
+    return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port), '--workers', str(workers),
+            '--backlog', '4096', '--log-level', 'warning', '--no-access-log']
+
+
+def wait_until_serving(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited during startup')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1) as conn:
+                conn.sendall(b'GET /post/1 HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n')
+                if conn.recv(64).startswith(b'HTTP/1.1'):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def build_requests(manifest, tokens, count, seed):
+    rng = random.Random(seed)
+    ranked = popularity(manifest['counts']['posts'], manifest['seed'])
+    hot = sample(rng, ranked, count)
+    paths = ('/post/?limit=20', '/post/{}', '/comment/post/{}')
+    return [
+        (f'GET {paths[n % 3].format(post_id)} HTTP/1.1\r\nHost: bench\r\nAuthorization: Bearer {rng.choice(tokens)}\r\n\r\n').encode('ascii')
+        for n, post_id in enumerate(hot)
+    ]
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head[9:12])
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def client(port, requests, offset, stop_at, slow_seconds, results):
+    reader = writer = None
+    n = offset
+    while time.monotonic() < stop_at:
+        request = requests[n % len(requests)]
+        n += 1
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), REQUEST_TIMEOUT)
+            if slow_seconds:
+                pieces = 10
+                step = len(request) // pieces + 1
+                for start in range(0, len(request), step):
+                    writer.write(request[start:start + step])
+                    await writer.drain()
+                    await asyncio.sleep(slow_seconds / pieces)
+            else:
+                writer.write(request)
+            status = await asyncio.wait_for(read_response(reader), REQUEST_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            results['errors'] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.1)
+            continue
+        if time.monotonic() <= stop_at:
+            results['latencies'].append(time.perf_counter() - started)
+            results['statuses'][status] = results['statuses'].get(status, 0) + 1
+    if writer is not None:
+        writer.close()
+
+
+async def load(port, requests, connections, slow, duration, slow_seconds):
+    fast = {'latencies': [], 'statuses': {}, 'errors': 0}
+    slow_results = {'latencies': [], 'statuses': {}, 'errors': 0}
+    stop_at = time.monotonic() + duration
+    tasks = [client(port, requests, n * 7, stop_at, 0, fast) for n in range(connections - slow)]
+    tasks += [client(port, requests, n * 11, stop_at, slow_seconds, slow_results) for n in range(slow)]
+    started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    return fast, slow_results, time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='10k', help='dataset size, see benchmarks/dataset.py')
+    parser.add_argument('--db', help='SQLite file for the dataset (default: a per-scale file in the temp dir)')
+    parser.add_argument('--servers', nargs='+', choices=('gunicorn', 'uvicorn'), default=('gunicorn', 'uvicorn'))
+    parser.add_argument('--workers', type=int, default=2, help='server processes for both servers')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker')
+    parser.add_argument('--connections', type=int, default=1000, help='concurrent client connections')
+    parser.add_argument('--slow', type=int, default=0, help='how many of the connections are slow clients')
+    parser.add_argument('--slow-seconds', type=float, default=5, help='time a slow client takes to send one request')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load per server')
+    args = parser.parse_args()
+
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    db_path = os.path.abspath(args.db or os.path.join(tempfile.gettempdir(), f'social-bench-{args.scale}-42.db'))
+    # Read-only load, so a separate memory cache per worker cannot serve anything stale here.
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', EVENT_WORKERS='0', METRICS_ENABLED='0', CACHE_BACKEND='memory')
+    os.environ.update(env)
+    from app import create_app
+    from models import User
+
+    app = create_app()
+    manifest = ensure_dataset(app, db_path, parse_scale(args.scale), 42)
+    with app.app_context():
+        tokens = [user.generate_token() for user in User.query.order_by(User.id).limit(200)]
+    requests = build_requests(manifest, tokens, 5000, 7)
+
+    rows = []
+    for server in args.servers:
+        port = free_port()
+        process = subprocess.Popen(server_command(server, port, args.workers, args.threads), cwd=ROOT, env=env)
+        try:
+            wait_until_serving(port, process)
+            fast, slow, elapsed = asyncio.run(load(port, requests, args.connections, args.slow, args.duration, args.slow_seconds))
+        finally:
+            process.terminate()
+            process.wait()
+        rows.append((server, fast, slow, elapsed))
+
+    print(f'{args.connections} connections ({args.slow} slow), {args.workers} workers, {args.duration:.0f}s, {os.cpu_count()} CPUs')
+    print(f"{'server':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'non-200':>8} {'errors':>7} {'slow done':>10}")
+    for server, fast, slow, elapsed in rows:
+        latencies = fast['latencies']
+        non_ok = sum(count for status, count in fast['statuses'].items() if status not in (200, 304))
+        print(f"{server:<10} {len(latencies) / elapsed:>8.0f} {percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.95):>8.1f} "
+              f"{percentile(latencies, 0.99):>8.1f} {non_ok:>8} {fast['errors']:>7} {len(slow['latencies']):>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""Synthetic dataset for the benchmark harness: users, posts, follows, comments and likes with power-law popularity.
+
+    python benchmarks/dataset.py --db /tmp/bench-10k.db --scale 10k
+
+A few posts and authors get most of the likes, comments and followers (Zipf), which is what makes hot
+rows, long comment threads and celebrity fan-out show up in benchmarks. The same --seed always builds
+the same rows, and a <db>.json manifest next to the database records what was generated.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Approximate total rows per scale; the mix below splits them across tables.
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+MIX = {'users': 0.01, 'posts': 0.10, 'follows': 0.09, 'comments': 0.30, 'likes': 0.50}
+CHUNK = 20_000
+ZIPF_EXPONENT = 1.1
+PASSWORD = 'benchmark-password'
+WORDS = ('flask', 'python', 'database', 'sqlite', 'cache', 'timeline', 'search', 'travel', 'coffee', 'music',
+         'football', 'recipe', 'garden', 'photo', 'weekend', 'concert', 'startup', 'climbing', 'movie', 'book')
+
+
+def parse_scale(value):
+    value = value.lower()
+    if value in SCALES:
+        return SCALES[value]
+    return int(value)
+
+
+def counts_for(rows):
+    counts = {table: int(rows * share) for table, share in MIX.items()}
+    counts['users'] = max(counts['users'], 50)
+    counts['posts'] = max(counts['posts'], 100)
+    return counts
+
+
+def email_for(user_id):
+    return f'user{user_id}@bench.example'
+
+
+def popularity(count, seed):
+    # Ids ordered from most to least popular, and cumulative Zipf weights to sample them with.
+    # Shuffled so popularity does not line up with age (id order).
+    ids = list(range(1, count + 1))
+    random.Random(f'{seed}:{count}').shuffle(ids)
+    cum_weights = list(accumulate(1 / (rank ** ZIPF_EXPONENT) for rank in range(1, count + 1)))
+    return ids, cum_weights
+
+
+def sample(rng, ranked, k):
+    ids, cum_weights = ranked
+    return rng.choices(ids, cum_weights=cum_weights, k=k)
+
+
+def text(rng, words):
+    return ' '.join(rng.choices(WORDS, weights=range(len(WORDS), 0, -1), k=words))
+
+
+def insert_ignore(conn, table, rows):
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        from sqlalchemy.dialects import postgresql, sqlite
+        dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        conn.execute(dialect_insert(table).on_conflict_do_nothing(), rows)
+    else:
+        conn.execute(table.insert(), rows)
+
+
+def chunks(total):
+    for start in range(0, total, CHUNK):
+        yield start, min(CHUNK, total - start)
+
+
+def seed(rows, random_seed=42, log=print):
+    # Must run inside an app context on an empty database.
+    from sqlalchemy import text as sql
+    from hashing import hash_password, password_hasher
+    from migrations import upgrade
+    from models import db, Comment, Follow, Like, Post, User
+    from timeline import BACKFILL_POSTS, fanout_limit
+
+    counts = counts_for(rows)
+    rng = random.Random(random_seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(days=365)
+    password = hash_password(PASSWORD, password_hasher.rounds)
+    users_ranked = popularity(counts['users'], random_seed)
+    posts_ranked = popularity(counts['posts'], random_seed)
+    db.create_all()
+    started = time.perf_counter()
+
+    with db.engine.begin() as conn:
+        for offset, size in chunks(counts['users']):
+            conn.execute(User.__table__.insert(), [{
+                'id': n, 'first_name': f'User{n}', 'last_name': 'Bench', 'email': email_for(n), 'password': password,
+                'date_of_birth': date(1990, 1, 1), 'gender': 'Other', 'created_at': start, 'updated_at': start,
+            } for n in range(offset + 1, offset + size + 1)])
+    log(f"users: {counts['users']}")
+
+    # Posts are spread evenly over the year in id order; prolific authors post more (Zipf over users).
+    step = (now - start) / counts['posts']
+    with db.engine.begin() as conn:
+        for offset, size in chunks(counts['posts']):
+            authors = sample(rng, users_ranked, size)
+            conn.execute(Post.__table__.insert(), [{
+                'id': n, 'user_id': author, 'title': text(rng, 4), 'content': text(rng, 40),
+                'created_at': start + step * n, 'updated_at': start + step * n,
+            } for n, author in zip(range(offset + 1, offset + size + 1), authors)])
+    log(f"posts: {counts['posts']}")
+
+    with db.engine.begin() as conn:
+        for _, size in chunks(counts['follows']):
+            followed = sample(rng, users_ranked, size)
+            pairs = [(rng.randint(1, counts['users']), user_id) for user_id in followed]
+            insert_ignore(conn, Follow.__table__, [
+                {'follower_id': follower_id, 'followed_id': followed_id, 'created_at': start}
+                for follower_id, followed_id in pairs if follower_id != followed_id
+            ])
+    log(f"follows: ~{counts['follows']}")
+
+    with db.engine.begin() as conn:
+        for _, size in chunks(counts['comments']):
+            targets = sample(rng, posts_ranked, size)
+            conn.execute(Comment.__table__.insert(), [{
+                'post_id': post_id, 'user_id': rng.randint(1, counts['users']), 'content': text(rng, 12),
+                'created_at': now - timedelta(seconds=rng.randint(0, 365 * 86400)), 'updated_at': now,
+            } for post_id in targets])
+    log(f"comments: {counts['comments']}")
+
+    with db.engine.begin() as conn:
+        for _, size in chunks(counts['likes']):
+            targets = sample(rng, posts_ranked, size)
+            insert_ignore(conn, Like.__table__, [
+                {'post_id': post_id, 'user_id': rng.randint(1, counts['users']), 'created_at': now} for post_id in targets
+            ])
+    log(f"likes: ~{counts['likes']}")
+
+    # Denormalized counters and materialized timelines, exactly as the write paths would have left them.
+    with db.engine.begin() as conn:
+        conn.execute(sql('UPDATE posts SET likes_count = (SELECT count(*) FROM likes WHERE likes.post_id = posts.id), '
+                         'comments_count = (SELECT count(*) FROM comments WHERE comments.post_id = posts.id)'))
+        conn.execute(sql('UPDATE users SET followers_count = (SELECT count(*) FROM follows WHERE follows.followed_id = users.id), '
+                         'following_count = (SELECT count(*) FROM follows WHERE follows.follower_id = users.id)'))
+        conn.execute(sql('INSERT INTO timeline_entries (user_id, post_id, author_id, created_at) '
+                         'SELECT user_id, id, user_id, created_at FROM posts'))
+        # Seeded follows count as made after the posts, so each one carries follow()'s backfill.
+        conn.execute(sql('INSERT INTO timeline_entries (user_id, post_id, author_id, created_at) '
+                         'SELECT follows.follower_id, recent.id, recent.user_id, recent.created_at FROM follows '
+                         'JOIN (SELECT id, user_id, created_at, row_number() OVER (PARTITION BY user_id ORDER BY created_at DESC, id DESC) AS position '
+                         'FROM posts) AS recent ON recent.user_id = follows.followed_id '
+                         'JOIN users ON users.id = follows.followed_id '
+                         'WHERE recent.position <= :backfill AND users.followers_count < :limit'),
+                     {'backfill': BACKFILL_POSTS, 'limit': fanout_limit()})
+    log('counters and timelines rebuilt')
+
+    # Creates the indexes and fills the search index from the seeded rows.
+    upgrade()
+    with db.engine.connect() as conn:
+        totals = {table: conn.execute(sql(f'SELECT count(*) FROM {table}')).scalar()
+                  for table in ('users', 'posts', 'follows', 'comments', 'likes', 'timeline_entries')}
+    return {
+        'scale_rows': rows,
+        'seed': random_seed,
+        'password': PASSWORD,
+        'counts': totals,
+        'seconds': round(time.perf_counter() - started, 1),
+        'created_at': now.isoformat(),
+    }
+
+
+def manifest_path(db_path):
+    return db_path + '.json'
+
+
+def load_manifest(db_path):
+    with open(manifest_path(db_path)) as f:
+        return json.load(f)
+
+
+def ensure_dataset(app, db_path, rows, random_seed=42, log=print):
+    # Reuses a database seeded with the same parameters; anything else is rebuilt from scratch.
+    if os.path.exists(db_path) and os.path.exists(manifest_path(db_path)):
+        manifest = load_manifest(db_path)
+        if manifest['scale_rows'] == rows and manifest['seed'] == random_seed:
+            return manifest
+    for path in (db_path, db_path + '-wal', db_path + '-shm', manifest_path(db_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    with app.app_context():
+        manifest = seed(rows, random_seed, log=log)
+    with open(manifest_path(db_path), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='SQLite file to create')
+    parser.add_argument('--scale', default='10k', help=f"total rows: {', '.join(SCALES)} or a number")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    db_path = os.path.abspath(args.db)
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    from app import create_app
+    app = create_app()
+    manifest = ensure_dataset(app, db_path, parse_scale(args.scale), args.seed)
+    print(json.dumps(manifest['counts'], indent=2), f"in {manifest['seconds']}s")
+
+
+if __name__ == '__main__':
+    main()
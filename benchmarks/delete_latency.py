@@ -0,0 +1,165 @@
+"""Account deletion: request latency and how long compaction holds the write lock.
+
+    python benchmarks/delete_latency.py --posts 100 1000 10000
+    python benchmarks/delete_latency.py --posts 10000 --batch-sizes 500 1000000
+
+A user with --posts posts (each with --comments comments and --likes likes from other users, and the
+user's own likes, comments and follows) deletes their account through DELETE /user/profile. The compactor
+then removes everything while another thread keeps commenting on an unrelated post; its latency shows how
+long other writers wait. A batch size larger than the data approximates the old inline delete, where
+one transaction removed everything. Each run uses a fresh SQLite file in its own process.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+OTHER_USERS = 200
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def seed(posts, comments, likes):
+    # User 1 is deleted; users 2.. comment, like and follow. Post 1 belongs to user 2 and takes the writer load.
+    from sqlalchemy import insert
+    from models import db, Comment, Follow, Like, Post, User
+    from search import ensure_search_schema
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {'first_name': 'bench', 'last_name': str(n), 'email': f'bench{n}@example.com', 'password': 'x',
+         'date_of_birth': date(1990, 1, 1), 'gender': 'Other', 'created_at': now, 'updated_at': now}
+        for n in range(OTHER_USERS + 1)
+    ])
+    db.session.execute(insert(Post), [{'user_id': 2, 'title': 'other', 'content': 'busy post', 'created_at': now, 'updated_at': now}])
+    db.session.execute(insert(Post), [
+        {'user_id': 1, 'title': f'post {n}', 'content': 'content to delete', 'created_at': now, 'updated_at': now,
+         'comments_count': comments, 'likes_count': likes}
+        for n in range(posts)
+    ])
+    post_ids = range(2, posts + 2)
+    db.session.execute(insert(Comment), [
+        {'post_id': post_id, 'user_id': 2 + (post_id + n) % OTHER_USERS, 'content': 'a comment', 'created_at': now, 'updated_at': now}
+        for post_id in post_ids for n in range(comments)
+    ])
+    db.session.execute(insert(Like), [
+        {'post_id': post_id, 'user_id': 2 + (post_id + n) % OTHER_USERS, 'created_at': now}
+        for post_id in post_ids for n in range(min(likes, OTHER_USERS))
+    ])
+    db.session.execute(insert(Comment), [{'post_id': 1, 'user_id': 1, 'content': 'mine', 'created_at': now, 'updated_at': now}])
+    db.session.execute(insert(Like), [{'post_id': 1, 'user_id': 1, 'created_at': now}])
+    db.session.execute(insert(Follow), [{'follower_id': n, 'followed_id': 1, 'created_at': now} for n in range(2, OTHER_USERS + 2)])
+    db.session.commit()
+    with db.engine.begin() as conn:
+        # The seed bypasses the write paths, so build the search index from the rows.
+        conn.exec_driver_sql('DROP TABLE IF EXISTS posts_fts')
+        conn.exec_driver_sql('DROP TABLE IF EXISTS comments_fts')
+        ensure_search_schema(conn)
+
+
+def run(posts, comments, likes, batch_size):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['EVENT_WORKERS'] = '0'
+        os.environ['METRICS_ENABLED'] = '0'
+        os.environ['COMPACTION_ENABLED'] = '0'
+        os.environ['RATE_LIMIT_ENABLED'] = '0'
+        from sqlalchemy import func, select
+        from app import create_app
+        from compaction import compactor
+        from migrations import upgrade
+        from models import db, Comment, Like, Post, User
+        app = create_app({'COMPACTION_BATCH_SIZE': batch_size})
+
+        with app.app_context():
+            upgrade()
+            seed(posts, comments, likes)
+            victim, writer = [user.generate_token() for user in User.query.filter(User.id.in_((1, 2))).order_by(User.id)]
+
+        client = app.test_client()
+        started = time.perf_counter()
+        status = client.delete('/user/profile', headers={'Authorization': f'Bearer {victim}'}).status_code
+        delete_ms = (time.perf_counter() - started) * 1000
+
+        latencies = []
+        done = threading.Event()
+
+        def write_load():
+            writer_client = app.test_client()
+            headers = {'Authorization': f'Bearer {writer}'}
+            while not done.is_set():
+                began = time.perf_counter()
+                writer_client.post('/comment/post/1', json={'content': 'still here'}, headers=headers)
+                latencies.append(time.perf_counter() - began)
+
+        thread = threading.Thread(target=write_load)
+        thread.start()
+        time.sleep(0.2)
+        with app.app_context():
+            started = time.perf_counter()
+            rows = compactor.compact()
+            compact_s = time.perf_counter() - started
+            done.set()
+            thread.join()
+            stats = compactor.info()
+            remaining = {
+                'users': db.session.execute(select(func.count()).select_from(User).where(User.id == 1)).scalar(),
+                'posts': db.session.execute(select(func.count()).select_from(Post).where(Post.user_id == 1)).scalar(),
+                'comments': db.session.execute(select(func.count()).select_from(Comment).where(Comment.user_id == 1)).scalar(),
+                'likes': db.session.execute(select(func.count()).select_from(Like).where(Like.user_id == 1)).scalar(),
+            }
+        return {
+            'posts': posts,
+            'batch_size': batch_size,
+            'delete_status': status,
+            'delete_ms': round(delete_ms, 2),
+            'rows': rows,
+            'compact_s': round(compact_s, 2),
+            'longest_batch_ms': stats['longest_batch_ms'],
+            'writes': len(latencies),
+            'write_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'write_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'write_max_ms': round(max(latencies, default=0) * 1000, 2),
+            'clean': remaining == {'users': 0, 'posts': 0, 'comments': 0, 'likes': 0},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, nargs='+', default=[100, 1000, 10000], help='posts owned by the deleted user')
+    parser.add_argument('--comments', type=int, default=5, help='comments per post')
+    parser.add_argument('--likes', type=int, default=5, help='likes per post')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[500], help='COMPACTION_BATCH_SIZE values to compare')
+    parser.add_argument('--run', type=int, nargs=2, metavar=('POSTS', 'BATCH_SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        print(json.dumps(run(args.run[0], args.comments, args.likes, args.run[1])))
+        return
+    print(f"{'posts':>7} {'batch':>8} {'DELETE ms':>10} {'rows':>7} {'compact s':>10} {'longest tx ms':>14} "
+          f"{'write p50':>10} {'write p99':>10} {'write max':>10} {'clean':>6}")
+    for posts in args.posts:
+        for batch_size in args.batch_sizes:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run', str(posts), str(batch_size),
+                 '--comments', str(args.comments), '--likes', str(args.likes)],
+                check=True, capture_output=True, text=True, cwd=ROOT,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{result['posts']:>7} {result['batch_size']:>8} {result['delete_ms']:>10} {result['rows']:>7} {result['compact_s']:>10} "
+                  f"{result['longest_batch_ms']:>14} {result['write_p50_ms']:>10} {result['write_p99_ms']:>10} {result['write_max_ms']:>10} {str(result['clean']):>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,562 @@
+"""Benchmark harness: drives every blueprint of the real app and reports req/s, latency percentiles and SQL per endpoint.
+
+    python benchmarks/harness.py run --scale 10k --mode client --output results.json
+    python benchmarks/harness.py run --scale 1m --mode server --workers 4 --concurrency 16 --output results.json
+    python benchmarks/harness.py compare baseline.json results.json --max-regression 10
+
+`run` seeds (or reuses) a synthetic dataset from benchmarks/dataset.py, then sends a fixed number of
+requests to each endpoint from --concurrency threads. `--mode client` goes through Flask's test client
+in this process. `--mode server` forks --workers processes that serve one shared listening socket
+(a pre-fork WSGI server built on werkzeug) and talks plain HTTP/1.1 to it. Hot posts are picked with
+the same Zipf popularity the dataset was seeded with. `compare` exits non-zero when an endpoint got
+slower or issues more SQL than in the baseline run.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import Counter, namedtuple
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dataset import PASSWORD, WORDS, email_for, ensure_dataset, parse_scale, popularity, sample
+
+SQL_HEADER = 'X-Bench-SQL'
+TOKEN_USERS = 200
+BATCH_LIMIT = 500
+EDITED_ROWS = 20  # rows the PUT and PATCH scenarios keep rewriting
+
+# name, method, path(ctx), body(ctx) or None, accepted statuses, share of --requests.
+# A scenario that has to act on rows of its own has a claim(ctx) returning (headers, value); path and body
+# are then called as path(ctx, value). setup(ctx, app, count) fills the pools it claims from before it runs.
+Scenario = namedtuple('Scenario', 'name method path body expected share claim setup', defaults=(None, None))
+
+
+def own(pool):
+    # The same rows are edited over and over.
+    return lambda ctx: ctx.rng.choice(ctx.pools[pool])
+
+
+def take(pool):
+    # Every request uses up a row: deletes, unlikes, unfollows.
+    return lambda ctx: ctx.pools[pool].pop()
+
+
+def token_user(ctx):
+    user_id, token = ctx.rng.choice(ctx.token_users)
+    return {'Authorization': f'Bearer {token}'}, user_id
+
+
+def profile(ctx, user_id):
+    return {'first_name': ctx.words(1), 'last_name': 'Bench', 'email': email_for(user_id), 'date_of_birth': '1990-01-01', 'gender': 'Other'}
+
+
+def provision_posts(pool, limit=None):
+    def setup(ctx, app, count):
+        headers, _ = token_user(ctx)
+        ids = []
+        for start in range(0, min(count, limit or count), BATCH_LIMIT):
+            body = {'posts': [{'title': ctx.words(4), 'content': ctx.words(40)} for _ in range(min(BATCH_LIMIT, count - start))]}
+            ids += [result['id'] for result in ctx.provision(app, '/post/batch', headers, body)]
+        ctx.pools[pool] = [(headers, post_id) for post_id in ids]
+    return setup
+
+
+def provision_comments(pool, limit=None):
+    def setup(ctx, app, count):
+        headers, _ = token_user(ctx)
+        ids = []
+        for start in range(0, min(count, limit or count), BATCH_LIMIT):
+            body = {'comments': [{'post_id': post_id, 'content': ctx.words(12)} for post_id in ctx.hot_posts(min(BATCH_LIMIT, count - start))]}
+            ids += [result['id'] for result in ctx.provision(app, '/comment/batch', headers, body)]
+        ctx.pools[pool] = [(headers, comment_id) for comment_id in ids]
+    return setup
+
+
+def provision_likes(ctx, app, count):
+    # Likes by several users on posts they had not liked yet; a conflict just means the like already exists.
+    items = []
+    while len(items) < count:
+        headers, _ = token_user(ctx)
+        post_ids = ctx.rng.sample(range(1, ctx.posts + 1), min(BATCH_LIMIT, ctx.posts))
+        items += [(headers, result['post_id']) for result in ctx.provision(app, '/like/batch', headers, {'post_ids': post_ids})]
+    ctx.pools['likes'] = items[:count]
+
+
+def follow_pairs(ctx, app, count):
+    from models import Follow, db
+    with app.app_context():
+        taken = set(db.session.execute(db.select(Follow.follower_id, Follow.followed_id).where(Follow.follower_id.in_([user_id for user_id, _ in ctx.token_users]))).all())
+    pairs = set()
+    while len(pairs) < count:
+        follower, _ = ctx.rng.choice(ctx.token_users)
+        followed = ctx.user_id()
+        if follower != followed and (follower, followed) not in taken:
+            pairs.add((follower, followed))
+    tokens = dict(ctx.token_users)
+    return [({'Authorization': f'Bearer {tokens[follower]}'}, followed) for follower, followed in pairs]
+
+
+def provision_follows(ctx, app, count):
+    ctx.pools['follow'] = follow_pairs(ctx, app, count)
+
+
+def provision_unfollows(ctx, app, count):
+    pairs = follow_pairs(ctx, app, count)
+    client = app.test_client()
+    for headers, followed in pairs:
+        client.post(f'/user/{followed}/follow', headers=headers).close()
+    ctx.pools['unfollow'] = pairs
+
+
+def provision_accounts(pool):
+    # Throwaway accounts for requests that revoke or delete the caller; they share the seeded password hash.
+    def setup(ctx, app, count):
+        from sqlalchemy import insert
+        from models import User, db
+        with app.app_context():
+            password = db.session.get(User, 1).password
+            now = datetime.utcnow()
+            emails = [f'{pool}-{ctx.unique()}@bench.example' for _ in range(count)]
+            db.session.execute(insert(User), [{'first_name': 'Throwaway', 'last_name': 'Bench', 'email': email, 'password': password,
+                                               'date_of_birth': date(1990, 1, 1), 'gender': 'Other', 'created_at': now, 'updated_at': now} for email in emails])
+            db.session.commit()
+            users = User.query.filter(User.email.in_(emails)).all()
+            ctx.pools[pool] = [({'Authorization': f'Bearer {user.generate_token()}'}, user.id) for user in users]
+    return setup
+
+
+SCENARIOS = (
+    # user
+    Scenario('user.signup_user', 'POST', lambda ctx: '/user/signup',
+             lambda ctx: {'first_name': 'New', 'last_name': 'Bench', 'email': f'signup-{ctx.unique()}@bench.example', 'password': PASSWORD,
+                          'date_of_birth': '1990-01-01', 'gender': 'Other'}, {201}, 0.05),
+    Scenario('user.login', 'POST', lambda ctx: '/user/login',
+             lambda ctx: {'email': email_for(ctx.user_id()), 'password': PASSWORD}, {200}, 0.05),
+    Scenario('user.get_current_user', 'GET', lambda ctx: '/user/profile', None, {200}, 1),
+    Scenario('user.update_user', 'PUT', lambda ctx, user_id: '/user/profile', profile, {200}, 0.25, token_user),
+    Scenario('user.patch_user', 'PATCH', lambda ctx, user_id: '/user/profile', lambda ctx, user_id: {'first_name': ctx.words(1)}, {200}, 0.25, token_user),
+    Scenario('user.follow_user', 'POST', lambda ctx, user_id: f'/user/{user_id}/follow', None, {201}, 0.25, take('follow'), provision_follows),
+    Scenario('user.unfollow_user', 'DELETE', lambda ctx, user_id: f'/user/{user_id}/follow', None, {200}, 0.25, take('unfollow'), provision_unfollows),
+    Scenario('user.logout_all', 'POST', lambda ctx, user_id: '/user/logout-all', None, {200}, 0.1, take('logout'), provision_accounts('logout')),
+    Scenario('user.delete_user', 'DELETE', lambda ctx, user_id: '/user/profile', None, {200}, 0.1, take('retire'), provision_accounts('retire')),
+    # post
+    Scenario('post.get_posts', 'GET', lambda ctx: '/post/?limit=20', None, {200}, 1),
+    Scenario('post.get_posts[include]', 'GET', lambda ctx: '/post/?limit=20&include=author,comments,like_count,liked_by_me', None, {200}, 1),
+    Scenario('post.get_user_posts', 'GET', lambda ctx: '/post/my-posts?limit=20', None, {200}, 1),
+    Scenario('post.get_home_feed', 'GET', lambda ctx: '/post/feed?limit=20', None, {200}, 1),
+    Scenario('post.get_post', 'GET', lambda ctx: f'/post/{ctx.hot_post()}', None, {200}, 1),
+    Scenario('post.get_post_counts', 'GET', lambda ctx: '/post/counts?ids=' + ','.join(map(str, ctx.hot_posts(20))), None, {200}, 1),
+    Scenario('post.create_post', 'POST', lambda ctx: '/post/',
+             lambda ctx: {'title': ctx.words(4), 'content': ctx.words(40)}, {201}, 0.25),
+    Scenario('post.create_posts_batch', 'POST', lambda ctx: '/post/batch',
+             lambda ctx: {'posts': [{'title': ctx.words(4), 'content': ctx.words(40)} for _ in range(20)]}, {200}, 0.1),
+    Scenario('post.update_post', 'PUT', lambda ctx, post_id: f'/post/{post_id}',
+             lambda ctx, post_id: {'title': ctx.words(4), 'content': ctx.words(40)}, {200}, 0.25, own('edit_posts'), provision_posts('edit_posts', EDITED_ROWS)),
+    Scenario('post.patch_post', 'PATCH', lambda ctx, post_id: f'/post/{post_id}',
+             lambda ctx, post_id: {'title': ctx.words(4)}, {200}, 0.25, own('edit_posts'), provision_posts('edit_posts', EDITED_ROWS)),
+    Scenario('post.delete_post', 'DELETE', lambda ctx, post_id: f'/post/{post_id}', None, {200}, 0.25, take('doomed_posts'), provision_posts('doomed_posts')),
+    # comment
+    Scenario('comment.get_post_comments', 'GET', lambda ctx: f'/comment/post/{ctx.hot_post()}', None, {200}, 1),
+    Scenario('comment.create_comment', 'POST', lambda ctx: f'/comment/post/{ctx.hot_post()}',
+             lambda ctx: {'content': ctx.words(12)}, {201}, 0.25),
+    Scenario('comment.create_comments_batch', 'POST', lambda ctx: '/comment/batch',
+             lambda ctx: {'comments': [{'post_id': post_id, 'content': ctx.words(12)} for post_id in ctx.hot_posts(20)]}, {200}, 0.1),
+    Scenario('comment.update_comment[PUT]', 'PUT', lambda ctx, comment_id: f'/comment/update/{comment_id}',
+             lambda ctx, comment_id: {'content': ctx.words(12)}, {200}, 0.25, own('edit_comments'), provision_comments('edit_comments', EDITED_ROWS)),
+    Scenario('comment.update_comment[PATCH]', 'PATCH', lambda ctx, comment_id: f'/comment/update/{comment_id}',
+             lambda ctx, comment_id: {'content': ctx.words(12)}, {200}, 0.25, own('edit_comments'), provision_comments('edit_comments', EDITED_ROWS)),
+    Scenario('comment.delete_comment', 'DELETE', lambda ctx, comment_id: f'/comment/{comment_id}', None, {200}, 0.25,
+             take('doomed_comments'), provision_comments('doomed_comments')),
+    # like
+    Scenario('like.get_post_likes', 'GET', lambda ctx: f'/like/post/{ctx.hot_post()}', None, {200}, 1),
+    Scenario('like.get_my_like', 'GET', lambda ctx: f'/like/post/{ctx.hot_post()}/me', None, {200}, 1),
+    Scenario('like.like_post', 'POST', lambda ctx: f'/like/post/{ctx.hot_post()}', None, {201, 202, 409}, 0.25),
+    Scenario('like.like_posts_batch', 'POST', lambda ctx: '/like/batch', lambda ctx: {'post_ids': ctx.hot_posts(20)}, {200}, 0.1),
+    Scenario('like.unlike_post', 'DELETE', lambda ctx, post_id: f'/like/post/{post_id}', None, {200, 202}, 0.25, take('likes'), provision_likes),
+    # search, stats, metrics
+    Scenario('search.search_content', 'GET', lambda ctx: '/search/?q=' + urllib.parse.quote(ctx.words(2)), None, {200}, 1),
+    Scenario('stats.get_cache_stats', 'GET', lambda ctx: '/stats/cache', None, {200}, 1),
+    Scenario('stats.get_like_buffer_stats', 'GET', lambda ctx: '/stats/like-buffer', None, {200}, 1),
+    Scenario('stats.get_compaction_stats', 'GET', lambda ctx: '/stats/compaction', None, {200}, 1),
+    Scenario('stats.get_rate_limit_stats', 'GET', lambda ctx: '/stats/rate-limit', None, {200}, 1),
+    Scenario('metrics.get_metrics', 'GET', lambda ctx: '/metrics', None, {200}, 1),
+)
+
+
+class Context:
+    def __init__(self, manifest, token_users):
+        counts = manifest['counts']
+        self.users = counts['users']
+        self.posts = counts['posts']
+        self.token_users = token_users
+        self.tokens = [token for _, token in token_users]
+        self.posts_ranked = popularity(counts['posts'], manifest['seed'])
+        self.rng = random.Random(manifest['seed'])
+        self.pools = {}
+        # The database outlives the run, so new emails must not repeat those of earlier runs.
+        self._serial = itertools.count()
+        self._run = f'{time.time_ns():x}'
+
+    def user_id(self):
+        return self.rng.randint(1, self.users)
+
+    def hot_post(self):
+        return sample(self.rng, self.posts_ranked, 1)[0]
+
+    def hot_posts(self, k):
+        return sample(self.rng, self.posts_ranked, k)
+
+    def words(self, count):
+        return ' '.join(self.rng.choices(WORDS, k=count))
+
+    def headers(self):
+        return {'Authorization': f'Bearer {self.rng.choice(self.tokens)}'}
+
+    def unique(self):
+        return f'{self._run}-{next(self._serial)}'
+
+    def provision(self, app, path, headers, body):
+        # Rows for a scenario are made through the batch endpoints, so counters and the search index stay right.
+        response = app.test_client().post(path, headers=headers, json=body)
+        if response.status_code != 200:
+            raise SystemExit(f'setup {path}: {response.status_code} {response.get_data(as_text=True)[:200]}')
+        return [result for result in response.get_json()['results'] if result['status'] == 'created']
+
+
+def instrument(app):
+    # Counts the SQL each request runs and reports it in a response header, so both transports can read it.
+    from flask import g, has_request_context
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @app.before_request
+    def start_sql_count():
+        g.bench_sql = 0
+
+    @app.after_request
+    def report_sql_count(response):
+        response.headers[SQL_HEADER] = str(g.pop('bench_sql', 0))
+        return response
+
+    def count_statement(*args):
+        if has_request_context() and 'bench_sql' in g:
+            g.bench_sql += 1
+
+    event.listen(Engine, 'before_cursor_execute', count_statement)
+
+
+class ClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers, body):
+        response = self.client.open(path, method=method, headers=headers, json=body)
+        response.close()
+        return response.status_code, int(response.headers.get(SQL_HEADER, 0))
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def request(self, method, path, headers, body):
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers = dict(headers, **{'Content-Type': 'application/json'})
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server may drop idle keep-alive connections; reconnect once.
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+        response.read()
+        return response.status, int(response.getheader(SQL_HEADER) or 0)
+
+    def close(self):
+        self.conn.close()
+
+
+def send(transport, scenario, ctx):
+    if scenario.claim:
+        headers, value = scenario.claim(ctx)
+        path, body = scenario.path(ctx, value), scenario.body(ctx, value) if scenario.body else None
+    else:
+        headers, path, body = ctx.headers(), scenario.path(ctx), scenario.body(ctx) if scenario.body else None
+    # A failed connection is recorded as status 0 instead of killing the worker thread.
+    try:
+        return transport.request(scenario.method, path, headers, body)
+    except (http.client.HTTPException, OSError):
+        return 0, 0
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def scenario_requests(scenario, requests):
+    return max(1, int(requests * scenario.share))
+
+
+def run_scenario(scenario, make_transport, ctx, requests, concurrency, warmup):
+    total = scenario_requests(scenario, requests)
+    latencies, sql_counts, statuses = [], [], Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(count):
+        transport = make_transport()
+        mine, sql, codes = [], [], Counter()
+        for _ in range(warmup):
+            send(transport, scenario, ctx)
+        barrier.wait()
+        for _ in range(count):
+            started = time.perf_counter()
+            status, statements = send(transport, scenario, ctx)
+            mine.append(time.perf_counter() - started)
+            sql.append(statements)
+            codes[status] += 1
+        transport.close()
+        with lock:
+            latencies.extend(mine)
+            sql_counts.extend(sql)
+            statuses.update(codes)
+
+    shares = [total // concurrency + (1 if n < total % concurrency else 0) for n in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(share,)) for share in shares]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': sum(count for status, count in statuses.items() if status not in scenario.expected),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'req_per_s': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'sql_per_request': round(sum(sql_counts) / len(sql_counts), 2),
+    }
+
+
+def start_server(app, workers):
+    from werkzeug.serving import make_server
+    from hashing import password_hasher
+    from models import db
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1024)
+    port = listener.getsockname()[1]
+    with app.app_context():
+        db.engine.dispose()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # SIGTERM unwinds serve_forever, so the worker can stop its hashing pool instead of orphaning it.
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            try:
+                # Every worker accepts from the same socket; the kernel spreads connections between them.
+                logging.getLogger('werkzeug').setLevel(logging.ERROR)
+                make_server('127.0.0.1', port, app, threaded=True, fd=listener.fileno()).serve_forever()
+            finally:
+                password_hasher.shutdown(wait=True)
+                os._exit(0)
+        pids.append(pid)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+    return listener, port, pids
+
+
+def stop_server(listener, pids):
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    listener.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(mode, results):
+    print(f'\n[{mode}]')
+    print(f"{'endpoint':<28} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8} {'errors':>7}")
+    for name, result in results.items():
+        print(f"{name:<28} {result['req_per_s']:>9} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} "
+              f"{result['sql_per_request']:>8} {result['errors']:>7}")
+
+
+def run(args):
+    rows = parse_scale(args.scale)
+    db_path = os.path.abspath(args.db or os.path.join(tempfile.gettempdir(), f'social-bench-{args.scale}-{args.seed}.db'))
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    # Metrics stay on, as in production, so that /metrics has something to render.
+    os.environ.setdefault('METRICS_ENABLED', '1')
+    # A handful of benchmark clients would run straight into the login and write limits.
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    from app import create_app
+    from models import User
+    app = create_app()
+
+    manifest = ensure_dataset(app, db_path, rows, args.seed, log=lambda line: print(f'seeding {line}', file=sys.stderr))
+    with app.app_context():
+        users = User.query.order_by(User.id).limit(TOKEN_USERS).all()
+        token_users = [(user.id, user.generate_token()) for user in users]
+    instrument(app)
+    ctx = Context(manifest, token_users)
+    scenarios = [scenario for scenario in SCENARIOS if not args.only or scenario.name in args.only]
+    modes = ('client', 'server') if args.mode == 'both' else (args.mode,)
+
+    report = {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'scale_rows': rows,
+            'counts': manifest['counts'],
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+        },
+        'runs': {},
+    }
+    for mode in modes:
+        results = {}
+        if mode == 'server':
+            listener, port, pids = start_server(app, args.workers)
+            make_transport = lambda: HTTPTransport(port)
+        else:
+            make_transport = lambda: ClientTransport(app)
+        try:
+            for scenario in scenarios:
+                print(f'{mode}: {scenario.name}', file=sys.stderr)
+                if scenario.setup:
+                    scenario.setup(ctx, app, scenario_requests(scenario, args.requests) + args.warmup * args.concurrency)
+                results[scenario.name] = run_scenario(scenario, make_transport, ctx, args.requests, args.concurrency, args.warmup)
+        finally:
+            if mode == 'server':
+                stop_server(listener, pids)
+        report['runs'][mode] = results
+        print_results(mode, results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nwrote {args.output}')
+    failed = [name for results in report['runs'].values() for name, result in results.items() if result['errors']]
+    return 1 if failed and args.fail_on_errors else 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    limit = args.max_regression / 100
+    regressions = []
+    for mode, results in current['runs'].items():
+        base_results = baseline['runs'].get(mode, {})
+        print(f'\n[{mode}]')
+        print(f"{'endpoint':<28} {'req/s':>18} {'p95 ms':>18} {'sql/req':>14}")
+        for name, result in results.items():
+            base = base_results.get(name)
+            if base is None:
+                print(f'{name:<28} (new)')
+                continue
+            problems = []
+            if result['req_per_s'] < base['req_per_s'] * (1 - limit):
+                problems.append('throughput')
+            # Sub-millisecond p95s are noise; require an absolute change as well.
+            if result['p95_ms'] > base['p95_ms'] * (1 + limit) and result['p95_ms'] - base['p95_ms'] > args.min_latency_ms:
+                problems.append('p95')
+            if result['sql_per_request'] > base['sql_per_request'] * (1 + limit) and result['sql_per_request'] - base['sql_per_request'] >= 0.5:
+                problems.append('sql')
+            if result['errors'] and not base['errors']:
+                problems.append('errors')
+            print(f"{name:<28} {base['req_per_s']:>8} -> {result['req_per_s']:<8} {base['p95_ms']:>8} -> {result['p95_ms']:<8} "
+                  f"{base['sql_per_request']:>5} -> {result['sql_per_request']:<6} {'REGRESSED: ' + ', '.join(problems) if problems else ''}")
+            if problems:
+                regressions.append((mode, name, problems))
+    if regressions:
+        print(f'\n{len(regressions)} regression(s) beyond {args.max_regression}%')
+        return 1
+    print(f'\nno regressions beyond {args.max_regression}%')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='seed if needed, then benchmark every endpoint')
+    run_parser.add_argument('--scale', default='10k', help='dataset size: 10k, 100k, 1m, 10m or a row count')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--db', help='SQLite file for the dataset (default: a per-scale file in the temp dir)')
+    run_parser.add_argument('--mode', choices=('client', 'server', 'both'), default='client')
+    run_parser.add_argument('--workers', type=int, default=4, help='server processes in --mode server')
+    run_parser.add_argument('--concurrency', type=int, default=8, help='concurrent client threads')
+    run_parser.add_argument('--requests', type=int, default=200, help='requests per endpoint (writes and logins use a fraction)')
+    run_parser.add_argument('--warmup', type=int, default=2, help='untimed requests per thread before each endpoint')
+    run_parser.add_argument('--only', nargs='+', help='endpoint names to run, e.g. post.get_post like.like_post')
+    run_parser.add_argument('--output', help='write results as JSON')
+    run_parser.add_argument('--fail-on-errors', action='store_true', help='exit non-zero if any request got an unexpected status')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two result files and fail on regressions')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--max-regression', type=float, default=10, help='allowed slowdown in percent')
+    compare_parser.add_argument('--min-latency-ms', type=float, default=1, help='ignore p95 changes smaller than this')
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Sustained like throughput on one hot post: direct writes vs. the write-behind like buffer.
+
+    python benchmarks/like_throughput.py --threads 8 --users 2000
+
+Every user likes the same post once through the real /like endpoint. Each mode runs in a fresh process
+against its own SQLite file; afterwards the buffer is flushed and the likes table and likes_count are
+checked against the number of accepted requests.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_mode(buffered, threads, users):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['LIKE_BUFFER_ENABLED'] = '1' if buffered else '0'
+        os.environ['EVENT_WORKERS'] = '0'
+        import logging
+        logging.getLogger('werkzeug').disabled = True
+        from sqlalchemy import func, insert, select
+        from app import create_app
+        from like_buffer import like_buffer
+        from migrations import upgrade
+        from models import db, Like, Post, User
+        app = create_app()
+
+        with app.app_context():
+            upgrade()
+            now = datetime.utcnow()
+            # A fixed hash keeps seeding fast; nobody logs in during the benchmark.
+            db.session.execute(insert(User), [
+                {'first_name': 'bench', 'last_name': str(n), 'email': f'bench{n}@example.com', 'password': 'x',
+                 'date_of_birth': date(1990, 1, 1), 'gender': 'Other', 'created_at': now, 'updated_at': now}
+                for n in range(users)
+            ])
+            post = Post(user_id=1, title='hot', content='viral', created_at=now)
+            db.session.add(post)
+            db.session.commit()
+            post_id = post.id
+            tokens = [user.generate_token() for user in User.query.order_by(User.id).all()]
+
+        client_headers = [{'Authorization': f'Bearer {token}'} for token in tokens]
+        latencies, statuses = [], []
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads + 1)
+
+        def worker(offset):
+            client = app.test_client()
+            mine, codes = [], []
+            barrier.wait()
+            for headers in client_headers[offset::threads]:
+                started = time.perf_counter()
+                codes.append(client.post(f'/like/post/{post_id}', headers=headers).status_code)
+                mine.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(mine)
+                statuses.extend(codes)
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for thread in workers:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        with app.app_context():
+            flush_started = time.perf_counter()
+            like_buffer.flush()
+            drain = time.perf_counter() - flush_started
+            rows = db.session.execute(select(func.count()).select_from(Like).where(Like.post_id == post_id)).scalar()
+            counter = db.session.get(Post, post_id).likes_count
+        accepted = sum(1 for status in statuses if status in (201, 202))
+        return {
+            'mode': 'buffered' if buffered else 'direct',
+            'requests': len(statuses),
+            'accepted': accepted,
+            'errors': len(statuses) - accepted,
+            'likes_per_second': round(len(statuses) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'final_flush_ms': round(drain * 1000, 1),
+            'consistent': rows == counter == accepted,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--users', type=int, default=2000, help='distinct users liking the post')
+    parser.add_argument('--mode', choices=('direct', 'buffered'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        print(json.dumps(run_mode(args.mode == 'buffered', args.threads, args.users)))
+        return
+    for mode in ('direct', 'buffered'):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--mode', mode, '--threads', str(args.threads), '--users', str(args.users)],
+            check=True, capture_output=True, text=True, cwd=ROOT,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['mode']:>9}: {result['likes_per_second']:>8} likes/s  p50={result['p50_ms']}ms p99={result['p99_ms']}ms "
+              f"accepted={result['accepted']} errors={result['errors']} final_flush={result['final_flush_ms']}ms consistent={result['consistent']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Per-request cost of the metrics middleware: the same request mix with the instrumentation off and on.
+
+    python benchmarks/metrics_overhead.py --requests 400 --rounds 20
+
+Off and on alternate in short blocks inside one process, against one SQLite file, so drift in machine
+load hits both modes equally. The middleware's request hooks and engine listeners are detached for the
+"off" blocks; the fastest block of each mode is compared, along with the total.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PATHS = ['/post/?limit=20', '/post/7', '/comment/post/7', '/post/?limit=5&include=author,comments']
+
+
+def seed():
+    from sqlalchemy import insert
+    from models import db, Comment, Post, User
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [{'first_name': 'bench', 'last_name': str(n), 'email': f'bench{n}@example.com', 'password': 'x',
+                                       'date_of_birth': date(1990, 1, 1), 'gender': 'Other', 'created_at': now, 'updated_at': now} for n in range(10)])
+    db.session.execute(insert(Post), [{'user_id': n % 10 + 1, 'title': f'post {n}', 'content': 'x' * 200, 'created_at': now + timedelta(seconds=n),
+                                       'updated_at': now} for n in range(200)])
+    db.session.execute(insert(Comment), [{'user_id': n % 10 + 1, 'post_id': n % 200 + 1, 'content': f'comment {n}', 'created_at': now,
+                                          'updated_at': now} for n in range(1000)])
+    db.session.commit()
+    return {'Authorization': f'Bearer {db.session.get(User, 1).generate_token()}'}
+
+
+def instrument(app, metrics, on):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    hooks = ((app.before_request_funcs.setdefault(None, []), metrics._before_request),
+             (app.after_request_funcs.setdefault(None, []), metrics._after_request))
+    for funcs, hook in hooks:
+        if on and hook not in funcs:
+            funcs.append(hook)
+        while not on and hook in funcs:
+            funcs.remove(hook)
+    for name, listener in (('before_cursor_execute', metrics._before_cursor_execute), ('after_cursor_execute', metrics._after_cursor_execute)):
+        if on and not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+        if not on and event.contains(Engine, name, listener):
+            event.remove(Engine, name, listener)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400, help='requests per block')
+    parser.add_argument('--rounds', type=int, default=20, help='off/on block pairs')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['METRICS_ENABLED'] = '1'
+        os.environ['EVENT_WORKERS'] = '0'
+        from app import create_app
+        from metrics import metrics
+        from migrations import upgrade
+        app = create_app()
+
+        with app.app_context():
+            upgrade()
+            headers = seed()
+        client = app.test_client()
+        for path in PATHS * 20:
+            client.get(path, headers=headers)
+
+        blocks = {'off': [], 'on': []}
+        for _ in range(args.rounds):
+            for mode in ('off', 'on'):
+                instrument(app, metrics, mode == 'on')
+                started = time.perf_counter()
+                for n in range(args.requests):
+                    client.get(PATHS[n % len(PATHS)], headers=headers)
+                blocks[mode].append((time.perf_counter() - started) / args.requests * 1e6)
+        instrument(app, metrics, True)
+        recorded = sum(count for (endpoint, _, _), count in metrics._requests.items() if endpoint != 'unmatched')
+
+    best = {mode: min(times) for mode, times in blocks.items()}
+    mean = {mode: sum(times) / len(times) for mode, times in blocks.items()}
+    print(f"metrics off: best {best['off']:.1f} us/request, mean {mean['off']:.1f}")
+    print(f"metrics on:  best {best['on']:.1f} us/request, mean {mean['on']:.1f}  ({recorded} requests recorded)")
+    print(f"overhead:    best {(best['on'] - best['off']) / best['off'] * 100:.2f}%, mean {(mean['on'] - mean['off']) / mean['off'] * 100:.2f}%")
+
+
+if __name__ == '__main__':
+    main()
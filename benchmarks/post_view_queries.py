@@ -0,0 +1,97 @@
+"""SQL statements per page of expanded posts: must not grow with the page size.
+
+    python benchmarks/post_view_queries.py --sizes 5 20 100
+
+Counts the statements one GET /post/?include=author,comments,like_count,liked_by_me issues at each page
+size, next to what the same page costs when a client stitches it together from /post/<id>,
+/comment/post/<id> and /like/post/<id>. Exits non-zero if the expanded count changes with the page size.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+INCLUDE = 'author,comments,like_count,liked_by_me'
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def seed(posts, comments_per_post, users=20):
+    from sqlalchemy import insert
+    from models import db, Comment, Like, Post, User
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {'first_name': 'bench', 'last_name': str(n), 'email': f'bench{n}@example.com', 'password': 'x',
+         'date_of_birth': date(1990, 1, 1), 'gender': 'Other', 'created_at': now, 'updated_at': now}
+        for n in range(users)
+    ])
+    db.session.execute(insert(Post), [
+        {'user_id': n % users + 1, 'title': f'post {n}', 'content': 'x' * 200, 'created_at': now + timedelta(seconds=n), 'updated_at': now,
+         'likes_count': n % users, 'comments_count': comments_per_post}
+        for n in range(posts)
+    ])
+    db.session.execute(insert(Comment), [
+        {'user_id': c % users + 1, 'post_id': p + 1, 'content': f'comment {c}', 'created_at': now + timedelta(seconds=c), 'updated_at': now}
+        for p in range(posts) for c in range(comments_per_post)
+    ])
+    db.session.execute(insert(Like), [
+        {'user_id': u + 1, 'post_id': p + 1, 'created_at': now}
+        for p in range(posts) for u in range(p % users)
+    ])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 20, 100])
+    parser.add_argument('--comments', type=int, default=10, help='comments per post')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['EVENT_WORKERS'] = '0'
+        from sqlalchemy import event
+        from app import create_app
+        from migrations import upgrade
+        from models import db, User
+        app = create_app()
+
+        with app.app_context():
+            upgrade()
+            seed(max(args.sizes), args.comments)
+            headers = {'Authorization': f'Bearer {db.session.get(User, 1).generate_token()}'}
+            counter = StatementCounter()
+            event.listen(db.engine, 'before_cursor_execute', counter)
+        client = app.test_client()
+        client.get('/post/?limit=1', headers=headers)
+
+        expanded = {}
+        for size in args.sizes:
+            counter.count = 0
+            response = client.get(f'/post/?limit={size}&include={INCLUDE}', headers=headers)
+            assert response.status_code == 200 and len(response.get_json()['posts']) == size, response.get_data(as_text=True)
+            expanded[size] = counter.count
+            post_ids = [post['id'] for post in response.get_json()['posts']]
+            counter.count = 0
+            for post_id in post_ids:
+                client.get(f'/post/{post_id}', headers=headers)
+                client.get(f'/comment/post/{post_id}', headers=headers)
+                client.get(f'/like/post/{post_id}', headers=headers)
+            print(f'page size {size:>4}: expanded={expanded[size]:>3} statements  separate requests={counter.count:>4} statements')
+    if len(set(expanded.values())) != 1:
+        print('FAIL: statement count grows with page size')
+        sys.exit(1)
+    print('OK: statement count is constant')
+
+
+if __name__ == '__main__':
+    main()
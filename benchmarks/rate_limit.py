@@ -0,0 +1,163 @@
+"""Cost of a rate-limit check: the bucket stores on their own, and per request with the limiter off and on.
+
+    python benchmarks/rate_limit.py --checks 200000 --keys 10000
+    python benchmarks/rate_limit.py --redis-url redis://localhost:6379/15
+
+The memory store is timed on a hot key, on --keys keys in rotation, and with max_keys below --keys so
+every check also pays for eviction. The redis store is timed against --redis-url or, without it, against
+a fakeredis TCP server started in this process (pip install fakeredis lupa); two connections then spend
+one shared bucket to show that workers see the same limit. The per-request overhead alternates the same
+GET mix with the limiter's hooks detached and attached, as metrics_overhead.py does for the metrics.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PATHS = ['/post/?limit=20', '/post/7', '/comment/post/7']
+
+
+def per_call(func, count):
+    started = time.perf_counter()
+    for n in range(count):
+        func(n)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def seed():
+    from sqlalchemy import insert
+    from models import db, Comment, Post, User
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [{'first_name': 'bench', 'last_name': str(n), 'email': f'bench{n}@example.com', 'password': 'x',
+                                       'date_of_birth': date(1990, 1, 1), 'gender': 'Other', 'created_at': now, 'updated_at': now} for n in range(10)])
+    db.session.execute(insert(Post), [{'user_id': n % 10 + 1, 'title': f'post {n}', 'content': 'x' * 200, 'created_at': now + timedelta(seconds=n),
+                                       'updated_at': now} for n in range(200)])
+    db.session.execute(insert(Comment), [{'user_id': n % 10 + 1, 'post_id': n % 200 + 1, 'content': f'comment {n}', 'created_at': now,
+                                          'updated_at': now} for n in range(1000)])
+    db.session.commit()
+    return {'Authorization': f'Bearer {db.session.get(User, 1).generate_token()}'}
+
+
+def bench_memory(checks, keys):
+    from ratelimit import MemoryBuckets, parse_rate
+    rate = parse_rate('1000000/second')
+    store = MemoryBuckets(max_keys=keys * 2)
+    print(f"memory, one key:        {per_call(lambda n: store.hit('user:1', rate), checks):.2f} us/check")
+    names = [f'user:{n}' for n in range(keys)]
+    print(f"memory, {keys} keys: {per_call(lambda n: store.hit(names[n % keys], rate), checks):>8.2f} us/check")
+    # A slow rate keeps the buckets from refilling, so eviction has to pick among active ones.
+    slow = parse_rate('60/minute')
+    store = MemoryBuckets(max_keys=keys // 2)
+    cost = per_call(lambda n: store.hit(names[n % keys], slow), checks)
+    print(f"memory, evicting:       {cost:.2f} us/check  ({store.info()['evictions']} evictions, {store.info()['keys']} keys kept)")
+
+
+def bench_keying(headers, checks):
+    from ratelimit import limiter
+    authorization = headers['Authorization']
+
+    def first_seen(n):
+        limiter._subjects.clear()
+        limiter.token_subject(authorization)
+
+    print(f"token, first seen:      {per_call(first_seen, checks):.2f} us  (HMAC check and payload decode)")
+    print(f"token, seen before:     {per_call(lambda n: limiter.token_subject(authorization), checks):.2f} us")
+
+
+def bench_redis(url, checks):
+    import redis
+    from ratelimit import GCRA_SCRIPT, RedisBuckets, parse_rate
+    server = None
+    if url is None:
+        try:
+            from fakeredis import TcpFakeServer
+        except ImportError:
+            print('redis: skipped, pass --redis-url or pip install fakeredis lupa')
+            return
+        server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'redis://%s:%d/0' % server.server_address
+        # fakeredis drops RESP3 connections on a NOSCRIPT reply instead of letting redis-py load the script.
+        redis.Redis(*server.server_address).script_load(GCRA_SCRIPT)
+    try:
+        workers = [RedisBuckets(redis.Redis.from_url(url), prefix='ratelimit-bench:') for _ in range(2)]
+        workers[0].clear()
+        rate = parse_rate('1000000/second')
+        cost = per_call(lambda n: workers[0].hit(f'user:{n % 1000}', rate), checks)
+        print(f"redis ({'fakeredis' if server else url}): {cost:.1f} us/check  (one round trip)")
+        rate = parse_rate('10/minute')
+        allowed = [workers[n % 2].hit('ip:203.0.113.7', rate).allowed for n in range(20)]
+        print(f"redis, two workers share one 10/minute bucket: {allowed.count(True)} of {len(allowed)} allowed")
+        workers[0].clear()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+def attach(app, limiter, on):
+    hooks = ((app.before_request_funcs.setdefault(None, []), limiter._before_request),
+             (app.after_request_funcs.setdefault(None, []), limiter._after_request))
+    for funcs, hook in hooks:
+        if on and hook not in funcs:
+            funcs.append(hook)
+        while not on and hook in funcs:
+            funcs.remove(hook)
+
+
+def bench_requests(app, headers, requests, rounds):
+    from ratelimit import limiter
+    client = app.test_client()
+    for path in PATHS * 20:
+        client.get(path, headers=headers)
+    blocks = {'off': [], 'on': []}
+    for _ in range(rounds):
+        for mode in ('off', 'on'):
+            attach(app, limiter, mode == 'on')
+            started = time.perf_counter()
+            for n in range(requests):
+                client.get(PATHS[n % len(PATHS)], headers=headers)
+            blocks[mode].append((time.perf_counter() - started) / requests * 1e6)
+    attach(app, limiter, True)
+    limited = client.get(PATHS[0], headers=headers).headers.get('X-RateLimit-Remaining') is not None
+    best = {mode: min(times) for mode, times in blocks.items()}
+    mean = {mode: sum(times) / len(times) for mode, times in blocks.items()}
+    print(f"limiter off: best {best['off']:.1f} us/request, mean {mean['off']:.1f}")
+    print(f"limiter on:  best {best['on']:.1f} us/request, mean {mean['on']:.1f}  (limit headers sent: {limited})")
+    print(f"overhead:    best {best['on'] - best['off']:.1f} us, mean {mean['on'] - mean['off']:.1f} us per request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--checks', type=int, default=200000, help='store checks per measurement')
+    parser.add_argument('--keys', type=int, default=10000, help='distinct clients in the multi-key runs')
+    parser.add_argument('--redis-url', help='a Redis server to use instead of the in-process stand-in')
+    parser.add_argument('--redis-checks', type=int, default=5000, help='checks against redis')
+    parser.add_argument('--requests', type=int, default=400, help='requests per off/on block')
+    parser.add_argument('--rounds', type=int, default=20, help='off/on block pairs')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['EVENT_WORKERS'] = '0'
+        os.environ['METRICS_ENABLED'] = '0'
+        from app import create_app
+        from migrations import upgrade
+        # A default limit high enough never to reject, so every GET pays for a check.
+        app = create_app({'RATE_LIMIT_ENABLED': True, 'RATE_LIMIT_BACKEND': 'memory', 'RATE_LIMIT_DEFAULT': '1000000/second'})
+        with app.app_context():
+            upgrade()
+            headers = seed()
+
+        bench_memory(args.checks, args.keys)
+        bench_keying(headers, args.checks // 10)
+        bench_redis(args.redis_url, args.redis_checks)
+        bench_requests(app, headers, args.requests, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Search latency for a term in nearly every post vs. a rare one, with and without the candidate cap.
+
+    python benchmarks/search_ranking.py --posts 100000 --candidates 100 1000 10000 0
+
+Every seeded post contains "common"; one in --rare-every also contains "rare". Each query asks for the
+first page of 20 and is timed through search() in process. A --candidates value of 0 ranks every match,
+the way search worked before the cap. The last column shows how many of the capped top 20 also make the
+uncapped top 20; the first pages rank the newest matches only, so the two can differ.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FILLER = ('flask', 'python', 'database', 'sqlite', 'cache', 'timeline', 'search', 'travel', 'coffee', 'music')
+CHUNK = 20000
+
+
+def seed(posts, rare_every):
+    from sqlalchemy import insert
+    from models import db, Post, User
+    from search import ensure_search_schema
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [{'first_name': 'bench', 'last_name': 'search', 'email': 'search@example.com', 'password': 'x',
+                                       'date_of_birth': date(1990, 1, 1), 'gender': 'Other', 'created_at': now, 'updated_at': now}])
+    for start in range(0, posts, CHUNK):
+        db.session.execute(insert(Post), [
+            {'user_id': 1, 'title': f'post {n} common', 'created_at': now + timedelta(seconds=n), 'updated_at': now,
+             # Repeating "common" a varying number of times gives bm25 something to tell apart.
+             'content': ' '.join(FILLER[(n + k) % len(FILLER)] for k in range(30)) + ' common' * (n % 7) + (' rare' if n % rare_every == 0 else '')}
+            for n in range(start, min(posts, start + CHUNK))
+        ])
+    db.session.commit()
+    with db.engine.begin() as conn:
+        # The seed bypasses the write paths, so build the search index from the rows.
+        conn.exec_driver_sql('DROP TABLE IF EXISTS posts_fts')
+        conn.exec_driver_sql('DROP TABLE IF EXISTS comments_fts')
+        ensure_search_schema(conn)
+
+
+def timed(terms, candidates, repeat):
+    from search import search
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows, _ = search('posts', ('id',), terms, candidates=candidates)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, [row.id for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--rare-every', type=int, default=1000, help='one post in this many contains the rare term')
+    parser.add_argument('--candidates', type=int, nargs='+', default=[100, 1000, 10000, 0], help='0 ranks every match')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per query; the best is reported')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['EVENT_WORKERS'] = '0'
+        os.environ['METRICS_ENABLED'] = '0'
+        from app import create_app
+        from migrations import upgrade
+        from search import parse_query
+        app = create_app()
+        with app.app_context():
+            upgrade()
+            seed(args.posts, args.rare_every)
+            print(f'{args.posts} posts: "common" matches all of them, "rare" matches {len(range(0, args.posts, args.rare_every))}')
+            print(f"{'query':<8} {'candidates':>10} {'ms':>9} {'same top 20':>12}")
+            for query in ('common', 'rare'):
+                terms = parse_query(query)
+                _, reference = timed(terms, args.posts + 1, 1)
+                for candidates in args.candidates:
+                    ms, ids = timed(terms, candidates or args.posts + 1, args.repeat)
+                    label = candidates or 'all'
+                    print(f'{query:<8} {label:>10} {ms:>9.2f} {len(set(ids) & set(reference)):>9}/20')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Per-item cost of serializing a 10k-post list response: hand-built dicts vs. serializers.post_schema.
+
+    python benchmarks/serialization.py --items 10000
+
+"post_schema" rows ask for the legacy dicts' eight fields; "default fields" is what a request without
+?fields= gets, which also carries media_url.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serializers import orjson, post_schema, ORJSON_OPTIONS
+
+PostRow = namedtuple('PostRow', [column.key for column in post_schema.columns()])
+
+
+def make_rows(count):
+    now = datetime(2024, 1, 1)
+    return [
+        PostRow(id=i, title=f'Post {i}', content='lorem ipsum ' * 40, media_url=None, user_id=i % 997,
+                likes_count=i % 50, comments_count=i % 7, created_at=now + timedelta(seconds=i), updated_at=now + timedelta(seconds=i))
+        for i in range(count)
+    ]
+
+
+def legacy(rows):
+    # What every route did before: a literal dict per item, then jsonify's stdlib encoder with sorted keys.
+    items = [{'id': post.id, 'title': post.title, 'content': post.content, 'user_id': post.user_id, 'likes_count': post.likes_count, 'comments_count': post.comments_count, 'created_at': str(post.created_at), 'updated_at': str(post.updated_at)} for post in rows]
+    return json.dumps({'posts': items}, sort_keys=True)
+
+
+def schema_stdlib(rows, fields=None):
+    return json.dumps({'posts': post_schema.dump_many(rows, fields)}, sort_keys=True)
+
+
+def schema_orjson(rows, fields=None):
+    return orjson.dumps({'posts': post_schema.dump_many(rows, fields)}, option=ORJSON_OPTIONS)
+
+
+def measure(fn, rows, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        payload = fn(rows)
+        best = min(best, time.perf_counter() - started)
+    return best / len(rows) * 1e6, len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    rows = make_rows(args.items)
+    legacy_fields = post_schema.parse_fields('id,title,content,user_id,likes_count,comments_count,created_at,updated_at')
+    sparse = post_schema.parse_fields('id,title,likes_count')
+    cases = [
+        ('legacy dicts + json', legacy),
+        ('post_schema + json', lambda rows: schema_stdlib(rows, legacy_fields)),
+        ('post_schema default fields + json', schema_stdlib),
+        ('post_schema fields=id,title,likes_count + json', lambda rows: schema_stdlib(rows, sparse)),
+    ]
+    if orjson is not None:
+        cases += [
+            ('post_schema + orjson', lambda rows: schema_orjson(rows, legacy_fields)),
+            ('post_schema fields=id,title,likes_count + orjson', lambda rows: schema_orjson(rows, sparse)),
+        ]
+    baseline = None
+    for name, fn in cases:
+        per_item, size = measure(fn, rows, args.repeat)
+        baseline = baseline or per_item
+        print(f'{name:<50} {per_item:7.2f} us/item  {baseline / per_item:5.2f}x  {size / 1024:8.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Concurrent write throughput on SQLite: default engine settings vs. the tuned ones from database.py.
+
+    python benchmarks/sqlite_write_concurrency.py --threads 8 --writes 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, select, func
+from sqlalchemy.exc import OperationalError
+from database import DATABASE_DEFAULTS, enable_sqlite_pragmas, engine_options, sqlite_pragmas
+from models import db, Post
+
+
+def make_engine(path, tuned):
+    uri = f'sqlite:///{path}'
+    if not tuned:
+        return create_engine(uri)
+    engine = create_engine(uri, **engine_options(uri, DATABASE_DEFAULTS))
+    enable_sqlite_pragmas(engine, sqlite_pragmas(DATABASE_DEFAULTS))
+    return engine
+
+
+def run(tuned, threads, writes):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, 'bench.db'), tuned)
+        db.metadata.create_all(engine)
+        errors = []
+        barrier = threading.Barrier(threads + 1)
+
+        def writer(worker):
+            barrier.wait()
+            for i in range(writes):
+                try:
+                    # One transaction per write, like one request per like/comment/post.
+                    with engine.begin() as conn:
+                        conn.execute(insert(Post).values(user_id=worker, title=f'{worker}-{i}', content='x' * 200, created_at=datetime.utcnow(), updated_at=datetime.utcnow()))
+                except OperationalError as e:
+                    errors.append(str(e.orig))
+
+        workers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        with engine.connect() as conn:
+            committed = conn.execute(select(func.count()).select_from(Post)).scalar()
+        engine.dispose()
+    return {'mode': 'tuned' if tuned else 'default', 'committed': committed, 'errors': len(errors), 'seconds': round(elapsed, 3), 'writes_per_second': round(committed / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--writes', type=int, default=300, help='writes per thread')
+    args = parser.parse_args()
+    for tuned in (False, True):
+        result = run(tuned, args.threads, args.writes)
+        print(f"{result['mode']:>8}: {result['writes_per_second']:>9} writes/s  committed={result['committed']} errors={result['errors']} in {result['seconds']}s")
+
+
+if __name__ == '__main__':
+    main()
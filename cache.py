@@ -0,0 +1,369 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_TTL = 10
+BACKEND_ERROR_LOG_INTERVAL = 60
+
+
+def post_key(post_id):
+    return f'post:{post_id}'
+
+
+def post_counts_key(post_id):
+    return f'post_counts:{post_id}'
+
+
+def user_key(user_id):
+    return f'user:{user_id}'
+
+
+def token_version_key(user_id):
+    return f'token_version:{user_id}'
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def record(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class Lease:
+    # Placeholder a reader stores at a missing key while it loads the value; reads see a miss.
+    __slots__ = ()
+
+
+class LRUCache:
+    def __init__(self, max_entries=10000, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = CacheStats()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and type(entry[0]) is not Lease:
+                value, expires_at = entry
+                if expires_at > self.clock():
+                    self._data.move_to_end(key)
+                    self.stats.hits += 1
+                    return value
+                del self._data[key]
+                self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+
+    def get_many(self, keys):
+        return {key: value for key in keys if (value := self.get(key)) is not None}
+
+    def set(self, key, value, ttl=None):
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats.evictions += 1
+
+    def set_many(self, mapping, ttl=None):
+        for key, value in mapping.items():
+            self.set(key, value, ttl)
+
+    def lease(self, key, ttl):
+        # A token when the key is free (missing, expired or an expired lease), otherwise None.
+        now = self.clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                return None
+            token = Lease()
+            self._data[key] = (token, now + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats.evictions += 1
+            return token
+
+    def fill(self, key, token, value, ttl=None):
+        # Stores value only if the key still holds this reader's lease, i.e. nothing invalidated it meanwhile.
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] is not token:
+                return False
+            self._data[key] = (value, self.clock() + (self.ttl if ttl is None else ttl))
+            return True
+
+    def lease_many(self, keys, ttl):
+        return {key: self.lease(key, ttl) for key in keys}
+
+    def fill_many(self, tokens, mapping, ttl=None):
+        for key, value in mapping.items():
+            self.fill(key, tokens[key], value, ttl)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def info(self):
+        return dict(self.stats.as_dict(), backend='memory', size=len(self._data), max_entries=self.max_entries, ttl=self.ttl)
+
+
+# Sets the value only while the key still holds the caller's lease. JSON never starts with "lease:".
+FILL_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+  return 1
+end
+return 0
+"""
+LEASE_PREFIX = b'lease:'
+
+
+class RedisCache:
+    # Speaks the Redis protocol through any client exposing get/mget/set/delete (redis-py or a stand-in).
+    def __init__(self, client, ttl=300, prefix='social:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = CacheStats()
+        self._fill = client.register_script(FILL_SCRIPT)
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None or raw.startswith(LEASE_PREFIX):
+            self.stats.record('misses')
+            return None
+        self.stats.record('hits')
+        return json.loads(raw)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        found = {}
+        for key, raw in zip(keys, self.client.mget([self.prefix + key for key in keys])):
+            if raw is not None and not raw.startswith(LEASE_PREFIX):
+                found[key] = json.loads(raw)
+        self.stats.record('hits', len(found))
+        self.stats.record('misses', len(keys) - len(found))
+        return found
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl if ttl is None else ttl)
+
+    def set_many(self, mapping, ttl=None):
+        for key, value in mapping.items():
+            self.set(key, value, ttl)
+
+    def lease(self, key, ttl):
+        token = LEASE_PREFIX + uuid.uuid4().hex.encode()
+        return token if self.client.set(self.prefix + key, token, nx=True, ex=ttl) else None
+
+    def fill(self, key, token, value, ttl=None):
+        return bool(self._fill(keys=[self.prefix + key], args=[token, json.dumps(value), self.ttl if ttl is None else ttl]))
+
+    def lease_many(self, keys, ttl):
+        # One round trip for all of them.
+        keys = list(keys)
+        tokens = [LEASE_PREFIX + uuid.uuid4().hex.encode() for _ in keys]
+        pipe = self.client.pipeline(transaction=False)
+        for key, token in zip(keys, tokens):
+            pipe.set(self.prefix + key, token, nx=True, ex=ttl)
+        return {key: token if placed else None for key, token, placed in zip(keys, tokens, pipe.execute())}
+
+    def fill_many(self, tokens, mapping, ttl=None):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            self._fill(keys=[self.prefix + key], args=[tokens[key], json.dumps(value), self.ttl if ttl is None else ttl], client=pipe)
+        pipe.execute()
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def info(self):
+        info = dict(self.stats.as_dict(), backend='redis', ttl=self.ttl)
+        try:
+            info['evictions'] = int(self.client.info('stats').get('evicted_keys', 0))
+        except Exception:
+            pass
+        return info
+
+
+class NullCache:
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key):
+        self.stats.record('misses')
+        return None
+
+    def get_many(self, keys):
+        return {}
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def set_many(self, mapping, ttl=None):
+        pass
+
+    def lease(self, key, ttl):
+        return None
+
+    def fill(self, key, token, value, ttl=None):
+        return False
+
+    def lease_many(self, keys, ttl):
+        return {key: None for key in keys}
+
+    def fill_many(self, tokens, mapping, ttl=None):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def info(self):
+        return dict(self.stats.as_dict(), backend='null')
+
+
+class Cache:
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.lease_ttl = DEFAULT_LEASE_TTL
+        self.errors = 0
+        self._error_logged = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_MAX_ENTRIES', 10000)
+        app.config.setdefault('CACHE_TTL', 300)
+        app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        app.config.setdefault('CACHE_LEASE_TTL', DEFAULT_LEASE_TTL)
+        self.lease_ttl = app.config['CACHE_LEASE_TTL']
+        backend = app.config['CACHE_BACKEND']
+        if backend == 'memory':
+            self.backend = LRUCache(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_TTL'])
+        elif backend == 'redis':
+            import redis
+            self.backend = RedisCache(redis.Redis.from_url(app.config['CACHE_REDIS_URL']), app.config['CACHE_TTL'])
+        elif backend == 'null':
+            self.backend = NullCache()
+        else:
+            raise ValueError(f'Unknown CACHE_BACKEND {backend!r}')
+        app.extensions['cache'] = self
+
+    def _call(self, fallback, method, *args):
+        # A cache outage degrades to misses and skipped fills instead of failing requests (token revocation
+        # checks read through here). Invalidations that fail leave entries to expire by TTL.
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception:
+            self.errors += 1
+            now = time.monotonic()
+            if now - self._error_logged >= BACKEND_ERROR_LOG_INTERVAL:
+                self._error_logged = now
+                logger.exception('cache backend failed; serving from the database until it recovers')
+            return fallback
+
+    def get(self, key):
+        return self._call(None, 'get', key)
+
+    def get_many(self, keys):
+        return self._call({}, 'get_many', keys)
+
+    def set(self, key, value, ttl=None):
+        self._call(None, 'set', key, value, ttl)
+
+    def set_many(self, mapping, ttl=None):
+        self._call(None, 'set_many', mapping, ttl)
+
+    def delete(self, *keys):
+        self._call(None, 'delete', *keys)
+
+    def clear(self):
+        self._call(None, 'clear')
+
+    def lease(self, key):
+        # Take before loading a missed key from the database and hand to fill() afterwards. An invalidation
+        # in between removes the lease, so a reader that loaded the row before a write cannot cache it after
+        # the write's invalidation. None when another reader holds the lease: load, but do not cache.
+        return self._call(None, 'lease', key, self.lease_ttl)
+
+    def fill(self, key, token, value, ttl=None):
+        if token is not None and value is not None:
+            self._call(False, 'fill', key, token, value, ttl)
+
+    def lease_many(self, keys):
+        keys = list(keys)
+        return self._call({key: None for key in keys}, 'lease_many', keys, self.lease_ttl)
+
+    def fill_many(self, tokens, mapping, ttl=None):
+        mapping = {key: value for key, value in mapping.items() if tokens.get(key) is not None and value is not None}
+        if mapping:
+            self._call(None, 'fill_many', tokens, mapping, ttl)
+
+    def get_or_set(self, key, loader, ttl=None):
+        # Read-through: misses fall back to loader(); a None result (e.g. not found) is never cached.
+        value = self.get(key)
+        if value is None:
+            token = self.lease(key)
+            value = loader()
+            self.fill(key, token, value, ttl)
+        return value
+
+    def invalidate_post(self, post_id):
+        self.delete(post_key(post_id), post_counts_key(post_id))
+
+    def invalidate_posts(self, post_ids):
+        keys = [key for post_id in post_ids for key in (post_key(post_id), post_counts_key(post_id))]
+        if keys:
+            self.delete(*keys)
+
+    def invalidate_user(self, user_id):
+        self.delete(user_key(user_id))
+
+    def info(self):
+        return dict(self._call({}, 'info'), errors=self.errors)
+
+
+cache = Cache()
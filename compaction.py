@@ -0,0 +1,258 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, exists, func, select, update
+from models import db, Comment, Follow, Like, Post, TimelineEntry, User, adjust_counters
+from cache import cache
+from search import unindex_comments, unindex_posts
+
+logger = logging.getLogger(__name__)
+
+COMPACTION_DEFAULTS = {
+    'COMPACTION_ENABLED': True,
+    'COMPACTION_BATCH_SIZE': 500,
+    'COMPACTION_INTERVAL': 30,
+    'COMPACTION_PAUSE': 0.01,
+}
+
+
+def delete_batch(model, criteria, limit, returning=()):
+    # DELETE ... WHERE id IN (SELECT id ... LIMIT n): one short write however many rows match.
+    ids = select(model.id).where(*criteria).limit(limit)
+    return db.session.execute(
+        delete(model).where(model.id.in_(ids)).returning(model.id, *returning),
+        execution_options={'synchronize_session': False},
+    ).all()
+
+
+def tombstone_batch(model, criteria, limit, returning=()):
+    # Only rows this call actually tombstoned come back, so counter deltas stay right if two compactors race.
+    ids = select(model.id).where(model.not_tombstoned(), *criteria).limit(limit)
+    return db.session.execute(
+        update(model).where(model.id.in_(ids), model.not_tombstoned()).values(deleted_at=datetime.utcnow()).returning(model.id, *returning),
+        execution_options={'synchronize_session': False},
+    ).all()
+
+
+def negative_counts(values):
+    return {key: -count for key, count in Counter(values).items()}
+
+
+class Compactor:
+    # Deletes only write a tombstone (deleted_at) and the compactor does the rest in the background: it
+    # hard-deletes tombstoned comments, tombstoned posts with their comments, likes and timeline entries,
+    # and retires deleted users by tombstoning their posts and comments and removing their likes and
+    # follows. Each batch of at most COMPACTION_BATCH_SIZE rows is its own transaction, so other writers
+    # never wait long for the lock.
+    def __init__(self, app=None):
+        self.app = None
+        self.config = dict(COMPACTION_DEFAULTS)
+        self.batches = 0
+        self.rows = 0
+        self.longest_batch = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for key, value in COMPACTION_DEFAULTS.items():
+            app.config.setdefault(key, value)
+        self.app = app
+        self.config = {key: app.config[key] for key in COMPACTION_DEFAULTS}
+        app.extensions['compactor'] = self
+        app.cli.add_command(compact_command)
+
+    @property
+    def batch_size(self):
+        return self.config['COMPACTION_BATCH_SIZE']
+
+    def wake(self):
+        # Call after a delete commits.
+        if not self.config['COMPACTION_ENABLED'] or self.app is None:
+            return
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='compactor', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.config['COMPACTION_INTERVAL'])
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.compact()
+                except Exception:
+                    logger.exception('compaction failed; the tombstones are picked up again on the next run')
+                    db.session.rollback()
+
+    def compact(self, max_batches=None):
+        # Runs batches until nothing is left to do; returns the number of rows written.
+        written = batches = 0
+        while max_batches is None or batches < max_batches:
+            started = time.perf_counter()
+            rows = self.step()
+            if not rows:
+                break
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.batches += 1
+                self.rows += rows
+                self.longest_batch = max(self.longest_batch, elapsed)
+            written += rows
+            batches += 1
+            time.sleep(self.config['COMPACTION_PAUSE'])
+        return written
+
+    def step(self):
+        # One batch from the first stage with work left. Tombstoned comments go first, so the later
+        # stages only have to look for live comments through the partial indexes.
+        return self.purge_comments() or self.purge_posts() or self.retire_users()
+
+    def purge_comments(self):
+        # Counters and the search index were updated when the comment was tombstoned.
+        rows = delete_batch(Comment, [Comment.deleted_at.is_not(None)], self.batch_size)
+        db.session.commit()
+        return len(rows)
+
+    def purge_posts(self):
+        post_ids = db.session.execute(select(Post.id).where(Post.deleted_at.is_not(None)).limit(self.batch_size)).scalars().all()
+        if not post_ids:
+            return 0
+        comments = delete_batch(Comment, [Comment.post_id.in_(post_ids), Comment.not_tombstoned()], self.batch_size)
+        if comments:
+            unindex_comments([row.id for row in comments])
+            db.session.commit()
+            return len(comments)
+        for model in (Like, TimelineEntry):
+            rows = delete_batch(model, [model.post_id.in_(post_ids)], self.batch_size)
+            if rows:
+                db.session.commit()
+                return len(rows)
+        # Anything written against these posts since the batches above keeps them for the next run.
+        rows = delete_batch(Post, [
+            Post.id.in_(post_ids),
+            Post.deleted_at.is_not(None),
+            ~exists().where(Comment.post_id == Post.id, Comment.not_tombstoned()),
+            ~exists().where(Comment.post_id == Post.id, Comment.deleted_at.is_not(None)),
+            ~exists().where(Like.post_id == Post.id),
+            ~exists().where(TimelineEntry.post_id == Post.id),
+        ], self.batch_size)
+        db.session.commit()
+        return len(rows)
+
+    def retire_users(self):
+        user_ids = db.session.execute(
+            select(User.id).where(User.deleted_at.is_not(None)).order_by(User.deleted_at).limit(self.batch_size)
+        ).scalars().all()
+        for user_id in user_ids:
+            rows = self.retire_user(user_id)
+            if rows:
+                return rows
+        return 0
+
+    def retire_user(self, user_id):
+        # One batch of a deleted user's remaining rows. Their tombstoned posts are purged by purge_posts;
+        # the user row goes once nothing refers to it.
+        posts = tombstone_batch(Post, [Post.user_id == user_id], self.batch_size)
+        if posts:
+            post_ids = [row.id for row in posts]
+            unindex_posts(post_ids)
+            db.session.commit()
+            for post_id in post_ids:
+                cache.invalidate_post(post_id)
+            return len(posts)
+        comments = tombstone_batch(Comment, [Comment.user_id == user_id], self.batch_size, returning=(Comment.post_id,))
+        if comments:
+            unindex_comments([row.id for row in comments])
+            deltas = negative_counts(row.post_id for row in comments)
+            adjust_counters(Post, 'comments_count', deltas)
+            db.session.commit()
+            for post_id in deltas:
+                cache.invalidate_post(post_id)
+            return len(comments)
+        likes = delete_batch(Like, [Like.user_id == user_id], self.batch_size, returning=(Like.post_id,))
+        if likes:
+            deltas = negative_counts(row.post_id for row in likes)
+            adjust_counters(Post, 'likes_count', deltas)
+            db.session.commit()
+            for post_id in deltas:
+                cache.invalidate_post(post_id)
+            return len(likes)
+        for column, other, counter in (
+            (Follow.follower_id, Follow.followed_id, 'followers_count'),
+            (Follow.followed_id, Follow.follower_id, 'following_count'),
+        ):
+            follows = delete_batch(Follow, [column == user_id], self.batch_size, returning=(other,))
+            if follows:
+                deltas = negative_counts(row[1] for row in follows)
+                adjust_counters(User, counter, deltas)
+                db.session.commit()
+                for other_id in deltas:
+                    cache.invalidate_user(other_id)
+                return len(follows)
+        timeline = delete_batch(TimelineEntry, [TimelineEntry.user_id == user_id], self.batch_size)
+        if timeline:
+            db.session.commit()
+            return len(timeline)
+        removed = db.session.execute(
+            delete(User).where(
+                User.id == user_id,
+                User.deleted_at.is_not(None),
+                ~exists().where(Post.user_id == user_id, Post.not_tombstoned()),
+                ~exists().where(Post.user_id == user_id, Post.deleted_at.is_not(None)),
+                ~exists().where(Comment.user_id == user_id, Comment.not_tombstoned()),
+                ~exists().where(Like.user_id == user_id),
+                ~exists().where(Follow.follower_id == user_id),
+                ~exists().where(Follow.followed_id == user_id),
+            ),
+            execution_options={'synchronize_session': False},
+        ).rowcount
+        db.session.commit()
+        if removed:
+            cache.invalidate_user(user_id)
+        return removed
+
+    def info(self):
+        # Tombstone counts come from the partial indexes over deleted rows.
+        pending = {
+            model.__tablename__: db.session.execute(select(func.count()).select_from(model).where(model.deleted_at.is_not(None))).scalar()
+            for model in (User, Post, Comment)
+        }
+        with self._lock:
+            return {
+                'pending': pending,
+                'batches': self.batches,
+                'rows': self.rows,
+                'longest_batch_ms': round(self.longest_batch * 1000, 2),
+            }
+
+
+compactor = Compactor()
+
+
+@click.command('compact')
+@click.option('--once', is_flag=True, help='Compact what is tombstoned now and exit instead of polling forever.')
+@with_appcontext
+def compact_command(once):
+    """Hard-delete tombstoned rows and what depends on them, in small batches."""
+    interval = compactor.config['COMPACTION_INTERVAL']
+    while True:
+        written = compactor.compact()
+        if written:
+            click.echo(f'compacted {written} rows')
+        if once:
+            break
+        time.sleep(interval)
@@ -0,0 +1,28 @@
+import hashlib
+from flask import current_app, request
+
+
+def make_etag(*parts):
+    # Weak validator over whatever the representation depends on: timestamps, counters, requested fields.
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def has_validators():
+    return bool(request.if_none_match)
+
+
+def is_not_modified(etag):
+    # ETag only: every representation carries counters that change without touching updated_at, and an unlike
+    # or a comment delete can move the newest timestamp backwards, so Last-Modified could answer 304 to a stale copy.
+    return bool(request.if_none_match) and request.if_none_match.contains_weak(etag)
+
+
+def with_validators(response, etag):
+    response.set_etag(etag, weak=True)
+    # Bodies are per user behind a JWT: shared caches must not store them, clients must revalidate.
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag):
+    return with_validators(current_app.response_class(status=304), etag)
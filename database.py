@@ -0,0 +1,110 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from models import db
+
+DATABASE_DEFAULTS = {
+    'DB_POOL_SIZE': 10,
+    'DB_MAX_OVERFLOW': 20,
+    'DB_POOL_TIMEOUT': 30,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_POOL_PRE_PING': True,
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_CACHE_SIZE_KB': 64 * 1024,
+}
+
+
+def normalize_database_uri(uri):
+    # Hosted Postgres providers still hand out the legacy postgres:// scheme, which SQLAlchemy rejects.
+    if uri.startswith('postgres://'):
+        return 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def is_sqlite_memory(uri):
+    return is_sqlite(uri) and make_url(uri).database in (None, '', ':memory:')
+
+
+# Async drivers for asgi.py; psycopg 3 is async-capable as is.
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def async_database_uri(uri):
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend == 'postgresql' and url.get_driver_name() == 'psycopg':
+        return uri
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver known for {backend}; set ASYNC_DATABASE_URL')
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def engine_options(uri, config):
+    if is_sqlite(uri):
+        # SQLite has a single writer; pool sizing does not apply, the busy timeout does.
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def sqlite_pragmas(config, memory=False):
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA cache_size = -{int(config['SQLITE_CACHE_SIZE_KB'])}",
+        'PRAGMA temp_store = MEMORY',
+    ]
+    if not memory:
+        pragmas.insert(0, f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}")
+        pragmas.append(f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}")
+    return pragmas
+
+
+def enable_sqlite_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def init_db(app):
+    for key, value in DATABASE_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    uri = normalize_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    options = engine_options(uri, app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    db.init_app(app)
+    if is_sqlite(uri):
+        with app.app_context():
+            enable_sqlite_pragmas(db.engine, sqlite_pragmas(app.config, memory=is_sqlite_memory(uri)))
+
+
+def create_async_db_engine(app):
+    # A second engine over the same database for the async read views (pip install aiosqlite / asyncpg).
+    from sqlalchemy.ext.asyncio import create_async_engine
+    uri = normalize_database_uri(app.config.get('ASYNC_DATABASE_URL') or async_database_uri(app.config['SQLALCHEMY_DATABASE_URI']))
+    if is_sqlite_memory(uri):
+        raise ValueError('The async views need a database file or server; an in-memory SQLite database is private to one engine')
+    options = engine_options(uri, app.config)
+    if is_sqlite(uri):
+        # aiosqlite runs one thread per connection, so the pool bounds how many queries run at once.
+        options.update(pool_size=app.config['DB_POOL_SIZE'], max_overflow=app.config['DB_MAX_OVERFLOW'], pool_timeout=app.config['DB_POOL_TIMEOUT'])
+    engine = create_async_engine(uri, **options)
+    if is_sqlite(uri):
+        enable_sqlite_pragmas(engine.sync_engine, sqlite_pragmas(app.config))
+    return engine
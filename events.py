@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_, bindparam, event, or_, select, update
+from models import db, OutboxEvent
+from compaction import delete_batch
+
+logger = logging.getLogger(__name__)
+
+EVENTS_DEFAULTS = {
+    'EVENT_WORKERS': 2,
+    'EVENT_QUEUE_SIZE': 1000,
+    'EVENT_BATCH_SIZE': 100,
+    'EVENT_MAX_ATTEMPTS': 5,
+    'EVENT_LEASE_SECONDS': 60,
+    'EVENT_POLL_INTERVAL': 5,
+    'EVENT_RETENTION': 86400,
+    'EVENT_FAILED_RETENTION': 7 * 86400,
+    'EVENT_PURGE_BATCH_SIZE': 500,
+    'EVENT_PURGE_INTERVAL': 60,
+}
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(2 ** attempts, 300))
+
+
+class EventBus:
+    # Transactional outbox: emit() writes an outbox row in the caller's transaction, so an event exists
+    # exactly when the write that caused it commits. After commit the ids are handed to in-process
+    # workers; anything they miss (full queue, crash, retries) is picked up by drain() from the table.
+    # Event types nobody subscribed to are not written at all, and purge() removes finished rows.
+    def __init__(self, app=None):
+        self.app = None
+        self.handlers = defaultdict(list)
+        self.config = dict(EVENTS_DEFAULTS)
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._listening = False
+        self._purged_at = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for key, value in EVENTS_DEFAULTS.items():
+            app.config.setdefault(key, value)
+        self.app = app
+        self.config = {key: app.config[key] for key in EVENTS_DEFAULTS}
+        app.extensions['events'] = self
+        app.cli.add_command(drain_outbox_command)
+        if not self._listening:
+            event.listen(db.session, 'after_flush', self._collect_ids)
+            event.listen(db.session, 'after_commit', self._dispatch_committed)
+            event.listen(db.session, 'after_soft_rollback', self._discard_ids)
+            self._listening = True
+
+    def subscribe(self, event_type, handler):
+        # Handlers receive a list of payloads of one event type and must be idempotent.
+        if handler not in self.handlers[event_type]:
+            self.handlers[event_type].append(handler)
+
+    def emit(self, event_type, **payload):
+        # Subscribe in create_app, before any request: every process, drainers included, then agrees on what is recorded.
+        if not self.handlers.get(event_type):
+            return
+        db.session.add(OutboxEvent(event_type=event_type, payload=json.dumps(payload), available_at=datetime.utcnow()))
+
+    def emit_many(self, event_type, payloads):
+        if not self.handlers.get(event_type) or not payloads:
+            return
+        now = datetime.utcnow()
+        db.session.add_all([OutboxEvent(event_type=event_type, payload=json.dumps(payload), available_at=now) for payload in payloads])
+
+    def _collect_ids(self, session, flush_context):
+        ids = [obj.id for obj in session.new if isinstance(obj, OutboxEvent)]
+        if ids:
+            session.info.setdefault('outbox_ids', []).extend(ids)
+
+    def _discard_ids(self, session, previous_transaction):
+        session.info.pop('outbox_ids', None)
+
+    def _dispatch_committed(self, session):
+        ids = session.info.pop('outbox_ids', None)
+        if not ids or not self.config['EVENT_WORKERS'] or self.app is None:
+            return
+        event_queue = self._ensure_workers()
+        for event_id in ids:
+            try:
+                event_queue.put_nowait(event_id)
+            except queue.Full:
+                # Still durable in the outbox; the poller will get to it.
+                break
+
+    def _ensure_workers(self):
+        # Started lazily and per process so pre-forking servers never inherit dead threads.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stopping.clear()
+                self._queue = queue.Queue(maxsize=self.config['EVENT_QUEUE_SIZE'])
+                self._threads = [threading.Thread(target=self._work, name=f'event-worker-{n}', daemon=True) for n in range(self.config['EVENT_WORKERS'])]
+                self._threads.append(threading.Thread(target=self._poll, name='event-poller', daemon=True))
+                for thread in self._threads:
+                    thread.start()
+            return self._queue
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                batch = [self._queue.get(timeout=1)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.config['EVENT_BATCH_SIZE']:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                try:
+                    self.process(batch)
+                except Exception:
+                    logger.exception('event batch failed; it stays in the outbox for retry')
+                    db.session.rollback()
+
+    def _poll(self):
+        while not self._stopping.wait(self.config['EVENT_POLL_INTERVAL']):
+            with self.app.app_context():
+                try:
+                    while self.drain() == self.config['EVENT_BATCH_SIZE']:
+                        pass
+                    if time.monotonic() - self._purged_at >= self.config['EVENT_PURGE_INTERVAL']:
+                        self._purged_at = time.monotonic()
+                        self.purge()
+                except Exception:
+                    logger.exception('outbox poll failed')
+                    db.session.rollback()
+
+    def stop(self):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        self._pid = None
+
+    def _claim(self, ids):
+        # A lease makes concurrent consumers (threads here, drain-outbox processes elsewhere) skip each other's rows.
+        now = datetime.utcnow()
+        claimed = db.session.execute(
+            update(OutboxEvent)
+            .where(
+                OutboxEvent.id.in_(ids),
+                OutboxEvent.processed_at.is_(None),
+                OutboxEvent.failed_at.is_(None),
+                OutboxEvent.available_at <= now,
+                or_(OutboxEvent.locked_until.is_(None), OutboxEvent.locked_until < now),
+            )
+            .values(locked_until=now + timedelta(seconds=self.config['EVENT_LEASE_SECONDS']))
+            .returning(OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.payload, OutboxEvent.attempts),
+            execution_options={'synchronize_session': False},
+        ).all()
+        db.session.commit()
+        return claimed
+
+    def process(self, ids):
+        claimed = self._claim(ids)
+        if not claimed:
+            return 0
+        groups = defaultdict(list)
+        for row in claimed:
+            groups[row.event_type].append(row)
+        # One transaction per event type: a failing handler only sends its own group back for retry.
+        for event_type, rows in groups.items():
+            try:
+                payloads = [json.loads(row.payload) for row in rows]
+                for handler in self.handlers.get(event_type, ()):
+                    handler(payloads)
+                self._finish(rows)
+                db.session.commit()
+            except Exception as e:
+                logger.exception('handler for %s failed', event_type)
+                db.session.rollback()
+                self._retry(rows, repr(e)[:500])
+                db.session.commit()
+        return len(claimed)
+
+    def _finish(self, rows):
+        table = OutboxEvent.__table__
+        db.session.execute(
+            table.update().where(table.c.id.in_([row.id for row in rows])).values(processed_at=datetime.utcnow(), locked_until=None)
+        )
+
+    def _retry(self, rows, error):
+        now = datetime.utcnow()
+        params = []
+        for row in rows:
+            attempts = row.attempts + 1
+            exhausted = attempts >= self.config['EVENT_MAX_ATTEMPTS']
+            params.append({
+                'event_id': row.id,
+                'attempts': attempts,
+                'error': error,
+                'available_at': now + retry_delay(attempts),
+                'failed_at': now if exhausted else None,
+            })
+        table = OutboxEvent.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('event_id')).values(
+                attempts=bindparam('attempts'),
+                last_error=bindparam('error'),
+                available_at=bindparam('available_at'),
+                failed_at=bindparam('failed_at'),
+                locked_until=None,
+            ),
+            params,
+        )
+
+    def drain(self, batch_size=None):
+        # Process one batch of due events straight from the outbox; returns how many were claimed.
+        now = datetime.utcnow()
+        ids = db.session.execute(
+            select(OutboxEvent.id)
+            .where(
+                OutboxEvent.processed_at.is_(None),
+                OutboxEvent.failed_at.is_(None),
+                OutboxEvent.available_at <= now,
+                or_(OutboxEvent.locked_until.is_(None), OutboxEvent.locked_until < now),
+            )
+            .order_by(OutboxEvent.id)
+            .limit(batch_size or self.config['EVENT_BATCH_SIZE'])
+        ).scalars().all()
+        db.session.commit()
+        return self.process(ids) if ids else 0
+
+    def purge(self):
+        # Deletes events processed more than EVENT_RETENTION seconds ago and failed ones past
+        # EVENT_FAILED_RETENTION, one short transaction per batch; returns how many rows went.
+        now = datetime.utcnow()
+        finished = or_(
+            OutboxEvent.processed_at < now - timedelta(seconds=self.config['EVENT_RETENTION']),
+            and_(OutboxEvent.processed_at.is_(None), OutboxEvent.failed_at < now - timedelta(seconds=self.config['EVENT_FAILED_RETENTION'])),
+        )
+        batch_size = self.config['EVENT_PURGE_BATCH_SIZE']
+        purged = 0
+        while True:
+            rows = delete_batch(OutboxEvent, [finished], batch_size)
+            db.session.commit()
+            purged += len(rows)
+            if len(rows) < batch_size:
+                return purged
+
+
+bus = EventBus()
+
+
+@click.command('drain-outbox')
+@click.option('--once', is_flag=True, help='Drain what is due now and exit instead of polling forever.')
+@click.option('--batch-size', type=int, default=None)
+@with_appcontext
+def drain_outbox_command(once, batch_size):
+    """Process outbox events in a dedicated worker process."""
+    interval = bus.config['EVENT_POLL_INTERVAL']
+    while True:
+        processed = bus.drain(batch_size)
+        if processed:
+            click.echo(f'processed {processed} events')
+            continue
+        purged = bus.purge()
+        if purged:
+            click.echo(f'purged {purged} finished events')
+        if once:
+            break
+        time.sleep(interval)
@@ -0,0 +1,86 @@
+from sqlalchemy import func, select
+from models import db, Comment, Like, Post, User
+from pagination import encode_cursor, keyset_order, paginate
+from serializers import author_schema, comment_schema
+from like_buffer import like_buffer
+
+INCLUDES = ('author', 'comments', 'like_count', 'liked_by_me')
+DEFAULT_EMBEDDED_COMMENTS = 3
+MAX_EMBEDDED_COMMENTS = 50
+
+
+def parse_includes(value):
+    if not value:
+        return ()
+    names = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in names if name not in INCLUDES]
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(unknown)}. Allowed: {', '.join(INCLUDES)}")
+    return names
+
+
+def expand_posts(posts, includes, user_id, comments_limit=DEFAULT_EMBEDDED_COMMENTS, comments_cursor=None):
+    # Adds the requested includes to a page of post dicts with at most one query per include,
+    # however many posts are on the page. Returns new dicts; the originals may be cached.
+    if not includes or not posts:
+        return posts
+    post_ids = [post['id'] for post in posts]
+    extras = {post_id: {} for post_id in post_ids}
+    if 'author' in includes:
+        for post_id, author in load_authors(post_ids).items():
+            extras[post_id]['author'] = author
+    if 'comments' in includes:
+        if comments_cursor:
+            comments = {post_ids[0]: load_comment_page(post_ids[0], comments_limit, comments_cursor)}
+        else:
+            comments = load_latest_comments(post_ids, comments_limit)
+        for post_id in post_ids:
+            extras[post_id]['comments'] = comments.get(post_id, {'items': [], 'next_cursor': None})
+    if 'like_count' in includes:
+        counts = {post['id']: post['likes_count'] for post in posts if 'likes_count' in post}
+        if len(counts) < len(post_ids):
+            counts = dict(db.session.execute(select(Post.id, Post.likes_count).where(Post.id.in_(post_ids))).all())
+        for post_id in post_ids:
+            extras[post_id]['like_count'] = counts.get(post_id, 0) + (like_buffer.pending_delta(post_id) if like_buffer.enabled else 0)
+    if 'liked_by_me' in includes:
+        liked = set(db.session.execute(select(Like.post_id).where(Like.user_id == user_id, Like.post_id.in_(post_ids))).scalars())
+        for post_id in post_ids:
+            buffered = like_buffer.is_liked(post_id, user_id) if like_buffer.enabled else None
+            extras[post_id]['liked_by_me'] = (post_id in liked) if buffered is None else buffered
+    return [dict(post, **extras[post['id']]) for post in posts]
+
+
+def load_authors(post_ids):
+    dump = author_schema.dumper()
+    rows = db.session.execute(
+        select(Post.id.label('post_id'), *author_schema.columns()).join(User, User.id == Post.user_id).where(Post.id.in_(post_ids))
+    ).all()
+    return {row.post_id: dump(row) for row in rows}
+
+
+def load_latest_comments(post_ids, limit):
+    # The newest `limit` comments of every post in one statement: number each post's comments with a
+    # window function and keep the first limit + 1, the extra one only signalling that there are more.
+    position = func.row_number().over(partition_by=Comment.post_id, order_by=keyset_order(Comment)).label('position')
+    ranked = select(*comment_schema.columns(), position).where(Comment.post_id.in_(post_ids), Comment.live()).subquery()
+    rows = db.session.execute(
+        select(ranked).where(ranked.c.position <= limit + 1).order_by(ranked.c.post_id, ranked.c.position)
+    ).all()
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row.post_id, []).append(row)
+    dump = comment_schema.dumper()
+    pages = {}
+    for post_id, comments in grouped.items():
+        next_cursor = None
+        if len(comments) > limit:
+            comments = comments[:limit]
+            next_cursor = encode_cursor(comments[-1].created_at, comments[-1].id)
+        pages[post_id] = {'items': list(map(dump, comments)), 'next_cursor': next_cursor}
+    return pages
+
+
+def load_comment_page(post_id, limit, cursor):
+    stmt = select(*comment_schema.columns()).where(Comment.post_id == post_id, Comment.live())
+    comments, next_cursor = paginate(db.session, stmt, Comment, cursor=cursor, limit=limit)
+    return {'items': comment_schema.dump_many(comments), 'next_cursor': next_cursor}
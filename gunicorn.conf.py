@@ -0,0 +1,44 @@
+import glob
+import multiprocessing
+import os
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 8000)}")
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))  # above 1 selects the gthread worker
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+backlog = int(os.environ.get('WEB_BACKLOG', 2048))
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+# Recycling workers bounds slow memory growth; the jitter keeps them from restarting together.
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('WEB_ACCESS_LOG')
+# The app is imported once per worker, so background threads, the hashing pool and database
+# connections are all created after fork().
+preload_app = False
+
+# The memory cache lives in each worker: after an edit served by one worker, the others keep the old post
+# or profile for up to CACHE_TTL. Several workers therefore need CACHE_BACKEND chosen explicitly.
+# Metrics, the memory rate limiter and the like buffer are per worker too; see "Serving in Production".
+def on_starting(server):
+    count = server.cfg.workers
+    if count > 1 and 'CACHE_BACKEND' not in os.environ:
+        raise RuntimeError(
+            f'{count} workers need a shared cache: set CACHE_BACKEND=redis (or null). '
+            'CACHE_BACKEND=memory keeps a separate cache per worker, which can serve stale posts for up to CACHE_TTL.'
+        )
+    if count > 1 and os.environ['CACHE_BACKEND'] == 'memory':
+        server.log.warning('CACHE_BACKEND=memory with %d workers: each worker caches separately and may serve stale data', count)
+    if count > 1 and os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'memory' and os.environ.get('RATE_LIMIT_ENABLED', '1') == '1':
+        server.log.warning('RATE_LIMIT_BACKEND=memory with %d workers: each worker keeps its own buckets, '
+                           'so a client may get up to %d times each limit', count, count)
+    metrics_dir = os.environ.get('METRICS_MULTIPROC_DIR')
+    if metrics_dir:
+        # Files left by a previous run would be added to this run's counters.
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, 'metrics-*.json')):
+            os.remove(path)
+    elif count > 1:
+        server.log.warning('METRICS_MULTIPROC_DIR is unset: /metrics reports only the worker that answers the scrape')
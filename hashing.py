@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+from flask import jsonify
+
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _password_bytes(password):
+    # bcrypt only looks at the first 72 bytes; truncate explicitly so bcrypt>=5 does not reject long input.
+    if isinstance(password, str):
+        password = password.encode('utf-8')
+    return password[:BCRYPT_MAX_PASSWORD_BYTES]
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def verify_password(password, password_hash):
+    if not password_hash:
+        return False
+    try:
+        return bcrypt.checkpw(_password_bytes(password), password_hash.encode('utf-8'))
+    except ValueError:
+        return False
+
+
+def hash_rounds(password_hash):
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def pool_context():
+    # fork() copies the parent's locks in whatever state its other threads left them, which can deadlock the
+    # child under a threaded server. Spawned workers start from a fresh interpreter instead. The fork server is
+    # no better here: it is shared with every process forked after it started, and their pools cannot wait on it.
+    return multiprocessing.get_context('spawn')
+
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.workers = 0
+        self.queue_size = 0
+        self.timeout = 10
+        self._executor = None
+        self._executor_pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.listeners = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_SIZE', 32)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.queue_size = app.config['PASSWORD_HASH_QUEUE_SIZE']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self.shutdown()
+        app.extensions['password_hasher'] = self
+        app.register_error_handler(HasherBusy, self._busy_response)
+
+    @staticmethod
+    def _busy_response(error):
+        return jsonify({'error': 'Authentication service is busy, please retry'}), 503, {'Retry-After': '1'}
+
+    def _get_executor(self):
+        # Created lazily and per process so pre-forking servers never share a pool across fork().
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context())
+                self._executor_pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+            return self._executor, self._slots
+
+    def _discard(self, executor):
+        # A pool whose worker died (OOM kill, segfault) stays broken; the next call gets a fresh one.
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._executor_pid = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        for _ in range(2):
+            executor, slots = self._get_executor()
+            if not slots.acquire(blocking=False):
+                raise HasherBusy()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                slots.release()
+                self._discard(executor)
+                continue
+            except Exception:
+                slots.release()
+                raise
+            future.add_done_callback(lambda _, slots=slots: slots.release())
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                future.cancel()
+                raise HasherBusy()
+            except BrokenProcessPool:
+                self._discard(executor)
+        raise HasherBusy()
+
+    def _timed(self, operation, fn, *args):
+        # listeners(operation, seconds) see the full cost a request pays, queueing for a worker included.
+        if not self.listeners:
+            return self._run(fn, *args)
+        started = time.perf_counter()
+        try:
+            return self._run(fn, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            for listener in self.listeners:
+                listener(operation, elapsed)
+
+    def hash(self, password):
+        return self._timed('hash', hash_password, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        return self._timed('verify', verify_password, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        return hash_rounds(password_hash) != self.rounds
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+            self._executor_pid = None
+
+
+password_hasher = PasswordHasher()
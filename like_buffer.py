@@ -0,0 +1,230 @@
+import atexit
+import logging
+import os
+import threading
+from collections import defaultdict
+from sqlalchemy import exists, select
+from models import db, Like, Post, adjust_counters
+from cache import cache
+from events import bus
+
+logger = logging.getLogger(__name__)
+
+LIKE_BUFFER_DEFAULTS = {
+    'LIKE_BUFFER_ENABLED': False,
+    'LIKE_BUFFER_MAX_PENDING': 1000,
+    'LIKE_BUFFER_FLUSH_INTERVAL': 0.5,
+}
+
+FLUSH_CHUNK = 500
+
+
+class LikeBuffer:
+    # Optional write-behind mode for likes. like()/unlike() record the new state of a (post_id, user_id)
+    # pair in memory and answer straight away; a background thread writes everything pending in one
+    # transaction every LIKE_BUFFER_FLUSH_INTERVAL seconds, or as soon as LIKE_BUFFER_MAX_PENDING changes
+    # pile up. Only real changes against the database are kept, so like + unlike before a flush cancel
+    # out. Changes still in memory are lost if the process dies.
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.max_pending = LIKE_BUFFER_DEFAULTS['LIKE_BUFFER_MAX_PENDING']
+        self.flush_interval = LIKE_BUFFER_DEFAULTS['LIKE_BUFFER_FLUSH_INTERVAL']
+        self.flushed = 0
+        self._pending = {}
+        self._deltas = defaultdict(int)
+        self._flushing = {}
+        self._flushing_deltas = defaultdict(int)
+        self._generation = 0
+        self._committing = False
+        self._lock = threading.Lock()
+        self._committed = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for key, value in LIKE_BUFFER_DEFAULTS.items():
+            app.config.setdefault(key, value)
+        self.app = app
+        self.enabled = bool(app.config['LIKE_BUFFER_ENABLED'])
+        self.max_pending = app.config['LIKE_BUFFER_MAX_PENDING']
+        self.flush_interval = app.config['LIKE_BUFFER_FLUSH_INTERVAL']
+        app.extensions['like_buffer'] = self
+        if self.enabled:
+            atexit.register(self._flush_at_exit)
+
+    def like(self, post_id, user_id):
+        return self._change(post_id, user_id, True)
+
+    def unlike(self, post_id, user_id):
+        return self._change(post_id, user_id, False)
+
+    def _change(self, post_id, user_id, liked):
+        # None: no such post. False: already in that state. True: accepted.
+        key = (post_id, user_id)
+        while True:
+            generation = self._generation
+            in_db = self._db_state(post_id, user_id)
+            if in_db is None:
+                return None
+            with self._lock:
+                if generation != self._generation:
+                    # A flush committed while we were reading; read again so the baseline is current.
+                    continue
+                baseline = self._flushing.get(key, in_db)
+                current = self._pending.get(key, baseline)
+                if current == liked:
+                    return False
+                if liked == baseline:
+                    del self._pending[key]
+                else:
+                    self._pending[key] = liked
+                self._deltas[post_id] += 1 if liked else -1
+                pending = len(self._pending)
+            break
+        self._ensure_flusher()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+        return True
+
+    def _db_state(self, post_id, user_id):
+        # One read answers both "does the post exist" and "has this user liked it".
+        liked = exists().where(Like.post_id == post_id, Like.user_id == user_id)
+        row = db.session.execute(select(Post.id, liked.label('liked')).where(Post.id == post_id, Post.live())).first()
+        return None if row is None else bool(row.liked)
+
+    def is_liked(self, post_id, user_id):
+        # The buffered state of the pair, or None when the database is authoritative.
+        key = (post_id, user_id)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            return self._flushing.get(key)
+
+    def pending_delta(self, post_id):
+        with self._lock:
+            # While the batch holding this post commits, a likes_count the caller just read may or may not
+            # include it, so wait for the clear rather than add its deltas twice. Other posts never wait.
+            while self._committing and post_id in self._flushing_deltas:
+                self._committed.wait()
+            return self._deltas.get(post_id, 0) + self._flushing_deltas.get(post_id, 0)
+
+    def overlay(self, data):
+        # Adds buffered likes to a post dict's likes_count. Returns a copy, so cached dicts stay untouched.
+        if not self.enabled or 'likes_count' not in data:
+            return data
+        delta = self.pending_delta(data['id'])
+        return dict(data, likes_count=data['likes_count'] + delta) if delta else data
+
+    def overlay_many(self, items):
+        if not self.enabled or not (self._deltas or self._flushing_deltas):
+            return items
+        return [self.overlay(item) for item in items]
+
+    def flush(self):
+        # Writes the pending changes in one transaction and returns how many pairs were applied.
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                self._flushing_deltas, self._deltas = self._deltas, defaultdict(int)
+            try:
+                post_ids = self._apply(self._flushing)
+                with self._lock:
+                    self._committing = True
+                # Committed without the lock: like(), unlike() and reads of other posts carry on meanwhile.
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self._requeue()
+                raise
+            with self._lock:
+                applied = len(self._flushing)
+                self._flushing = {}
+                self._flushing_deltas = defaultdict(int)
+                self._generation += 1
+                self._committing = False
+                self._committed.notify_all()
+            self.flushed += applied
+            for post_id in post_ids:
+                cache.invalidate_post(post_id)
+            return applied
+
+    def _apply(self, changes):
+        likes = [key for key, liked in changes.items() if liked]
+        unlikes = [key for key, liked in changes.items() if not liked]
+        existing = set()
+        for start in range(0, len(likes), FLUSH_CHUNK):
+            post_ids = {post_id for post_id, _ in likes[start:start + FLUSH_CHUNK]}
+            existing.update(db.session.execute(select(Post.id).where(Post.id.in_(post_ids), Post.live())).scalars())
+        likes = [key for key in likes if key[0] in existing]
+        added, removed = [], []
+        for start in range(0, len(likes), FLUSH_CHUNK):
+            added += Like.insert_ignore_pairs(likes[start:start + FLUSH_CHUNK])
+        for start in range(0, len(unlikes), FLUSH_CHUNK):
+            removed += Like.delete_pairs(unlikes[start:start + FLUSH_CHUNK])
+        # Counters follow the rows actually written, so another process racing on the same pair cannot skew them.
+        deltas = defaultdict(int)
+        for post_id, _ in added:
+            deltas[post_id] += 1
+        for post_id, _ in removed:
+            deltas[post_id] -= 1
+        adjust_counters(Post, 'likes_count', {post_id: delta for post_id, delta in deltas.items() if delta})
+        bus.emit_many('post_liked', [{'post_id': post_id, 'user_id': user_id} for post_id, user_id in added])
+        bus.emit_many('post_unliked', [{'post_id': post_id, 'user_id': user_id} for post_id, user_id in removed])
+        return {post_id for post_id, _ in changes}
+
+    def _requeue(self):
+        # A failed flush goes back in front of whatever arrived meanwhile. A newer entry for the same pair
+        # was recorded against the in-flight state, so the two cancel out.
+        with self._lock:
+            for key, liked in self._flushing.items():
+                if key in self._pending:
+                    del self._pending[key]
+                else:
+                    self._pending[key] = liked
+                self._deltas[key[0]] += 1 if liked else -1
+            self._flushing = {}
+            self._flushing_deltas = defaultdict(int)
+            self._committing = False
+            self._committed.notify_all()
+
+    def _ensure_flusher(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='like-buffer-flusher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('like buffer flush failed; changes stay buffered')
+
+    def _flush_at_exit(self):
+        if self._pending and self.app is not None:
+            with self.app.app_context():
+                self.flush()
+
+    def info(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'pending': len(self._pending),
+                'flushing': len(self._flushing),
+                'flushed': self.flushed,
+                'max_pending': self.max_pending,
+                'flush_interval': self.flush_interval,
+            }
+
+
+like_buffer = LikeBuffer()
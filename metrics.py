@@ -0,0 +1,289 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from hashing import password_hasher
+
+logger = logging.getLogger(__name__)
+
+METRICS_DEFAULTS = {
+    'METRICS_ENABLED': True,
+    'METRICS_SLOW_REQUEST_MS': 0,  # 0 turns the slow-request log off
+    'METRICS_SLOW_REQUEST_MAX_STATEMENTS': 50,
+    'METRICS_MULTIPROC_DIR': None,  # shared by all worker processes; /metrics then reports all of them
+    'METRICS_EXPORT_INTERVAL': 5,
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name, type, label names, help
+FAMILIES = (
+    ('http_requests_total', 'counter', ('endpoint', 'method', 'status'), 'Requests handled.'),
+    ('http_request_duration_seconds', 'histogram', ('endpoint',), 'Time from the start of the request to the response being ready.'),
+    ('http_response_size_bytes', 'histogram', ('endpoint',), 'Response body size; streamed responses are not counted.'),
+    ('db_statements_per_request', 'histogram', ('endpoint',), 'SQL statements executed per request.'),
+    ('db_duration_seconds_per_request', 'histogram', ('endpoint',), 'Time spent executing SQL per request.'),
+    ('password_hash_duration_seconds', 'histogram', ('endpoint', 'operation'), 'Time spent in bcrypt.'),
+)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    __slots__ = ('started', 'statements', 'sql_seconds', 'hash_seconds', 'captured')
+
+    def __init__(self, capture):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.captured = [] if capture else None
+
+
+HISTOGRAM_BUCKETS = {
+    'http_request_duration_seconds': LATENCY_BUCKETS,
+    'http_response_size_bytes': SIZE_BUCKETS,
+    'db_statements_per_request': STATEMENT_BUCKETS,
+    'db_duration_seconds_per_request': LATENCY_BUCKETS,
+    'password_hash_duration_seconds': LATENCY_BUCKETS,
+}
+
+
+def endpoint_label():
+    # Blueprints are nested under 'main'; report post.get_posts rather than main.post.get_posts.
+    endpoint = request.endpoint
+    if endpoint is None:
+        return 'unmatched'
+    return endpoint[len('main.'):] if endpoint.startswith('main.') else endpoint
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metrics:
+    # Per-process request metrics in Prometheus text format. SQL statements are counted with engine
+    # events and attributed to the request running on the same thread; background threads are ignored.
+    # With METRICS_MULTIPROC_DIR set, every process writes its totals to metrics-<pid>.json there every
+    # METRICS_EXPORT_INTERVAL seconds and render() adds up all the files, so any worker can be scraped.
+    # Files of exited workers are kept so counters never go backwards; clear the directory on server start.
+    def __init__(self, app=None):
+        self.enabled = False
+        self.slow_request_ms = 0
+        self.max_statements = METRICS_DEFAULTS['METRICS_SLOW_REQUEST_MAX_STATEMENTS']
+        self.multiproc_dir = None
+        self.export_interval = METRICS_DEFAULTS['METRICS_EXPORT_INTERVAL']
+        self._lock = threading.Lock()
+        self._exporter_pid = None
+        self._listening = False
+        self.reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for key, value in METRICS_DEFAULTS.items():
+            app.config.setdefault(key, value)
+        self.enabled = bool(app.config['METRICS_ENABLED'])
+        self.slow_request_ms = app.config['METRICS_SLOW_REQUEST_MS']
+        self.max_statements = app.config['METRICS_SLOW_REQUEST_MAX_STATEMENTS']
+        self.multiproc_dir = app.config['METRICS_MULTIPROC_DIR']
+        self.export_interval = app.config['METRICS_EXPORT_INTERVAL']
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            password_hasher.listeners.append(self._record_password_hash)
+            self._listening = True
+
+    def reset(self):
+        with self._lock:
+            self._requests = {}
+            self._histograms = {name: {} for name, kind, _, _ in FAMILIES if kind == 'histogram'}
+
+    def _observe(self, name, labels, value, buckets):
+        histogram = self._histograms[name].get(labels)
+        if histogram is None:
+            histogram = self._histograms[name][labels] = Histogram(buckets)
+        histogram.observe(value)
+
+    def _before_request(self):
+        if self.multiproc_dir and self._exporter_pid != os.getpid():
+            self._start_exporter()
+        g._metrics = RequestStats(capture=bool(self.slow_request_ms))
+
+    def _start_exporter(self):
+        with self._lock:
+            if self._exporter_pid == os.getpid():
+                return
+            self._exporter_pid = os.getpid()
+        threading.Thread(target=self._export_forever, name='metrics-exporter', daemon=True).start()
+
+    def _export_forever(self):
+        while True:
+            time.sleep(self.export_interval)
+            try:
+                self.export()
+            except OSError:
+                logger.exception('could not write metrics to %s', self.multiproc_dir)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': [[*labels, value] for labels, value in self._requests.items()],
+                'histograms': {
+                    name: [[list(labels), histogram.counts, histogram.sum, histogram.count] for labels, histogram in histograms.items()]
+                    for name, histograms in self._histograms.items()
+                },
+            }
+
+    def export(self):
+        path = os.path.join(self.multiproc_dir, f'metrics-{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def _copy(self):
+        # Call with self._lock held; the copies can then be merged and rendered without it.
+        requests = dict(self._requests)
+        histograms = {name: {labels: (list(h.counts), h.sum, h.count) for labels, h in family.items()} for name, family in self._histograms.items()}
+        return requests, histograms
+
+    def _merge_exports(self, requests, histograms):
+        # Adds the last export of every other process to this process' copied totals.
+        own = os.path.join(self.multiproc_dir, f'metrics-{os.getpid()}.json')
+        for path in glob.glob(os.path.join(self.multiproc_dir, 'metrics-*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for *labels, value in data['requests']:
+                requests[tuple(labels)] = requests.get(tuple(labels), 0) + value
+            for name, entries in data['histograms'].items():
+                family = histograms.setdefault(name, {})
+                for labels, counts, total, count in entries:
+                    labels = tuple(labels)
+                    if labels in family:
+                        merged_counts, merged_sum, merged_count = family[labels]
+                        family[labels] = ([a + b for a, b in zip(merged_counts, counts)], merged_sum + total, merged_count + count)
+                    else:
+                        family[labels] = (counts, total, count)
+
+    def _after_request(self, response):
+        stats = g.pop('_metrics', None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.started
+        endpoint = endpoint_label()
+        size = None if response.is_streamed else response.calculate_content_length()
+        key = (endpoint, request.method, response.status_code)
+        with self._lock:
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._observe('http_request_duration_seconds', (endpoint,), elapsed, LATENCY_BUCKETS)
+            self._observe('db_statements_per_request', (endpoint,), stats.statements, STATEMENT_BUCKETS)
+            self._observe('db_duration_seconds_per_request', (endpoint,), stats.sql_seconds, LATENCY_BUCKETS)
+            if size is not None:
+                self._observe('http_response_size_bytes', (endpoint,), size, SIZE_BUCKETS)
+        if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+            self._log_slow_request(endpoint, response, elapsed, stats)
+        return response
+
+    def _log_slow_request(self, endpoint, response, elapsed, stats):
+        logger.warning('slow request %s', json.dumps({
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'sql_statements': stats.statements,
+            'sql_ms': round(stats.sql_seconds * 1000, 2),
+            'password_hash_ms': round(stats.hash_seconds * 1000, 2),
+            'statements': stats.captured,
+        }))
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and '_metrics' in g:
+            context._metrics_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        stats = g.get('_metrics')
+        if stats is None:
+            return
+        stats.statements += 1
+        stats.sql_seconds += elapsed
+        if stats.captured is not None and len(stats.captured) < self.max_statements:
+            stats.captured.append({'sql': ' '.join(statement.split())[:1000], 'ms': round(elapsed * 1000, 3)})
+
+    def _record_password_hash(self, operation, seconds):
+        endpoint = 'background'
+        if has_request_context():
+            endpoint = endpoint_label()
+            stats = g.get('_metrics')
+            if stats is not None:
+                stats.hash_seconds += seconds
+        with self._lock:
+            self._observe('password_hash_duration_seconds', (endpoint, operation), seconds, LATENCY_BUCKETS)
+
+    def render(self):
+        with self._lock:
+            requests, histograms = self._copy()
+        if self.multiproc_dir:
+            # File reads stay outside the lock, so requests recording their metrics never wait on the disk.
+            self._merge_exports(requests, histograms)
+        lines = []
+        for name, kind, label_names, help_text in FAMILIES:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for labels, value in sorted(requests.items()):
+                    lines.append(f'{name}{format_labels(label_names, labels)} {value}')
+                continue
+            buckets = HISTOGRAM_BUCKETS[name]
+            for labels, (counts, total, count) in sorted(histograms.get(name, {}).items()):
+                cumulative = 0
+                for bound, bucket_count in zip((*buckets, '+Inf'), counts):
+                    cumulative += bucket_count
+                    le = 'le="%s"' % bound
+                    lines.append(f'{name}_bucket{format_labels(label_names, labels, le)} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(label_names, labels)} {total}')
+                lines.append(f'{name}_count{format_labels(label_names, labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,69 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+from models import db, Comment, Follow, Like, OutboxEvent, Post, TimelineEntry, User
+from search import ensure_search_schema
+
+COUNTER_COLUMNS = {
+    'posts': {
+        'likes_count': 'SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id',
+        'comments_count': 'SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id AND comments.deleted_at IS NULL',
+    },
+    'users': {
+        'followers_count': 'SELECT COUNT(*) FROM follows WHERE follows.followed_id = users.id',
+        'following_count': 'SELECT COUNT(*) FROM follows WHERE follows.follower_id = users.id',
+        'token_version': 'SELECT 0',
+    },
+}
+INDEXED_MODELS = (User, Post, Comment, Like, Follow, TimelineEntry, OutboxEvent)
+# Full indexes superseded by the partial ones over live rows in models.py.
+RETIRED_INDEXES = ('ix_posts_user_id_created_at', 'ix_posts_created_at_id', 'ix_comments_post_id_created_at')
+
+
+def add_counter_columns(conn):
+    for table, counters in COUNTER_COLUMNS.items():
+        columns = {column['name'] for column in inspect(conn).get_columns(table)}
+        for name, backfill in counters.items():
+            if name in columns:
+                continue
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0'))
+            conn.execute(text(f'UPDATE {table} SET {name} = ({backfill})'))
+
+
+def dedupe_likes(conn):
+    # uq_likes_post_user cannot be built while check-then-insert races have left duplicate likes behind.
+    removed = conn.execute(text(
+        'DELETE FROM likes WHERE id NOT IN (SELECT MIN(id) FROM likes GROUP BY post_id, user_id)'
+    )).rowcount
+    if removed:
+        conn.execute(text(f"UPDATE posts SET likes_count = ({COUNTER_COLUMNS['posts']['likes_count']})"))
+
+
+def create_indexes(conn):
+    inspector = inspect(conn)
+    existing = {model.__tablename__: {index['name'] for index in inspector.get_indexes(model.__tablename__)} for model in INDEXED_MODELS}
+    if 'uq_likes_post_user' not in existing['likes']:
+        dedupe_likes(conn)
+    for model in INDEXED_MODELS:
+        for index in model.__table__.indexes:
+            if index.name not in existing[model.__tablename__]:
+                index.create(conn)
+    for name in RETIRED_INDEXES:
+        conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+
+def upgrade():
+    # Brings an existing database up to the current models; every step is idempotent.
+    db.create_all()
+    with db.engine.begin() as conn:
+        add_counter_columns(conn)
+        create_indexes(conn)
+        ensure_search_schema(conn)
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Create missing tables, columns and indexes before starting the servers."""
+    upgrade()
+    click.echo('database is up to date')
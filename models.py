@@ -1,14 +1,101 @@
 from datetime import datetime, timedelta
 from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+from sqlalchemy import and_, bindparam, delete, insert, select, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from flask_jwt_extended import create_access_token
+from hashing import password_hasher
 
 db = SQLAlchemy()
-bcrypt = Bcrypt()
 
-class User(db.Model):
+
+def adjust_counter(model, row_id, column, delta):
+    # Increment in SQL so concurrent writers never lose an update; leave updated_at alone.
+    counter = getattr(model, column)
+    db.session.execute(
+        update(model).where(model.id == row_id).values({counter: counter + delta, model.updated_at: model.updated_at}),
+        execution_options={'synchronize_session': False},
+    )
+
+
+def adjust_counters(model, column, deltas):
+    # Batched form of adjust_counter: one executemany UPDATE for a {row_id: delta} mapping.
+    if not deltas:
+        return
+    table = model.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.id == bindparam('row_id'))
+        .values({column: table.c[column] + bindparam('delta'), 'updated_at': table.c.updated_at}),
+        [{'row_id': row_id, 'delta': delta} for row_id, delta in deltas.items()],
+    )
+
+
+def insert_ignore(model, index_elements, values, returning=()):
+    # Let a unique index arbitrate concurrent inserts. Returns the RETURNING row (or True) when a row was
+    # inserted, and None when it already existed.
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = dialect_insert(model).values(**values).on_conflict_do_nothing(index_elements=index_elements)
+        if returning:
+            return db.session.execute(stmt.returning(*returning)).first()
+        return True if db.session.execute(stmt).rowcount > 0 else None
+    try:
+        with db.session.begin_nested():
+            stmt = insert(model).values(**values)
+            if returning:
+                return db.session.execute(stmt.returning(*returning)).first()
+            db.session.execute(stmt)
+            return True
+    except IntegrityError:
+        return None
+
+
+def partial_index(name, *columns, where='deleted_at IS NULL'):
+    # Read paths filter on live() and use these; tombstones waiting for compaction stay out of them.
+    return db.Index(name, *columns, sqlite_where=text(where), postgresql_where=text(where))
+
+
+def tombstone_index(name, *columns):
+    return partial_index(name, *columns, where='deleted_at IS NOT NULL')
+
+
+class Tombstoned:
+    # Deleting sets deleted_at; compaction.py removes the row and what depends on it later, in small batches.
+    @classmethod
+    def not_tombstoned(cls):
+        return cls.deleted_at.is_(None)
+
+    @classmethod
+    def live(cls):
+        return cls.not_tombstoned()
+
+    @classmethod
+    def get_live(cls, row_id):
+        return cls.query.filter(cls.id == row_id, cls.live()).first()
+
+
+def deleted_user_ids():
+    # Users waiting for compaction; the ix_users_deleted_at partial index holds exactly these rows.
+    return select(User.id).where(User.deleted_at.is_not(None))
+
+
+class Authored(Tombstoned):
+    # Deleting an account only tombstones the user row, so posts and comments check their author too: they
+    # disappear with the request, while compaction tombstones them in batches later.
+    @classmethod
+    def live(cls):
+        return and_(cls.not_tombstoned(), cls.user_id.not_in(deleted_user_ids()))
+
+
+class User(Tombstoned, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_followers_count', 'followers_count'),
+        tombstone_index('ix_users_deleted_at', 'deleted_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
@@ -20,15 +107,24 @@ class User(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     deleted_at = db.Column(db.DateTime, nullable=True)
     soft_deleted_at = db.Column(db.DateTime, nullable=True)
+    followers_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     posts = db.relationship('Post', backref='author', lazy=True)
     comments = db.relationship('Comment', backref='commenter', lazy=True)
     likes = db.relationship('Like', backref='liker', lazy=True)
 
     def set_password(self, password):
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password = password_hasher.hash(password)
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password, password)
+        return password_hasher.verify(password, self.password)
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password)
+
+    @classmethod
+    def adjust_counter(cls, user_id, column, delta):
+        adjust_counter(cls, user_id, column, delta)
 
     def generate_token(self, expires_delta=None):
         if expires_delta is None:
@@ -39,18 +135,26 @@ class User(db.Model):
             additional_claims={
                 'email': self.email,
                 'first_name': self.first_name,
-                'last_name': self.last_name
+                'last_name': self.last_name,
+                'ver': self.token_version or 0
             }
         )
         return token
 
-class Post(db.Model):
+class Post(Authored, db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        partial_index('ix_posts_live_user_id_created_at', 'user_id', 'created_at'),
+        partial_index('ix_posts_live_created_at_id', 'created_at', 'id'),
+        tombstone_index('ix_posts_deleted_user_id', 'user_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(255), nullable=False)
     content = db.Column(db.Text, nullable=False)
     media_url = db.Column(db.String(255), nullable=True)
+    likes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comments_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     deleted_at = db.Column(db.DateTime, nullable=True)
@@ -58,9 +162,18 @@ class Post(db.Model):
     comments = db.relationship('Comment', backref='post', lazy=True)
     likes = db.relationship('Like', backref='post', lazy=True)
 
+    @classmethod
+    def adjust_counter(cls, post_id, column, delta):
+        adjust_counter(cls, post_id, column, delta)
+
 
-class Comment(db.Model):
+class Comment(Authored, db.Model):
     __tablename__ = 'comments'
+    __table_args__ = (
+        partial_index('ix_comments_live_post_id_created_at', 'post_id', 'created_at'),
+        partial_index('ix_comments_live_user_id', 'user_id'),
+        tombstone_index('ix_comments_deleted_post_id', 'post_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -72,7 +185,123 @@ class Comment(db.Model):
 
 class Like(db.Model):
     __tablename__ = 'likes'
+    __table_args__ = (
+        db.Index('uq_likes_post_user', 'post_id', 'user_id', unique=True),
+        db.Index('ix_likes_user_id', 'user_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def insert_ignore(cls, post_id, user_id):
+        return insert_ignore(cls, ['post_id', 'user_id'], {'post_id': post_id, 'user_id': user_id}, returning=(cls.id, cls.post_id, cls.user_id, cls.created_at))
+
+    @classmethod
+    def insert_ignore_many(cls, user_id, post_ids):
+        # One multi-row INSERT; RETURNING only yields rows that did not hit uq_likes_post_user.
+        if not post_ids:
+            return {}
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+            now = datetime.utcnow()
+            stmt = (
+                dialect_insert(cls)
+                .values([{'post_id': post_id, 'user_id': user_id, 'created_at': now} for post_id in post_ids])
+                .on_conflict_do_nothing(index_elements=['post_id', 'user_id'])
+                .returning(cls.post_id, cls.id)
+            )
+            return {row.post_id: row.id for row in db.session.execute(stmt)}
+        inserted = {}
+        for post_id in post_ids:
+            row = cls.insert_ignore(post_id, user_id)
+            if row:
+                inserted[post_id] = row.id
+        return inserted
+
+    @classmethod
+    def insert_ignore_pairs(cls, pairs):
+        # Multi-row form over arbitrary (post_id, user_id) pairs; returns the pairs actually inserted.
+        if not pairs:
+            return []
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+            now = datetime.utcnow()
+            stmt = (
+                dialect_insert(cls)
+                .values([{'post_id': post_id, 'user_id': user_id, 'created_at': now} for post_id, user_id in pairs])
+                .on_conflict_do_nothing(index_elements=['post_id', 'user_id'])
+                .returning(cls.post_id, cls.user_id)
+            )
+            return [tuple(row) for row in db.session.execute(stmt)]
+        return [(post_id, user_id) for post_id, user_id in pairs if cls.insert_ignore(post_id, user_id)]
+
+    @classmethod
+    def delete_for(cls, post_id, user_id):
+        return db.session.execute(delete(cls).where(cls.post_id == post_id, cls.user_id == user_id)).rowcount > 0
+
+    @classmethod
+    def delete_pairs(cls, pairs):
+        # Returns the (post_id, user_id) pairs that existed and were deleted.
+        if not pairs:
+            return []
+        if db.session.get_bind().dialect.name in ('sqlite', 'postgresql'):
+            stmt = delete(cls).where(tuple_(cls.post_id, cls.user_id).in_(pairs)).returning(cls.post_id, cls.user_id)
+            return [tuple(row) for row in db.session.execute(stmt)]
+        return [(post_id, user_id) for post_id, user_id in pairs if cls.delete_for(post_id, user_id)]
+
+
+class Follow(db.Model):
+    __tablename__ = 'follows'
+    __table_args__ = (
+        db.Index('uq_follows_follower_followed', 'follower_id', 'followed_id', unique=True),
+        db.Index('ix_follows_followed_id', 'followed_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    follower_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    followed_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def insert_ignore(cls, follower_id, followed_id):
+        return insert_ignore(cls, ['follower_id', 'followed_id'], {'follower_id': follower_id, 'followed_id': followed_id})
+
+    @classmethod
+    def delete_for(cls, follower_id, followed_id):
+        return db.session.execute(delete(cls).where(cls.follower_id == follower_id, cls.followed_id == followed_id)).rowcount > 0
+
+
+class TimelineEntry(db.Model):
+    __tablename__ = 'timeline_entries'
+    __table_args__ = (
+        db.Index('uq_timeline_entries_user_post', 'user_id', 'post_id', unique=True),
+        db.Index('ix_timeline_entries_user_created_post', 'user_id', 'created_at', 'post_id'),
+        db.Index('ix_timeline_entries_post_id', 'post_id'),
+        db.Index('ix_timeline_entries_user_author', 'user_id', 'author_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Copied from the post so the home feed can be read and paginated from this table alone.
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_events'
+    __table_args__ = (
+        db.Index('ix_outbox_events_due', 'processed_at', 'failed_at', 'available_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    failed_at = db.Column(db.DateTime, nullable=True)
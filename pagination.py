@@ -0,0 +1,96 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+STREAM_BATCH_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, row_id):
+    payload = json.dumps([created_at.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor(cursor)
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, maximum)
+
+
+def keyset_columns(model):
+    # A model keyed on its own (created_at, id), or an explicit (created_at, id) column pair.
+    if isinstance(model, tuple):
+        return model
+    return model.created_at, model.id
+
+
+def keyset_filter(model, cursor):
+    # Newest first on (created_at, id); id breaks ties between equal timestamps.
+    created_at_column, id_column = keyset_columns(model)
+    created_at, row_id = decode_cursor(cursor)
+    return or_(
+        created_at_column < created_at,
+        and_(created_at_column == created_at, id_column < row_id),
+    )
+
+
+def keyset_order(model):
+    created_at_column, id_column = keyset_columns(model)
+    return (created_at_column.desc(), id_column.desc())
+
+
+def apply_keyset(stmt, model, cursor=None):
+    if cursor:
+        stmt = stmt.where(keyset_filter(model, cursor))
+    return stmt.order_by(*keyset_order(model))
+
+
+def page_query(stmt, model, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    # Fetch one extra row to know whether another page exists without a COUNT(*).
+    return apply_keyset(stmt, model, cursor).limit(limit + 1)
+
+
+def split_page(rows, limit):
+    items = [row[0] if len(row) == 1 else row for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return items, next_cursor
+
+
+def paginate(session, stmt, model, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    return split_page(session.execute(page_query(stmt, model, cursor, limit)).all(), limit)
+
+
+def stream_rows(session, stmt, model, cursor=None, limit=None, batch_size=STREAM_BATCH_SIZE):
+    stmt = apply_keyset(stmt, model, cursor)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    result = session.execute(stmt.execution_options(yield_per=batch_size, stream_results=True))
+    try:
+        for row in result:
+            yield row
+    finally:
+        result.close()
@@ -0,0 +1,265 @@
+import base64
+import hashlib
+import hmac
+import logging
+import math
+import re
+import threading
+import time
+from collections import namedtuple
+from flask import g, jsonify, request
+from auth import unverified_subject
+from metrics import endpoint_label
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_DEFAULTS = {
+    'RATE_LIMIT_ENABLED': True,
+    'RATE_LIMIT_BACKEND': 'memory',
+    'RATE_LIMIT_REDIS_URL': 'redis://localhost:6379/0',
+    'RATE_LIMIT_MAX_KEYS': 100000,
+    'RATE_LIMIT_DEFAULT': None,
+    'RATE_LIMITS': {},
+}
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+RATE_RE = re.compile(r'^\s*(\d+)\s*(?:/|per)\s*(second|minute|hour|day)s?(?:\s+burst\s+(\d+))?\s*$')
+HMAC_DIGESTS = {'HS256': hashlib.sha256, 'HS384': hashlib.sha384, 'HS512': hashlib.sha512}
+STORE_ERROR_LOG_INTERVAL = 60
+
+# One token every `interval` seconds into a bucket of `burst` tokens; `window` is the time a full bucket takes to refill.
+Rate = namedtuple('Rate', ['interval', 'burst', 'window'])
+Decision = namedtuple('Decision', ['allowed', 'remaining', 'retry_after', 'reset'])
+
+
+def parse_rate(spec):
+    # '10/minute', '10 per minute', or '10/minute burst 20' to allow short bursts above the average rate.
+    match = RATE_RE.match(spec or '')
+    if not match or not int(match.group(1)):
+        raise ValueError(f'Invalid rate limit {spec!r}; use e.g. "10/minute" or "10/minute burst 20"')
+    count = int(match.group(1))
+    burst = int(match.group(3) or count)
+    interval = PERIODS[match.group(2)] / count
+    return Rate(interval, burst, interval * burst)
+
+
+class MemoryBuckets:
+    # Token buckets in the generic cell rate form: a bucket is one float, the time at which it will be full
+    # again. A check is a dict read and a dict write with no lock held. Two threads racing on one key can
+    # both get through, which errs by a request in the client's favour. Past max_keys, full buckets
+    # (which carry no state) are dropped first, then the fullest ones.
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self.evictions = 0
+        self._buckets = {}
+        self._sweeping = threading.Lock()
+
+    def hit(self, key, rate):
+        now = self.clock()
+        full_at = self._buckets.get(key, now)
+        if full_at < now:
+            full_at = now
+        slack = now + rate.window - full_at - rate.interval
+        if slack < 0:
+            return Decision(False, 0, -slack, full_at - now)
+        if len(self._buckets) >= self.max_keys and key not in self._buckets:
+            self._evict(now)
+        self._buckets[key] = full_at + rate.interval
+        return Decision(True, int(slack / rate.interval), 0.0, full_at + rate.interval - now)
+
+    def _evict(self, now):
+        # Only one thread sweeps; the others carry on and may overshoot max_keys by a few entries meanwhile.
+        if not self._sweeping.acquire(blocking=False):
+            return
+        try:
+            entries = list(self._buckets.items())
+            victims = [key for key, full_at in entries if full_at <= now]
+            excess = len(entries) - len(victims) - int(self.max_keys * 0.9)
+            if excess > 0:
+                active = sorted((full_at, key) for key, full_at in entries if full_at > now)
+                victims += [key for _, key in active[:excess]]
+            for key in victims:
+                self._buckets.pop(key, None)
+            self.evictions += len(victims)
+        finally:
+            self._sweeping.release()
+
+    def clear(self):
+        self._buckets.clear()
+
+    def info(self):
+        return {'backend': 'memory', 'keys': len(self._buckets), 'max_keys': self.max_keys, 'evictions': self.evictions}
+
+
+# The same algorithm as one Lua script: atomic on the server, one round trip, and Redis' clock is shared by
+# every worker. Keys expire when their bucket is full again, so Redis memory stays bounded by active clients.
+GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local full_at = tonumber(redis.call('GET', KEYS[1])) or now
+if full_at < now then
+  full_at = now
+end
+local slack = now + window - full_at - interval
+if slack < 0 then
+  return {0, tostring(-slack), tostring(full_at - now)}
+end
+full_at = full_at + interval
+redis.call('SET', KEYS[1], tostring(full_at), 'PX', math.ceil((full_at - now) * 1000))
+return {1, tostring(slack), tostring(full_at - now)}
+"""
+
+
+class RedisBuckets:
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(GCRA_SCRIPT)
+
+    def hit(self, key, rate):
+        allowed, seconds, reset = self._script(keys=[self.prefix + key], args=[rate.interval, rate.window])
+        if int(allowed):
+            return Decision(True, int(float(seconds) / rate.interval), 0.0, float(reset))
+        return Decision(False, 0, float(seconds), float(reset))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def info(self):
+        return {'backend': 'redis'}
+
+
+class RateLimiter:
+    # Checked before every view that has a limit. RATE_LIMITS maps an endpoint ('comment.create_comment') or
+    # a blueprint ('comment', one bucket shared by all its endpoints) to a rate; RATE_LIMIT_DEFAULT covers the
+    # remaining endpoints. Clients are keyed by the user id of a correctly signed bearer token, or else by IP.
+    def __init__(self, app=None):
+        self.enabled = False
+        self.store = None
+        self.limits = {}
+        self.default = None
+        self.limited = 0
+        self.store_errors = 0
+        self._resolved = {}
+        self._subjects = {}
+        self._secret = None
+        self._digest = None
+        self._store_error_logged = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for key, value in RATE_LIMIT_DEFAULTS.items():
+            app.config.setdefault(key, value)
+        self.enabled = bool(app.config['RATE_LIMIT_ENABLED'])
+        app.extensions['rate_limiter'] = self
+        if not self.enabled:
+            return
+        self.limits = {name: parse_rate(spec) for name, spec in app.config['RATE_LIMITS'].items()}
+        self.default = parse_rate(app.config['RATE_LIMIT_DEFAULT']) if app.config['RATE_LIMIT_DEFAULT'] else None
+        self._resolved = {}
+        self._subjects = {}
+        self._max_subjects = app.config['RATE_LIMIT_MAX_KEYS']
+        self._digest = HMAC_DIGESTS.get(app.config.get('JWT_ALGORITHM', 'HS256'))
+        secret = app.config.get('JWT_SECRET_KEY') or ''
+        self._secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+        backend = app.config['RATE_LIMIT_BACKEND']
+        if backend == 'memory':
+            self.store = MemoryBuckets(app.config['RATE_LIMIT_MAX_KEYS'])
+        elif backend == 'redis':
+            import redis
+            self.store = RedisBuckets(redis.Redis.from_url(app.config['RATE_LIMIT_REDIS_URL']))
+        else:
+            raise ValueError(f'Unknown RATE_LIMIT_BACKEND {backend!r}')
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def resolve(self, endpoint):
+        # (bucket scope, rate) for an endpoint, or None when it is not limited. Memoized per endpoint.
+        try:
+            return self._resolved[endpoint]
+        except KeyError:
+            pass
+        found = (endpoint, self.default) if self.default else None
+        if endpoint in self.limits:
+            found = (endpoint, self.limits[endpoint])
+        else:
+            blueprint = endpoint.rpartition('.')[0]
+            while blueprint:
+                if blueprint in self.limits:
+                    found = (blueprint, self.limits[blueprint])
+                    break
+                blueprint = blueprint.rpartition('.')[0]
+        self._resolved[endpoint] = found
+        return found
+
+    def token_subject(self, authorization):
+        # Checking the HMAC costs microseconds, unlike a full decode, and stops clients from minting a fresh
+        # bucket per request with made-up tokens. Expiry and revocation are still left to jwt_required().
+        # Clients send the same token many times, so verified tokens are remembered until the table fills up.
+        if self._digest is None or not authorization:
+            return None
+        try:
+            return self._subjects[authorization]
+        except KeyError:
+            pass
+        _, _, token = authorization.partition(' ')
+        signing_input, _, signature = token.rpartition('.')
+        if not signing_input:
+            return None
+        expected = base64.urlsafe_b64encode(hmac.new(self._secret, signing_input.encode('latin-1'), self._digest).digest()).rstrip(b'=')
+        if not hmac.compare_digest(expected, signature.encode('latin-1')):
+            return None
+        subject = unverified_subject(authorization)
+        if subject is not None:
+            if len(self._subjects) >= self._max_subjects:
+                self._subjects.clear()
+            self._subjects[authorization] = subject
+        return subject
+
+    def client_key(self):
+        user_id = self.token_subject(request.headers.get('Authorization'))
+        return f'user:{user_id}' if user_id is not None else f'ip:{request.remote_addr}'
+
+    def _before_request(self):
+        limit = self.resolve(endpoint_label())
+        if limit is None:
+            return None
+        scope, rate = limit
+        try:
+            decision = self.store.hit(f'{scope}|{self.client_key()}', rate)
+        except Exception:
+            # An unreachable shared store must not take the API down with it: let requests through.
+            self.store_errors += 1
+            now = time.monotonic()
+            if now - self._store_error_logged >= STORE_ERROR_LOG_INTERVAL:
+                self._store_error_logged = now
+                logger.exception('rate limit store failed; requests are not limited until it recovers')
+            return None
+        g._rate_limit = (rate, decision)
+        if not decision.allowed:
+            self.limited += 1
+            return jsonify({'error': 'Too many requests, please retry later'}), 429, {'Retry-After': str(math.ceil(decision.retry_after))}
+        return None
+
+    def _after_request(self, response):
+        limit = g.pop('_rate_limit', None)
+        if limit is not None:
+            rate, decision = limit
+            response.headers['X-RateLimit-Limit'] = str(rate.burst)
+            response.headers['X-RateLimit-Remaining'] = str(decision.remaining)
+            response.headers['X-RateLimit-Reset'] = str(math.ceil(decision.reset))
+        return response
+
+    def info(self):
+        if not self.enabled:
+            return {'enabled': False}
+        return dict(self.store.info(), enabled=True, limited=self.limited, store_errors=self.store_errors)
+
+
+limiter = RateLimiter()
@@ -1,6 +1,6 @@
 from flask import Blueprint
 from flask_jwt_extended import jwt_required
-from routes import user_routes, post_routes, comment_routes, like_routes
+from routes import user_routes, post_routes, comment_routes, like_routes, stats_routes, search_routes, metrics_routes
 
 bp = Blueprint('main', __name__)
 
@@ -8,3 +8,6 @@ bp.register_blueprint(user_routes.bp)
 bp.register_blueprint(post_routes.bp)
 bp.register_blueprint(like_routes.bp)
 bp.register_blueprint(comment_routes.bp)
+bp.register_blueprint(stats_routes.bp)
+bp.register_blueprint(search_routes.bp)
+bp.register_blueprint(metrics_routes.bp)
@@ -1,15 +1,22 @@
 from flask import Blueprint, request, jsonify
-from models import db, Comment, Post
+from cache import cache
+from sqlalchemy import and_, func, insert, select
+from models import db, Comment, Post, adjust_counters
+from batch import CREATED, INVALID, NOT_FOUND, BatchError, batch_items, batch_response, is_id, is_text
+from serializers import comment_schema
+from search import index_comments, unindex_comments
+from events import bus
+from conditional import is_not_modified, make_etag, not_modified, with_validators
 from datetime import datetime
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, current_user
 
 bp = Blueprint('comment', __name__, url_prefix='/comment')
 
-@bp.route('/post/<id>', methods=['POST'])
+@bp.route('/post/<int:post_id>', methods=['POST'])
 @jwt_required()
 def create_comment(post_id):
-    current_user_id = int(get_jwt_identity())
-    post = Post.query.get(post_id)
+    current_user_id = current_user.id
+    post = Post.get_live(post_id)
     if not post:
         return jsonify({'error': 'Post not found'}), 404
     data = request.get_json()
@@ -21,25 +28,95 @@ def create_comment(post_id):
         content=data['content']
     )
     db.session.add(new_comment)
+    db.session.flush()
+    index_comments([new_comment.id])
+    Post.adjust_counter(post_id, 'comments_count', 1)
+    bus.emit('comment_created', comment_id=new_comment.id, post_id=post_id, user_id=current_user_id)
     db.session.commit()
-    return jsonify({ 'message': 'Comment added successfully', 'comment': {'id': new_comment.id, 'user_id': new_comment.user_id, 'post_id': new_comment.post_id, 'content': new_comment.content,'created_at': str(new_comment.created_at) }}), 201
+    cache.invalidate_post(post_id)
+    return jsonify({ 'message': 'Comment added successfully', 'comment': comment_schema.dump(new_comment)}), 201
 
 
-@bp.route('/post/<id>', methods=['GET'])
+@bp.route('/batch', methods=['POST'])
+@jwt_required()
+def create_comments_batch():
+    current_user_id = current_user.id
+    try:
+        items = batch_items(request.get_json(), 'comments')
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    post_ids = {item.get('post_id') for item in items if isinstance(item, dict) and is_id(item.get('post_id'))}
+    existing = set(db.session.execute(select(Post.id).where(Post.id.in_(post_ids), Post.live())).scalars()) if post_ids else set()
+    now = datetime.utcnow()
+    results = []
+    rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not is_id(item.get('post_id')) or not is_text(item.get('content')):
+            results.append({'index': index, 'status': INVALID, 'error': 'post_id and content are required'})
+        elif item['post_id'] not in existing:
+            results.append({'index': index, 'status': NOT_FOUND, 'error': 'Post not found'})
+        else:
+            results.append({'index': index, 'status': CREATED})
+            rows.append({'user_id': current_user_id, 'post_id': item['post_id'], 'content': item['content'], 'created_at': now, 'updated_at': now})
+    if rows:
+        ids = db.session.execute(insert(Comment).returning(Comment.id, sort_by_parameter_order=True), rows).scalars().all()
+        deltas = {}
+        for row in rows:
+            deltas[row['post_id']] = deltas.get(row['post_id'], 0) + 1
+        adjust_counters(Post, 'comments_count', deltas)
+        index_comments(ids)
+        bus.emit_many('comment_created', [{'comment_id': comment_id, 'post_id': row['post_id'], 'user_id': current_user_id} for comment_id, row in zip(ids, rows)])
+        db.session.commit()
+        for post_id in deltas:
+            cache.invalidate_post(post_id)
+        created = iter(ids)
+        for result in results:
+            if result['status'] == CREATED:
+                result['id'] = next(created)
+    return batch_response(results)
+
+
+def comments_meta_query(post_id):
+    # One aggregate row validates the request; comment rows are only read when the client's copy is stale.
+    return (
+        select(Post.comments_count, func.count(Comment.id).label('total'), func.max(Comment.updated_at).label('last_updated'))
+        .outerjoin(Comment, and_(Comment.post_id == Post.id, Comment.live()))
+        .where(Post.id == post_id, Post.live())
+        .group_by(Post.id)
+    )
+
+
+def comments_query(post_id, fields):
+    return select(*comment_schema.columns(fields)).where(Comment.post_id == post_id, Comment.live()).order_by(Comment.created_at, Comment.id)
+
+
+def comments_etag(post_id, fields, meta):
+    return make_etag('comments', post_id, fields, meta.comments_count, meta.total, str(meta.last_updated))
+
+
+@bp.route('/post/<int:post_id>', methods=['GET'])
 @jwt_required()
 def get_post_comments(post_id):
-    post = Post.query.get(post_id)
-    if not post:
+    try:
+        fields = comment_schema.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    meta = db.session.execute(comments_meta_query(post_id)).first()
+    if not meta:
         return jsonify({'error': 'Post not found'}), 404
-    comments = Comment.query.filter_by(post_id=post_id).all()
-    return jsonify({'post_id': post_id,'comments_count': len(comments),'comments': [{'id': comment.id, 'user_id': comment.user_id,'content': comment.content, 'created_at': str(comment.created_at),'updated_at': str(comment.updated_at)} for comment in comments] }), 200
+    etag = comments_etag(post_id, fields, meta)
+    if is_not_modified(etag):
+        return not_modified(etag)
+    comments = db.session.execute(comments_query(post_id, fields)).all()
+    response = jsonify({'post_id': post_id,'comments_count': meta.comments_count,'comments': comment_schema.dump_many(comments, fields) })
+    return with_validators(response, etag), 200
 
 
-@bp.route('/update/<id>', methods=['PUT', 'PATCH'])
+@bp.route('/update/<int:comment_id>', methods=['PUT', 'PATCH'])
 @jwt_required()
 def update_comment(comment_id):
-    current_user_id = int(get_jwt_identity())
-    comment = Comment.query.get(comment_id)
+    current_user_id = current_user.id
+    comment = Comment.get_live(comment_id)
     if not comment:
         return jsonify({'error': 'Comment not found'}), 404
     if comment.user_id != current_user_id:
@@ -52,19 +129,25 @@ def update_comment(comment_id):
     if 'content' in data:
         comment.content = data['content']
         comment.updated_at = datetime.utcnow()
+        index_comments([comment.id])
+        bus.emit('comment_updated', comment_id=comment.id, post_id=comment.post_id, user_id=current_user_id)
         db.session.commit()
-    return jsonify({ 'message': 'Comment updated successfully','comment': { 'id': comment.id,  'user_id': comment.user_id, 'post_id': comment.post_id, 'content': comment.content,  'created_at': str(comment.created_at), 'updated_at': str(comment.updated_at) } }), 200
+    return jsonify({ 'message': 'Comment updated successfully','comment': comment_schema.dump(comment) }), 200
 
 
-@bp.route('/<id>', methods=['DELETE'])
+@bp.route('/<int:comment_id>', methods=['DELETE'])
 @jwt_required()
 def delete_comment(comment_id):
-    current_user_id = int(get_jwt_identity())
-    comment = Comment.query.get(comment_id)
+    current_user_id = current_user.id
+    comment = Comment.get_live(comment_id)
     if not comment:
         return jsonify({'error': 'Comment not found'}), 404
     if comment.user_id != current_user_id:
         return jsonify({'error': 'Unauthorized to delete this comment'}), 403
-    db.session.delete(comment)
+    comment.deleted_at = datetime.utcnow()
+    unindex_comments([comment.id])
+    Post.adjust_counter(comment.post_id, 'comments_count', -1)
+    bus.emit('comment_deleted', comment_id=comment.id, post_id=comment.post_id, user_id=current_user_id)
     db.session.commit()
+    cache.invalidate_post(comment.post_id)
     return jsonify({'message': 'Comment deleted successfully'}), 200
@@ -1,50 +1,136 @@
 from flask import Blueprint, request, jsonify
-from models import db, Like, Post
+from cache import cache
+from sqlalchemy import func, select
+from models import db, Like, Post, adjust_counters
+from batch import CONFLICT, CREATED, INVALID, NOT_FOUND, BatchError, batch_items, batch_response, is_id
+from serializers import like_schema
+from events import bus
+from like_buffer import like_buffer
+from conditional import is_not_modified, make_etag, not_modified, with_validators
 from datetime import datetime
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, current_user
 
 bp = Blueprint('like', __name__, url_prefix='/like')
 
-@bp.route('/post/<id>', methods=['POST'])
+@bp.route('/post/<int:post_id>', methods=['POST'])
 @jwt_required()
 def like_post(post_id):
-    current_user_id = int(get_jwt_identity())
-    post = Post.query.get(post_id)
+    current_user_id = current_user.id
+    if like_buffer.enabled:
+        accepted = like_buffer.like(post_id, current_user_id)
+        if accepted is None:
+            return jsonify({'error': 'Post not found'}), 404
+        if not accepted:
+            return jsonify({'error': 'You have already liked this post'}), 409
+        return jsonify({'message': 'Post liked successfully', 'like': {'post_id': post_id, 'user_id': current_user_id}}), 202
+    post = Post.get_live(post_id)
     if not post:
         return jsonify({'error': 'Post not found'}), 404
-    existing_like = Like.query.filter_by(user_id=current_user_id, post_id=post_id ).first()
-    if existing_like:
+    new_like = Like.insert_ignore(post_id, current_user_id)
+    if not new_like:
+        db.session.rollback()
         return jsonify({'error': 'You have already liked this post'}), 409
-    new_like = Like(
-        user_id=current_user_id,
-        post_id=post_id
-    )
-    db.session.add(new_like)
+    Post.adjust_counter(post_id, 'likes_count', 1)
+    bus.emit('post_liked', post_id=post_id, user_id=current_user_id)
     db.session.commit()
-    return jsonify({'message': 'Post liked successfully','like': { 'id': new_like.id, 'user_id': new_like.user_id,'post_id': new_like.post_id,'created_at': str(new_like.created_at) } }), 201
+    cache.invalidate_post(post_id)
+    return jsonify({'message': 'Post liked successfully','like': like_schema.dump(new_like) }), 201
 
 
-@bp.route('/post/<id>', methods=['GET'])
+@bp.route('/batch', methods=['POST'])
+@jwt_required()
+def like_posts_batch():
+    current_user_id = current_user.id
+    try:
+        items = batch_items(request.get_json(), 'post_ids')
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    post_ids = {post_id for post_id in items if is_id(post_id)}
+    existing = set(db.session.execute(select(Post.id).where(Post.id.in_(post_ids), Post.live())).scalars()) if post_ids else set()
+    if like_buffer.enabled:
+        # Buffered likes get their ids when they are flushed, so CREATED results carry none.
+        inserted = {post_id: None for post_id in sorted(existing) if like_buffer.like(post_id, current_user_id)}
+    else:
+        inserted = Like.insert_ignore_many(current_user_id, sorted(existing))
+        adjust_counters(Post, 'likes_count', {post_id: 1 for post_id in inserted})
+        bus.emit_many('post_liked', [{'post_id': post_id, 'user_id': current_user_id} for post_id in inserted])
+        db.session.commit()
+        for post_id in inserted:
+            cache.invalidate_post(post_id)
+    results = []
+    for index, post_id in enumerate(items):
+        if not is_id(post_id):
+            results.append({'index': index, 'post_id': post_id, 'status': INVALID, 'error': 'post_id must be an integer'})
+        elif post_id not in existing:
+            results.append({'index': index, 'post_id': post_id, 'status': NOT_FOUND, 'error': 'Post not found'})
+        elif post_id in inserted:
+            result = {'index': index, 'post_id': post_id, 'status': CREATED}
+            like_id = inserted.pop(post_id)
+            if like_id is not None:
+                result['id'] = like_id
+            results.append(result)
+        else:
+            results.append({'index': index, 'post_id': post_id, 'status': CONFLICT, 'error': 'You have already liked this post'})
+    return batch_response(results)
+
+
+@bp.route('/post/<int:post_id>', methods=['GET'])
 @jwt_required()
 def get_post_likes(post_id):
-    post = Post.query.get(post_id)
-    if not post:
+    try:
+        fields = like_schema.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Likes are never edited, so the count plus the newest id and timestamp change whenever the set does.
+    meta = db.session.execute(
+        select(Post.likes_count, func.count(Like.id).label('total'), func.max(Like.id).label('last_id'), func.max(Like.created_at).label('last_created'))
+        .outerjoin(Like, Like.post_id == Post.id)
+        .where(Post.id == post_id, Post.live())
+        .group_by(Post.id)
+    ).first()
+    if not meta:
         return jsonify({'error': 'Post not found'}), 404
-    likes = Like.query.filter_by(post_id=post_id).all()
-    return jsonify({ 'post_id': post_id, 'likes_count': len(likes),'likes': [{ 'id': like.id, 'user_id': like.user_id, 'created_at': str(like.created_at) } for like in likes]}), 200
+    likes_count = meta.likes_count + (like_buffer.pending_delta(post_id) if like_buffer.enabled else 0)
+    etag = make_etag('likes', post_id, fields, likes_count, meta.total, meta.last_id, str(meta.last_created))
+    if is_not_modified(etag):
+        return not_modified(etag)
+    likes = db.session.execute(select(*like_schema.columns(fields)).where(Like.post_id == post_id)).all()
+    response = jsonify({ 'post_id': post_id, 'likes_count': likes_count,'likes': like_schema.dump_many(likes, fields)})
+    return with_validators(response, etag), 200
+
+
+@bp.route('/post/<int:post_id>/me', methods=['GET'])
+@jwt_required()
+def get_my_like(post_id):
+    current_user_id = current_user.id
+    liked = like_buffer.is_liked(post_id, current_user_id) if like_buffer.enabled else None
+    if liked is None:
+        post = Post.get_live(post_id)
+        if not post:
+            return jsonify({'error': 'Post not found'}), 404
+        liked = db.session.execute(select(Like.id).where(Like.post_id == post_id, Like.user_id == current_user_id)).first() is not None
+    return jsonify({'post_id': post_id, 'liked': liked}), 200
 
 
-@bp.route('/post/<id>', methods=['DELETE'])
+@bp.route('/post/<int:post_id>', methods=['DELETE'])
 @jwt_required()
 def unlike_post(post_id):
-    current_user_id = int(get_jwt_identity())
-    post = Post.query.get(post_id)
+    current_user_id = current_user.id
+    if like_buffer.enabled:
+        accepted = like_buffer.unlike(post_id, current_user_id)
+        if accepted is None:
+            return jsonify({'error': 'Post not found'}), 404
+        if not accepted:
+            return jsonify({'error': 'You have not liked this post'}), 404
+        return jsonify({'message': 'Post unliked successfully'}), 202
+    post = Post.get_live(post_id)
     if not post:
         return jsonify({'error': 'Post not found'}), 404
-    like = Like.query.filter_by(   user_id=current_user_id, post_id=post_id ).first()
-    if not like:
+    if not Like.delete_for(post_id, current_user_id):
         return jsonify({'error': 'You have not liked this post'}), 404
-    db.session.delete(like)
+    Post.adjust_counter(post_id, 'likes_count', -1)
+    bus.emit('post_unliked', post_id=post_id, user_id=current_user_id)
     db.session.commit()
+    cache.invalidate_post(post_id)
     return jsonify({'message': 'Post unliked successfully'}), 200
 
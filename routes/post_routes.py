@@ -1,14 +1,70 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from sqlalchemy import insert, select
 from models import db, Post
+from cache import cache, post_counts_key, post_key
 from datetime import datetime
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, current_user
+from pagination import InvalidCursor, paginate, parse_limit, stream_rows
+from timeline import fan_out_post, fan_out_posts, home_feed
+from batch import CREATED, INVALID, BatchError, batch_items, batch_response, is_text
+from serializers import post_schema
+from search import index_posts, unindex_posts
+from events import bus
+from like_buffer import like_buffer
+from conditional import has_validators, is_not_modified, make_etag, not_modified, with_validators
+from expand import DEFAULT_EMBEDDED_COMMENTS, MAX_EMBEDDED_COMMENTS, expand_posts, parse_includes
+from compaction import compactor
 
 bp = Blueprint('post', __name__, url_prefix='/post')
 
+MAX_COUNT_IDS = 100
+
+
+def parse_expansion():
+    # ?include=author,comments,like_count,liked_by_me and the size of embedded comment pages.
+    includes = parse_includes(request.args.get('include'))
+    comments_limit = parse_limit(request.args.get('comments_limit'), default=DEFAULT_EMBEDDED_COMMENTS, maximum=MAX_EMBEDDED_COMMENTS)
+    return includes, comments_limit
+
+
+def list_posts(*criteria):
+    cursor = request.args.get('cursor')
+    try:
+        fields = post_schema.parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+        includes, comments_limit = parse_expansion()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Only the requested columns are loaded, so ?fields=id,title never reads post bodies.
+    stmt = select(*post_schema.columns(fields)).where(Post.live(), *criteria)
+    dump = post_schema.dumper(fields)
+    if like_buffer.enabled and 'likes_count' in fields:
+        dump = lambda row, dump=dump: like_buffer.overlay(dump(row))
+    try:
+        if request.args.get('format') == 'ndjson':
+            if includes:
+                return jsonify({'error': 'include is not supported with format=ndjson'}), 400
+            stream_limit = limit if 'limit' in request.args else None
+            rows = stream_rows(db.session, stmt, Post, cursor=cursor, limit=stream_limit)
+            first = next(rows, None)
+            dumps = current_app.json.dumps
+            def generate():
+                if first is None:
+                    return
+                yield dumps(dump(first)) + '\n'
+                for row in rows:
+                    yield dumps(dump(row)) + '\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson'), 200
+        posts, next_cursor = paginate(db.session, stmt, Post, cursor=cursor, limit=limit)
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    items = expand_posts(list(map(dump, posts)), includes, current_user.id, comments_limit)
+    return jsonify({'posts': items, 'next_cursor': next_cursor}), 200
+
 @bp.route('/', methods=['POST'])
 @jwt_required()
 def create_post():
-    current_user_id = int(get_jwt_identity())
+    current_user_id = current_user.id
     data = request.get_json()
     if not data:
         return jsonify({'error': 'Invalid input'}), 400
@@ -16,41 +72,160 @@ def create_post():
     content = data.get('content')
     if not title or not content:
         return jsonify({'error': 'Title and content are required'}), 400
-    new_post = Post( title=title, content=content, user_id=current_user_id )
+    new_post = Post( title=title, content=content, user_id=current_user_id, created_at=datetime.utcnow() )
     db.session.add(new_post)
+    db.session.flush()
+    fan_out_post(new_post)
+    index_posts([new_post.id])
+    bus.emit('post_created', post_id=new_post.id, user_id=current_user_id)
     db.session.commit()
-    return jsonify({ 'message': 'Post created successfully', 'post': { 'id': new_post.id, 'title': new_post.title, 'content': new_post.content, 'user_id': new_post.user_id, 'created_at': str(new_post.created_at), 'updated_at': str(new_post.updated_at) } }), 201
+    return jsonify({ 'message': 'Post created successfully', 'post': post_schema.dump(new_post) }), 201
+
+
+@bp.route('/batch', methods=['POST'])
+@jwt_required()
+def create_posts_batch():
+    current_user_id = current_user.id
+    try:
+        items = batch_items(request.get_json(), 'posts')
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    now = datetime.utcnow()
+    results = []
+    rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not is_text(item.get('title')) or not is_text(item.get('content')):
+            results.append({'index': index, 'status': INVALID, 'error': 'Title and content are required'})
+            continue
+        if item.get('media_url') is not None and not isinstance(item['media_url'], str):
+            results.append({'index': index, 'status': INVALID, 'error': 'media_url must be a string'})
+            continue
+        results.append({'index': index, 'status': CREATED})
+        rows.append({'user_id': current_user_id, 'title': item['title'], 'content': item['content'], 'media_url': item.get('media_url'), 'created_at': now, 'updated_at': now})
+    if rows:
+        ids = db.session.execute(insert(Post).returning(Post.id, sort_by_parameter_order=True), rows).scalars().all()
+        fan_out_posts(current_user_id, ids)
+        index_posts(ids)
+        bus.emit_many('post_created', [{'post_id': post_id, 'user_id': current_user_id} for post_id in ids])
+        db.session.commit()
+        created = iter(ids)
+        for result in results:
+            if result['status'] == CREATED:
+                result['id'] = next(created)
+    return batch_response(results)
 
 
 @bp.route('/', methods=['GET'])
 @jwt_required()
 def get_posts():
-    posts = Post.query.all()
-    return jsonify([{'id': post.id, 'title': post.title, 'content': post.content, 'user_id': post.user_id, 'created_at': str(post.created_at), 'updated_at': str(post.updated_at)} for post in posts]), 200
+    return list_posts()
 
 
 @bp.route('/my-posts', methods=['GET'])
 @jwt_required()
 def get_user_posts():
-    current_user_id = int(get_jwt_identity())
-    posts = Post.query.filter_by(user_id=current_user_id).all()
-    return jsonify([{'id': post.id, 'title': post.title, 'content': post.content, 'user_id': post.user_id, 'created_at': str(post.created_at), 'updated_at': str(post.updated_at)} for post in posts]), 200
+    current_user_id = current_user.id
+    return list_posts(Post.user_id == current_user_id)
+
+
+@bp.route('/feed', methods=['GET'])
+@jwt_required()
+def get_home_feed():
+    current_user_id = current_user.id
+    try:
+        fields = post_schema.parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+        includes, comments_limit = parse_expansion()
+        posts, next_cursor = home_feed(current_user_id, post_schema.columns(fields), cursor=request.args.get('cursor'), limit=limit)
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    items = expand_posts(like_buffer.overlay_many(post_schema.dump_many(posts, fields)), includes, current_user_id, comments_limit)
+    return jsonify({'posts': items, 'next_cursor': next_cursor}), 200
+
+
+@bp.route('/counts', methods=['GET'])
+@jwt_required()
+def get_post_counts():
+    try:
+        ids = {int(post_id) for post_id in request.args.get('ids', '').split(',') if post_id.strip()}
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of integers'}), 400
+    if not ids:
+        return jsonify({'error': 'ids is required'}), 400
+    if len(ids) > MAX_COUNT_IDS:
+        return jsonify({'error': f'At most {MAX_COUNT_IDS} ids per request'}), 400
+    cached = cache.get_many([post_counts_key(post_id) for post_id in ids])
+    counts = {str(post_id): cached[post_counts_key(post_id)] for post_id in ids if post_counts_key(post_id) in cached}
+    missing = [post_id for post_id in ids if str(post_id) not in counts]
+    if missing:
+        tokens = cache.lease_many([post_counts_key(post_id) for post_id in missing])
+        rows = db.session.execute(select(Post.id, Post.likes_count, Post.comments_count).where(Post.id.in_(missing), Post.live())).all()
+        loaded = {row.id: {'likes_count': row.likes_count, 'comments_count': row.comments_count} for row in rows}
+        cache.fill_many(tokens, {post_counts_key(post_id): value for post_id, value in loaded.items()})
+        counts.update({str(post_id): value for post_id, value in loaded.items()})
+    if like_buffer.enabled:
+        for post_id, value in counts.items():
+            delta = like_buffer.pending_delta(int(post_id))
+            if delta:
+                counts[post_id] = dict(value, likes_count=value['likes_count'] + delta)
+    return jsonify({'counts': counts}), 200
+
+
+def post_meta_query(post_id):
+    return select(Post.updated_at, Post.likes_count, Post.comments_count).where(Post.id == post_id, Post.live())
+
+
+def post_etag(post_id, fields, updated_at, likes_count, comments_count):
+    # Counter updates leave updated_at alone, so the counts are part of the validator.
+    return make_etag('post', post_id, fields, str(updated_at), likes_count, comments_count)
 
 
-@bp.route('/<id>', methods=['GET'])
+@bp.route('/<int:post_id>', methods=['GET'])
 @jwt_required()
 def get_post(post_id):
-    post = Post.query.get(post_id)
+    try:
+        fields = post_schema.parse_fields(request.args.get('fields'))
+        includes, comments_limit = parse_expansion()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    post = cache.get(post_key(post_id))
+    if post is None:
+        if not includes and has_validators():
+            # Revalidate from a metadata-only query before loading (and caching) the full row.
+            meta = db.session.execute(post_meta_query(post_id)).first()
+            if not meta:
+                return jsonify({'error': 'Post not found'}), 404
+            likes_count = meta.likes_count + (like_buffer.pending_delta(post_id) if like_buffer.enabled else 0)
+            etag = post_etag(post_id, fields, meta.updated_at, likes_count, meta.comments_count)
+            if is_not_modified(etag):
+                return not_modified(etag)
+        token = cache.lease(post_key(post_id))
+        loaded = Post.get_live(post_id)
+        post = post_schema.dump(loaded) if loaded else None
+        cache.fill(post_key(post_id), token, post)
     if not post:
         return jsonify({'error': 'Post not found'}), 404
-    return jsonify({'id': post.id, 'title': post.title, 'content': post.content, 'user_id': post.user_id, 'created_at': str(post.created_at), 'updated_at': str(post.updated_at)}), 200
+    post = like_buffer.overlay(post)
+    if includes:
+        # Expanded views depend on other rows and on the caller, so they are not validated.
+        try:
+            post = expand_posts([post_schema.project(post, fields)], includes, current_user.id, comments_limit, request.args.get('comments_cursor'))[0]
+        except InvalidCursor:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        return jsonify(post), 200
+    etag = post_etag(post_id, fields, post['updated_at'], post['likes_count'], post['comments_count'])
+    if is_not_modified(etag):
+        return not_modified(etag)
+    return with_validators(jsonify(post_schema.project(post, fields)), etag), 200
 
 
-@bp.route('/<id>', methods=['PUT'])
+@bp.route('/<int:post_id>', methods=['PUT'])
 @jwt_required()
 def update_post(post_id):
-    current_user_id = int(get_jwt_identity())
-    post = Post.query.get(post_id)
+    current_user_id = current_user.id
+    post = Post.get_live(post_id)
     if not post:
         return jsonify({'error': 'Post not found'}), 404
     if post.user_id != current_user_id:
@@ -63,15 +238,18 @@ def update_post(post_id):
     post.title = data['title']
     post.content = data['content']
     post.updated_at = datetime.utcnow()
+    index_posts([post.id])
+    bus.emit('post_updated', post_id=post.id, user_id=current_user_id)
     db.session.commit()
-    return jsonify({'message': 'Post updated successfully', 'post': {'id': post.id, 'title': post.title, 'content': post.content, 'user_id': post.user_id, 'created_at': str(post.created_at), 'updated_at': str(post.updated_at)}}), 200
+    cache.invalidate_post(post.id)
+    return jsonify({'message': 'Post updated successfully', 'post': post_schema.dump(post)}), 200
  
  
-@bp.route('/<id>', methods=['PATCH'])
+@bp.route('/<int:post_id>', methods=['PATCH'])
 @jwt_required()
 def patch_post(post_id):
-    current_user_id = int(get_jwt_identity())
-    post = Post.query.get(post_id)
+    current_user_id = current_user.id
+    post = Post.get_live(post_id)
     if not post:
         return jsonify({'error': 'Post not found'}), 404
     if post.user_id != current_user_id:
@@ -84,19 +262,27 @@ def patch_post(post_id):
     if 'content' in data:
         post.content = data['content']
     post.updated_at = datetime.utcnow()
+    index_posts([post.id])
+    bus.emit('post_updated', post_id=post.id, user_id=current_user_id)
     db.session.commit()
-    return jsonify({'message': 'Post updated successfully', 'post': {'id': post.id, 'title': post.title, 'content': post.content, 'user_id': post.user_id, 'created_at': str(post.created_at), 'updated_at': str(post.updated_at)}}), 200
+    cache.invalidate_post(post.id)
+    return jsonify({'message': 'Post updated successfully', 'post': post_schema.dump(post)}), 200
 
 
-@bp.route('/<id>', methods=['DELETE'])
+@bp.route('/<int:post_id>', methods=['DELETE'])
 @jwt_required()
 def delete_post(post_id):
-    current_user_id = int(get_jwt_identity())
-    post = Post.query.get(post_id)
+    current_user_id = current_user.id
+    post = Post.get_live(post_id)
     if not post:
         return jsonify({'error': 'Post not found'}), 404
     if post.user_id != current_user_id:
         return jsonify({'error': 'Unauthorized to delete this post'}), 403
-    db.session.delete(post)
+    # A tombstone write; comments, likes and timeline entries are removed later by the compactor.
+    post.deleted_at = datetime.utcnow()
+    unindex_posts([post_id])
+    bus.emit('post_deleted', post_id=post_id, user_id=current_user_id)
     db.session.commit()
+    cache.invalidate_post(post_id)
+    compactor.wake()
     return jsonify({'message': 'Post deleted successfully'}), 200
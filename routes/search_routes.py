@@ -0,0 +1,36 @@
+from flask import Blueprint, current_app, request, jsonify
+from flask_jwt_extended import jwt_required
+from pagination import parse_limit
+from search import InvalidSearchCursor, UnsupportedSearch, parse_query, search
+from serializers import comment_schema, post_schema
+
+bp = Blueprint('search', __name__, url_prefix='/search')
+
+SEARCH_TYPES = {
+    'posts': ('posts', post_schema),
+    'comments': ('comments', comment_schema),
+}
+
+@bp.route('/', methods=['GET'])
+@jwt_required()
+def search_content():
+    search_type = request.args.get('type', 'posts')
+    if search_type not in SEARCH_TYPES:
+        return jsonify({'error': 'type must be posts or comments'}), 400
+    table, schema = SEARCH_TYPES[search_type]
+    terms = parse_query(request.args.get('q'))
+    if not terms:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        fields = schema.parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+        rows, next_cursor = search(table, [column.key for column in schema.columns(fields)], terms, cursor=request.args.get('cursor'), limit=limit,
+                                   candidates=current_app.config['SEARCH_MAX_CANDIDATES'])
+    except InvalidSearchCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    except UnsupportedSearch:
+        return jsonify({'error': 'Search is not available on this database'}), 501
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    dump = schema.dumper(fields)
+    return jsonify({search_type: [dict(dump(row), score=row.score) for row in rows], 'next_cursor': next_cursor}), 200
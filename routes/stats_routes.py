@@ -0,0 +1,32 @@
+import os
+from flask import Blueprint, jsonify
+from cache import cache
+from like_buffer import like_buffer
+from compaction import compactor
+from ratelimit import limiter
+
+bp = Blueprint('stats', __name__, url_prefix='/stats')
+
+# These figures belong to the worker that answered; pid tells scrapes of different workers apart.
+def worker_stats(info):
+    return jsonify(dict(info, pid=os.getpid())), 200
+
+
+@bp.route('/cache', methods=['GET'])
+def get_cache_stats():
+    return worker_stats(cache.info())
+
+
+@bp.route('/like-buffer', methods=['GET'])
+def get_like_buffer_stats():
+    return worker_stats(like_buffer.info())
+
+
+@bp.route('/compaction', methods=['GET'])
+def get_compaction_stats():
+    return worker_stats(compactor.info())
+
+
+@bp.route('/rate-limit', methods=['GET'])
+def get_rate_limit_stats():
+    return worker_stats(limiter.info())
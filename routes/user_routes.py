@@ -1,7 +1,14 @@
 from flask import Blueprint, request, jsonify
-from models import db, User
+from sqlalchemy import select
+from models import db, Post, User
+from cache import cache, user_key
+from timeline import follow, unfollow
+from auth import forget_token_version, revoke_tokens
+from serializers import user_schema
+from conditional import is_not_modified, make_etag, not_modified, with_validators
+from compaction import compactor
 from datetime import datetime
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, current_user
 
 bp = Blueprint('user', __name__, url_prefix='/user')
 
@@ -56,30 +63,50 @@ def login():
 
     if not (email and password):
         return jsonify({'error': 'Email and password are required'}), 400
-    user = User.query.filter_by(email=email).first()
+    user = User.query.filter(User.email == email, User.live()).first()
 
     if user and user.check_password(password):
+        if user.password_needs_rehash():
+            user.set_password(password)
+            db.session.commit()
         access_token = user.generate_token()
         return jsonify({'message': 'Login successful', 'access_token': access_token,  'user_id': user.id }), 200
     else:
         return jsonify({'error': 'Invalid email or password'}), 401
 
 
+@bp.route('/logout-all', methods=['POST'])
+@jwt_required()
+def logout_all():
+    revoke_tokens(current_user.id)
+    db.session.commit()
+    forget_token_version(current_user.id)
+    return jsonify({'message': 'All sessions have been signed out'}), 200
+
+
 @bp.route('/profile', methods=['GET'])
 @jwt_required()
 def get_current_user():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(int(current_user_id))
+    current_user_id = current_user.id
+    def load():
+        user = User.get_live(current_user_id)
+        if not user:
+            return None
+        return user_schema.dump(user)
+    user = cache.get_or_set(user_key(current_user_id), load)
     if not user:
         return jsonify({'error': 'User not found'}), 404
-    return jsonify({'id': user.id, 'first_name': user.first_name, 'last_name': user.last_name, 'email': user.email, 'date_of_birth': str(user.date_of_birth), 'gender': user.gender, 'created_at': str(user.created_at), 'updated_at': str(user.updated_at)}), 200
+    etag = make_etag('user', sorted(user.items()))
+    if is_not_modified(etag):
+        return not_modified(etag)
+    return with_validators(jsonify(user), etag), 200
 
 
 @bp.route('/profile', methods=['PUT'])
 @jwt_required()
 def update_user():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(int(current_user_id))
+    current_user_id = current_user.id
+    user = User.get_live(current_user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -114,14 +141,15 @@ def update_user():
     if 'password' in data:
         user.set_password(data['password'])
     db.session.commit()
-    return jsonify({'message': 'User updated successfully', 'user': {'id': user.id, 'first_name': user.first_name, 'last_name': user.last_name, 'email': user.email, 'date_of_birth': str(user.date_of_birth), 'gender': user.gender, 'updated_at': str(user.updated_at)}}), 200
+    cache.invalidate_user(user.id)
+    return jsonify({'message': 'User updated successfully', 'user': user_schema.dump(user)}), 200
  
 
 @bp.route('/profile', methods=['PATCH'])
 @jwt_required()
 def patch_user():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(int(current_user_id))
+    current_user_id = current_user.id
+    user = User.get_live(current_user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -152,15 +180,51 @@ def patch_user():
     if 'password' in data:
         user.set_password(data['password'])
     db.session.commit()
-    return jsonify({'message': 'User updated successfully', 'user': {'id': user.id, 'first_name': user.first_name, 'last_name': user.last_name, 'email': user.email, 'date_of_birth': str(user.date_of_birth), 'gender': user.gender, 'updated_at': str(user.updated_at)}}), 200
+    cache.invalidate_user(user.id)
+    return jsonify({'message': 'User updated successfully', 'user': user_schema.dump(user)}), 200
   
 @bp.route('/profile', methods=['DELETE'])
 @jwt_required()
 def delete_user():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(int(current_user_id))
+    current_user_id = current_user.id
+    user = User.get_live(current_user_id)
     if not user:
         return jsonify({'error': 'User not found'}), 404
-    db.session.delete(user)
+    # A tombstone write: it revokes the user's tokens and hides their posts and comments at once (see
+    # Authored.live), and the compactor removes them, their likes and follows afterwards in small batches.
+    user.deleted_at = datetime.utcnow()
+    db.session.commit()
+    cache.invalidate_user(current_user_id)
+    cache.invalidate_posts(db.session.execute(select(Post.id).where(Post.user_id == current_user_id, Post.not_tombstoned())).scalars())
+    forget_token_version(current_user_id)
+    compactor.wake()
+    return jsonify({'message': 'User deleted successfully'}), 200
+
+
+@bp.route('/<int:user_id>/follow', methods=['POST'])
+@jwt_required()
+def follow_user(user_id):
+    current_user_id = current_user.id
+    if user_id == current_user_id:
+        return jsonify({'error': 'You cannot follow yourself'}), 400
+    if not User.get_live(user_id):
+        return jsonify({'error': 'User not found'}), 404
+    if not follow(current_user_id, user_id):
+        db.session.rollback()
+        return jsonify({'error': 'You already follow this user'}), 409
+    db.session.commit()
+    cache.invalidate_user(current_user_id)
+    cache.invalidate_user(user_id)
+    return jsonify({'message': 'User followed successfully'}), 201
+
+
+@bp.route('/<int:user_id>/follow', methods=['DELETE'])
+@jwt_required()
+def unfollow_user(user_id):
+    current_user_id = current_user.id
+    if not unfollow(current_user_id, user_id):
+        return jsonify({'error': 'You do not follow this user'}), 404
     db.session.commit()
-    return jsonify({'message': 'User deleted successfully'}), 200
\ No newline at end of file
+    cache.invalidate_user(current_user_id)
+    cache.invalidate_user(user_id)
+    return jsonify({'message': 'User unfollowed successfully'}), 200
@@ -0,0 +1,189 @@
+import base64
+import json
+import re
+from sqlalchemy import bindparam, inspect, text
+from models import db
+
+DEFAULT_SEARCH_LIMIT = 20
+# Only the newest matches are ranked, so a term that is in most rows costs no more than a rare one.
+DEFAULT_SEARCH_CANDIDATES = 1000
+TOKEN_RE = re.compile(r'\w+\*?', re.UNICODE)
+
+# SQLite keeps a separate FTS5 index per table; rowid is the post/comment id.
+SQLITE_INDEXES = {
+    'posts': {
+        'create': "CREATE VIRTUAL TABLE posts_fts USING fts5(title, content, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+        'fill': 'INSERT INTO posts_fts (rowid, title, content) SELECT id, title, content FROM posts',
+    },
+    'comments': {
+        'create': "CREATE VIRTUAL TABLE comments_fts USING fts5(content, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+        'fill': 'INSERT INTO comments_fts (rowid, content) SELECT id, content FROM comments',
+    },
+}
+
+# PostgreSQL keeps a generated tsvector column with a GIN index, so writes need no extra work.
+POSTGRES_INDEXES = {
+    'posts': "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(content, ''))",
+    'comments': "to_tsvector('simple', coalesce(content, ''))",
+}
+
+
+# Deletes unindex the row itself, but comments of a deleted post, and everything a deleted user wrote, stay
+# indexed until compaction gets to them.
+DELETED_USERS = 'SELECT id FROM users WHERE deleted_at IS NOT NULL'
+LIVE_ROWS = {
+    'posts': f'posts.deleted_at IS NULL AND posts.user_id NOT IN ({DELETED_USERS})',
+    'comments': f'comments.deleted_at IS NULL AND comments.user_id NOT IN ({DELETED_USERS}) AND EXISTS (SELECT 1 FROM posts WHERE '
+                f'posts.id = comments.post_id AND posts.deleted_at IS NULL AND posts.user_id NOT IN ({DELETED_USERS}))',
+}
+
+
+class UnsupportedSearch(Exception):
+    pass
+
+
+class InvalidSearchCursor(ValueError):
+    pass
+
+
+def dialect_name():
+    return db.session.get_bind().dialect.name
+
+
+def ensure_search_schema(conn):
+    dialect = conn.dialect.name
+    tables = set(inspect(conn).get_table_names())
+    if dialect == 'sqlite':
+        for table, ddl in SQLITE_INDEXES.items():
+            if f'{table}_fts' not in tables:
+                conn.execute(text(ddl['create']))
+                conn.execute(text(ddl['fill']))
+    elif dialect == 'postgresql':
+        for table, expression in POSTGRES_INDEXES.items():
+            columns = {column['name'] for column in inspect(conn).get_columns(table)}
+            if 'search_vector' not in columns:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({expression}) STORED'))
+                conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_search_vector ON {table} USING GIN (search_vector)'))
+
+
+def _reindex(table, columns, row_ids):
+    # Called inside the writer's transaction, after the rows are flushed, so the index commits with them.
+    if not row_ids or dialect_name() != 'sqlite':
+        return
+    ids = bindparam('ids', expanding=True)
+    db.session.execute(text(f'DELETE FROM {table}_fts WHERE rowid IN :ids').bindparams(ids), {'ids': list(row_ids)})
+    db.session.execute(
+        text(f"INSERT INTO {table}_fts (rowid, {', '.join(columns)}) SELECT id, {', '.join(columns)} FROM {table} WHERE id IN :ids").bindparams(ids),
+        {'ids': list(row_ids)},
+    )
+
+
+def _unindex(table, row_ids):
+    if not row_ids or dialect_name() != 'sqlite':
+        return
+    db.session.execute(
+        text(f'DELETE FROM {table}_fts WHERE rowid IN :ids').bindparams(bindparam('ids', expanding=True)),
+        {'ids': list(row_ids)},
+    )
+
+
+def index_posts(post_ids):
+    _reindex('posts', ('title', 'content'), post_ids)
+
+
+def unindex_posts(post_ids):
+    _unindex('posts', post_ids)
+
+
+def index_comments(comment_ids):
+    _reindex('comments', ('content',), comment_ids)
+
+
+def unindex_comments(comment_ids):
+    _unindex('comments', comment_ids)
+
+
+def parse_query(q):
+    # Free text -> list of (term, is_prefix); all terms must match. Operators in user input are ignored.
+    terms = []
+    for token in TOKEN_RE.findall(q or ''):
+        prefix = token.endswith('*')
+        term = token.rstrip('*')
+        if term:
+            terms.append((term.lower(), prefix))
+    return terms
+
+
+def sqlite_match(terms):
+    return ' '.join('"{}"{}'.format(term.replace('"', '""'), '*' if prefix else '') for term, prefix in terms)
+
+
+def postgres_tsquery(terms):
+    return ' & '.join("'{}'{}".format(term.replace("'", "''"), ':*' if prefix else '') for term, prefix in terms)
+
+
+def encode_search_cursor(score, row_id, top):
+    payload = json.dumps([score, row_id, top], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_search_cursor(cursor):
+    # top is the newest id the first page could match; later pages rank the same candidates.
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        score, row_id, top = values if len(values) == 3 else (*values, None)
+        return float(score), int(row_id), None if top is None else int(top)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidSearchCursor(cursor)
+
+
+def search(table, columns, terms, cursor=None, limit=DEFAULT_SEARCH_LIMIT, candidates=DEFAULT_SEARCH_CANDIDATES):
+    # Ranked best-first (higher score is better on both backends), paginated on (score, id). Only the
+    # `candidates` newest matches are scored at a time; ranking every match of a common term costs
+    # O(matches). Once a window runs out, paging continues with the next `candidates` older matches.
+    dialect = dialect_name()
+    params = {'limit': limit + 1, 'candidates': candidates, 'top': None}
+    conditions = [LIVE_ROWS[table]]
+    if cursor:
+        params['score'], params['after_id'], params['top'] = decode_search_cursor(cursor)
+        conditions.append('(hits.score < :score OR (hits.score = :score AND hits.id > :after_id))')
+    # The first page pins the window at the newest id; SQLite and PostgreSQL evaluate this subquery once.
+    top = f'coalesce(:top, (SELECT max(id) FROM {table}))'
+    if dialect == 'sqlite':
+        # FTS5 walks a rowid range without scoring it, so the window is found first and bm25 runs inside it.
+        floor = (f'SELECT min(rowid) FROM (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH :query AND rowid <= {top} '
+                 f'ORDER BY rowid DESC LIMIT :candidates)')
+        hits = (f'SELECT rowid AS id, -bm25({table}_fts) AS score FROM {table}_fts '
+                f'WHERE {table}_fts MATCH :query AND rowid BETWEEN ({floor}) AND {top}')
+        below = f'SELECT max(rowid) FROM {table}_fts WHERE {table}_fts MATCH :query AND rowid < ({floor})'
+        params['query'] = sqlite_match(terms)
+    elif dialect == 'postgresql':
+        matches = f"FROM {table} WHERE search_vector @@ to_tsquery('simple', :query)"
+        window = f'SELECT id {matches} AND id <= {top} ORDER BY id DESC LIMIT :candidates'
+        hits = f"SELECT id, ts_rank(search_vector, to_tsquery('simple', :query)) AS score FROM {table} WHERE id IN ({window})"
+        below = f'SELECT max(id) {matches} AND id < (SELECT min(id) FROM ({window}) AS candidates)'
+        params['query'] = postgres_tsquery(terms)
+    else:
+        raise UnsupportedSearch(dialect)
+    select_list = ', '.join(f'{table}.{column}' for column in columns)
+
+    def page(conditions):
+        return db.session.execute(text(
+            f'SELECT {select_list}, hits.score AS score, {top} AS top FROM ({hits}) AS hits JOIN {table} ON {table}.id = hits.id '
+            f"WHERE {' AND '.join(conditions)} ORDER BY hits.score DESC, hits.id ASC LIMIT :limit"
+        ), params).all()
+
+    rows = page(conditions)
+    while len(rows) <= limit:
+        # This window is used up: the newest older match tops the next one, ranked on its own.
+        params['top'] = db.session.execute(text(below), params).scalar()
+        if params['top'] is None:
+            break
+        params['limit'] = limit + 1 - len(rows)
+        rows += page(conditions[:1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_search_cursor(rows[-1].score, rows[-1].id, rows[-1].top)
+    return rows, next_cursor
@@ -0,0 +1,149 @@
+from flask.json.provider import DefaultJSONProvider
+from models import Comment, Like, Post, User
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Schema:
+    # Field name -> (column, formatter). Works on ORM objects and on Rows from column-only selects alike.
+    def __init__(self, fields, required=('id', 'created_at')):
+        self.fields = fields
+        self.default = tuple(fields)
+        self.required = required
+        self._dumpers = {}
+
+    def parse_fields(self, value):
+        if not value:
+            return self.default
+        names = {name.strip() for name in value.split(',') if name.strip()}
+        unknown = sorted(names.difference(self.fields))
+        if unknown or not names:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(self.default)}")
+        return self.normalize(names)
+
+    def normalize(self, names):
+        # Schema order, so every ordering a client can send maps to one dumper: at most one per subset of fields.
+        return tuple(name for name in self.default if name in names)
+
+    def columns(self, names=None):
+        # The requested columns plus the ones keyset pagination needs, in a stable order.
+        names = dict.fromkeys((*(names or self.default), *self.required))
+        return tuple(self.fields[name][0] for name in names)
+
+    def dumper(self, names=None):
+        names = names or self.default
+        dump = self._dumpers.get(names)
+        if dump is None:
+            names = self.normalize(names)
+            dump = self._dumpers.get(names)
+            if dump is None:
+                dump = self._dumpers[names] = self._compile(names)
+        return dump
+
+    def _compile(self, names):
+        # Builds the dict display a hand-written serializer would use, one attribute load per field, the way
+        # namedtuple and dataclasses generate code. Names come from the schema, never from the request.
+        namespace = {}
+        items = []
+        for name in names:
+            column, formatter = self.fields[name]
+            value = f'obj.{column.key}'
+            if formatter:
+                namespace[f'format_{name}'] = formatter
+                value = f'format_{name}({value})'
+            items.append(f'{name!r}: {value}')
+        return eval(f"lambda obj: {{{', '.join(items)}}}", namespace)
+
+    def dump(self, obj, names=None):
+        return self.dumper(names)(obj)
+
+    def dump_many(self, objs, names=None):
+        return list(map(self.dumper(names), objs))
+
+    def project(self, data, names=None):
+        if not names or names == self.default:
+            return data
+        return {name: data[name] for name in names}
+
+
+post_schema = Schema({
+    'id': (Post.id, None),
+    'title': (Post.title, None),
+    'content': (Post.content, None),
+    'media_url': (Post.media_url, None),
+    'user_id': (Post.user_id, None),
+    'likes_count': (Post.likes_count, None),
+    'comments_count': (Post.comments_count, None),
+    'created_at': (Post.created_at, str),
+    'updated_at': (Post.updated_at, str),
+})
+
+comment_schema = Schema({
+    'id': (Comment.id, None),
+    'post_id': (Comment.post_id, None),
+    'user_id': (Comment.user_id, None),
+    'content': (Comment.content, None),
+    'created_at': (Comment.created_at, str),
+    'updated_at': (Comment.updated_at, str),
+})
+
+like_schema = Schema({
+    'id': (Like.id, None),
+    'post_id': (Like.post_id, None),
+    'user_id': (Like.user_id, None),
+    'created_at': (Like.created_at, str),
+})
+
+user_schema = Schema({
+    'id': (User.id, None),
+    'first_name': (User.first_name, None),
+    'last_name': (User.last_name, None),
+    'email': (User.email, None),
+    'date_of_birth': (User.date_of_birth, str),
+    'gender': (User.gender, None),
+    'followers_count': (User.followers_count, None),
+    'following_count': (User.following_count, None),
+    'created_at': (User.created_at, str),
+    'updated_at': (User.updated_at, str),
+})
+
+# Public subset of a user, embedded as a post's author.
+author_schema = Schema({
+    'id': (User.id, None),
+    'first_name': (User.first_name, None),
+    'last_name': (User.last_name, None),
+}, required=('id',))
+
+
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Same behaviour as Flask's provider, but encodes with orjson and skips the str round trip for responses.
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS) + b'\n',
+            mimetype=self.mimetype,
+        )
+
+
+def init_json(app):
+    app.config.setdefault('JSON_PROVIDER', 'default')
+    if app.config['JSON_PROVIDER'] == 'orjson':
+        if orjson is None:
+            raise RuntimeError("JSON_PROVIDER = 'orjson' requires `pip install orjson`")
+        app.json = OrjsonProvider(app)
@@ -0,0 +1,109 @@
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import delete, exists, insert, literal, select
+from models import db, Follow, Post, TimelineEntry, User
+from pagination import apply_keyset, encode_cursor
+
+DEFAULT_FANOUT_LIMIT = 10000
+BACKFILL_POSTS = 50
+TIMELINE_COLUMNS = ('user_id', 'post_id', 'author_id', 'created_at')
+
+
+def fanout_limit():
+    return current_app.config.get('TIMELINE_FANOUT_LIMIT', DEFAULT_FANOUT_LIMIT)
+
+
+def celebrity_ids():
+    # Authors above the fan-out limit are merged in at read time instead of being copied into timelines.
+    return select(User.id).where(User.followers_count >= fanout_limit())
+
+
+def fan_out_post(post):
+    fan_out_posts(post.user_id, [post.id])
+
+
+def fan_out_posts(author_id, post_ids):
+    # Expects flushed posts. The author sees their own posts immediately; copies for followers are
+    # made by deliver_to_followers once the post_created event is processed.
+    if not post_ids:
+        return
+    db.session.execute(insert(TimelineEntry).from_select(
+        TIMELINE_COLUMNS,
+        select(Post.user_id, Post.id, Post.user_id, Post.created_at).where(Post.id.in_(post_ids)),
+    ))
+
+
+def deliver_to_followers(events):
+    # post_created handler. Idempotent: retries and posts already backfilled by a new follow are skipped.
+    post_ids = defaultdict(list)
+    for payload in events:
+        post_ids[payload['user_id']].append(payload['post_id'])
+    limit = fanout_limit()
+    for author_id, ids in post_ids.items():
+        followers_count = db.session.execute(select(User.followers_count).where(User.id == author_id)).scalar()
+        if not followers_count or followers_count >= limit:
+            continue
+        db.session.execute(insert(TimelineEntry).from_select(
+            TIMELINE_COLUMNS,
+            select(Follow.follower_id, Post.id, Post.user_id, Post.created_at)
+            .join(Post, Post.user_id == Follow.followed_id)
+            .where(Follow.followed_id == author_id, Post.id.in_(ids), Post.live())
+            .where(~exists().where(TimelineEntry.user_id == Follow.follower_id, TimelineEntry.post_id == Post.id)),
+        ))
+
+
+def init_timeline(bus):
+    bus.subscribe('post_created', deliver_to_followers)
+
+
+def follow(follower_id, followed_id):
+    if not Follow.insert_ignore(follower_id, followed_id):
+        return False
+    User.adjust_counter(follower_id, 'following_count', 1)
+    User.adjust_counter(followed_id, 'followers_count', 1)
+    followers_count = db.session.execute(select(User.followers_count).where(User.id == followed_id)).scalar()
+    if followers_count < fanout_limit():
+        recent = (
+            select(literal(follower_id), Post.id, Post.user_id, Post.created_at)
+            .where(Post.user_id == followed_id, Post.live())
+            .where(~exists().where(TimelineEntry.user_id == follower_id, TimelineEntry.post_id == Post.id))
+            .order_by(Post.created_at.desc(), Post.id.desc())
+            .limit(BACKFILL_POSTS)
+        )
+        db.session.execute(insert(TimelineEntry).from_select(TIMELINE_COLUMNS, recent))
+    return True
+
+
+def unfollow(follower_id, followed_id):
+    if not Follow.delete_for(follower_id, followed_id):
+        return False
+    User.adjust_counter(follower_id, 'following_count', -1)
+    User.adjust_counter(followed_id, 'followers_count', -1)
+    db.session.execute(delete(TimelineEntry).where(TimelineEntry.user_id == follower_id, TimelineEntry.author_id == followed_id))
+    return True
+
+
+def home_feed(user_id, columns, cursor=None, limit=20):
+    # One indexed range scan over the user's materialized timeline, plus one over posts by the
+    # (few) followed celebrities; neither grows with the number of accounts the user follows.
+    materialized = (
+        select(*columns)
+        .join(TimelineEntry, TimelineEntry.post_id == Post.id)
+        .where(TimelineEntry.user_id == user_id, Post.live())
+    )
+    rows = db.session.execute(
+        apply_keyset(materialized, (TimelineEntry.created_at, TimelineEntry.post_id), cursor).limit(limit + 1)
+    ).all()
+    followed_celebrities = select(Follow.followed_id).where(
+        Follow.follower_id == user_id, Follow.followed_id.in_(celebrity_ids())
+    )
+    rows += db.session.execute(
+        apply_keyset(select(*columns).where(Post.user_id.in_(followed_celebrities), Post.live()), Post, cursor).limit(limit + 1)
+    ).all()
+    merged = {row.id: row for row in rows}
+    page = sorted(merged.values(), key=lambda row: (row.created_at, row.id), reverse=True)[:limit + 1]
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1].created_at, page[-1].id)
+    return page, next_cursor